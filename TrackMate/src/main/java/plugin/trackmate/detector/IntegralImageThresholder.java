@@ -0,0 +1,130 @@
+package plugin.trackmate.detector;
+
+import ij.process.ByteProcessor;
+import ij.process.ImageProcessor;
+
+/**
+ * Local thresholding built on summed-area (integral) images. The sum and the
+ * sum of squares of the pixels are accumulated once, after which the mean and
+ * standard deviation of any rectangular window take four lookups, so the cost
+ * per pixel does not depend on the window radius.
+ * <p>
+ * Supported methods:
+ * <ul>
+ * <li>{@link #LOCAL_MEAN}: a pixel is foreground if it differs from the
+ * window mean by more than <code>k</code> times the window standard deviation.
+ * <li>{@link #SAUVOLA}: a pixel is foreground if it is above
+ * <code>mean * (1 + k * (stdDev / r - 1))</code>.
+ * </ul>
+ * Windows are clipped at the image border.
+ */
+public class IntegralImageThresholder
+{
+
+	/** Threshold method name for windowed mean thresholding. */
+	public static final String LOCAL_MEAN = "LocalMean";
+
+	/** Threshold method name for Sauvola thresholding. */
+	public static final String SAUVOLA = "Sauvola";
+
+	/**
+	 * Returns whether the given method name is one of the local thresholding
+	 * methods of this class.
+	 */
+	public static boolean isLocalMethod( final String method )
+	{
+		return LOCAL_MEAN.equals( method ) || SAUVOLA.equals( method );
+	}
+
+	/**
+	 * Threshold an image with a local threshold.
+	 *
+	 * @param ip
+	 *            the image to threshold, is not modified.
+	 * @param method
+	 *            {@link #LOCAL_MEAN} or {@link #SAUVOLA}.
+	 * @param radius
+	 *            the window radius in pixels, windows are
+	 *            <code>2 * radius + 1</code> pixels wide.
+	 * @param k
+	 *            the weight of the window standard deviation.
+	 * @param r
+	 *            the dynamic range of the standard deviation, only used by
+	 *            {@link #SAUVOLA}.
+	 * @param above
+	 *            if true, foreground is above the local threshold, otherwise
+	 *            it is below.
+	 * @return a mask where foreground pixels are 255 and background pixels
+	 *         are 0.
+	 */
+	public static ByteProcessor threshold( final ImageProcessor ip, final String method, final int radius,
+			final double k, final double r, final boolean above )
+	{
+		if ( !isLocalMethod( method ) ) { throw new IllegalArgumentException( "Unknown local threshold method: " + method ); }
+		final boolean sauvola = SAUVOLA.equals( method );
+
+		final int width = ip.getWidth();
+		final int height = ip.getHeight();
+		final int stride = width + 1;
+
+		// Row 0 and column 0 of the tables are zero, so window sums need no
+		// special cases at the image border
+		final double[] sum = new double[ stride * ( height + 1 ) ];
+		final double[] sumSq = new double[ stride * ( height + 1 ) ];
+		for ( int y = 0; y < height; y++ )
+		{
+			double rowSum = 0;
+			double rowSumSq = 0;
+			for ( int x = 0; x < width; x++ )
+			{
+				final double v = ip.getf( x, y );
+				rowSum += v;
+				rowSumSq += v * v;
+				final int i = ( y + 1 ) * stride + x + 1;
+				sum[ i ] = sum[ i - stride ] + rowSum;
+				sumSq[ i ] = sumSq[ i - stride ] + rowSumSq;
+			}
+		}
+
+		final ByteProcessor mask = new ByteProcessor( width, height );
+		final byte[] maskPixels = ( byte[] ) mask.getPixels();
+		for ( int y = 0; y < height; y++ )
+		{
+			final int y0 = Math.max( 0, y - radius );
+			final int y1 = Math.min( height, y + radius + 1 );
+			for ( int x = 0; x < width; x++ )
+			{
+				final int x0 = Math.max( 0, x - radius );
+				final int x1 = Math.min( width, x + radius + 1 );
+				final double n = ( x1 - x0 ) * ( y1 - y0 );
+
+				final int i00 = y0 * stride + x0;
+				final int i01 = y0 * stride + x1;
+				final int i10 = y1 * stride + x0;
+				final int i11 = y1 * stride + x1;
+				final double mean = ( sum[ i11 ] - sum[ i01 ] - sum[ i10 ] + sum[ i00 ] ) / n;
+				final double meanSq = ( sumSq[ i11 ] - sumSq[ i01 ] - sumSq[ i10 ] + sumSq[ i00 ] ) / n;
+				final double stdDev = Math.sqrt( Math.max( 0, meanSq - mean * mean ) );
+
+				final double localThreshold;
+				if ( sauvola )
+				{
+					localThreshold = mean * ( 1 + k * ( stdDev / r - 1 ) );
+				}
+				else
+				{
+					localThreshold = above ? mean + k * stdDev : mean - k * stdDev;
+				}
+
+				final double v = ip.getf( x, y );
+				final boolean foreground = above ? v > localThreshold : v < localThreshold;
+				if ( foreground )
+				{
+					maskPixels[ y * width + x ] = ( byte ) 255;
+				}
+			}
+		}
+		return mask;
+	}
+
+}
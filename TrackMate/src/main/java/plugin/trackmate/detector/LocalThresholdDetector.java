@@ -0,0 +1,80 @@
+package plugin.trackmate.detector;
+
+import ij.IJ;
+import ij.ImagePlus;
+import ij.process.ByteProcessor;
+import ij.process.ImageProcessor;
+import net.imglib2.Interval;
+import net.imglib2.RandomAccessible;
+import net.imglib2.img.Img;
+import net.imglib2.img.display.imagej.ImageJFunctions;
+import net.imglib2.type.NativeType;
+import net.imglib2.type.numeric.RealType;
+
+/**
+ * A {@link ThresholdDetector} that creates its binary mask with a local
+ * threshold, computed with {@link IntegralImageThresholder}. Particle
+ * detection and measurement are the same as for the {@link ThresholdDetector}.
+ */
+public class LocalThresholdDetector< T extends RealType< T > & NativeType< T >> extends ThresholdDetector< T >
+{
+
+	/*
+	 * FIELDS
+	 */
+
+	private final static String BASE_ERROR_MESSAGE = "LocalThresholdDetector: ";
+
+	protected int radius;
+
+	protected double k;
+
+	protected double r;
+
+	/*
+	 * CONSTRUCTOR
+	 */
+
+	public LocalThresholdDetector( final RandomAccessible< T > img, final Interval interval, final double[] calibration,
+			int frame, boolean above, String thresholdMethod, int radius, double k, double r)
+	{
+		super(img, interval, calibration, null, frame, above, thresholdMethod);
+		this.baseErrorMessage = BASE_ERROR_MESSAGE;
+		this.radius = radius;
+		this.k = k;
+		this.r = r;
+	}
+
+	/*
+	 * METHODS
+	 */
+
+	@Override
+	public boolean checkInput()
+	{
+		if (!IntegralImageThresholder.isLocalMethod(thresholdMethod))
+		{
+			errorMessage = baseErrorMessage + "Unknown local threshold method: " + thresholdMethod;
+			return false;
+		}
+		return super.checkInput();
+	}
+
+	@Override
+	protected ImagePlus createBinaryMask(Img<T> inputImg)
+	{
+		ImagePlus origImg = ImageJFunctions.wrap(inputImg, "Original");
+		ByteProcessor mask = IntegralImageThresholder.threshold(origImg.getProcessor(), thresholdMethod, radius, k, r, above);
+
+		// Detect particles in the foreground (255) pixels, regardless of the
+		// LUT and the black background preference
+		mask.setThreshold(255, 255, ImageProcessor.NO_LUT_UPDATE);
+		ImagePlus binaryMask = new ImagePlus("Binary Mask", mask);
+
+		if (isDebug()) {
+			IJ.save(binaryMask, getDebugPath() + "/localThresh_fr" + frame + ".png");
+		}
+		return binaryMask;
+	}
+
+}
@@ -0,0 +1,140 @@
+package plugin.trackmate.detector;
+
+import static plugin.trackmate.detector.ThresholdDetectorKeys.KEY_THRESHOLD_METHOD;
+import static plugin.trackmate.detector.ThresholdDetectorKeys.KEY_ABOVE;
+import static plugin.trackmate.detector.ThresholdDetectorKeys.KEY_LOCAL_RADIUS;
+import static plugin.trackmate.detector.ThresholdDetectorKeys.DEFAULT_LOCAL_RADIUS;
+import static plugin.trackmate.detector.ThresholdDetectorKeys.KEY_LOCAL_K;
+import static plugin.trackmate.detector.ThresholdDetectorKeys.DEFAULT_LOCAL_K;
+import static plugin.trackmate.detector.ThresholdDetectorKeys.KEY_LOCAL_R;
+import static plugin.trackmate.detector.ThresholdDetectorKeys.DEFAULT_LOCAL_R;
+import static fiji.plugin.trackmate.gui.TrackMateWizard.FONT;
+
+import java.util.HashMap;
+import java.util.Map;
+
+import javax.swing.JLabel;
+import javax.swing.JTextField;
+import javax.swing.SpringLayout;
+import javax.swing.SwingConstants;
+
+import fiji.plugin.trackmate.Model;
+import fiji.plugin.trackmate.Settings;
+import fiji.plugin.trackmate.detection.SpotDetectorFactory;
+import fiji.plugin.trackmate.gui.panels.components.JNumericTextField;
+import fiji.util.NumberParser;
+
+/**
+ * Configuration panel for the {@link LocalThresholdDetectorFactory}. The
+ * local threshold has no global threshold value, so the threshold field is
+ * replaced by the window radius and the weights of the local threshold.
+ */
+public class LocalThresholdDetectorConfigurationPanel extends ThresholdDetectorConfigurationPanel {
+
+	private static final long serialVersionUID = 1L;
+
+	private static final String TOOLTIP_LOCAL_RADIUS = "<html>" + "Radius in pixels of the window the local <br>" + "mean and standard deviation are computed over.</html>";
+
+	private static final String TOOLTIP_LOCAL_K = "<html>" + "Weight of the window standard deviation <br>" + "in the local threshold.</html>";
+
+	private static final String TOOLTIP_LOCAL_R = "<html>" + "Dynamic range of the standard deviation, <br>" + "only used by the Sauvola method.</html>";
+
+	protected JTextField jTextFieldLocalRadius;
+
+	protected JTextField jTextFieldLocalK;
+
+	protected JTextField jTextFieldLocalR;
+
+	/*
+	 * CONSTRUCTOR
+	 */
+
+	public LocalThresholdDetectorConfigurationPanel( final Settings settings, final Model model, final String infoText, final String detectorName )
+	{
+		super( settings, model, infoText, detectorName );
+	}
+
+	/*
+	 * METHODS
+	 */
+
+	@Override
+	public Map< String, Object > getSettings()
+	{
+		final HashMap< String, Object > lSettings = new HashMap< >( 5 );
+		lSettings.put( KEY_THRESHOLD_METHOD, jTextFieldThresholdMethod.getText() );
+		lSettings.put( KEY_ABOVE, Boolean.parseBoolean( jTextFieldThresholdAbove.getText() ) );
+		lSettings.put( KEY_LOCAL_RADIUS, ( int ) NumberParser.parseDouble( jTextFieldLocalRadius.getText() ) );
+		lSettings.put( KEY_LOCAL_K, NumberParser.parseDouble( jTextFieldLocalK.getText() ) );
+		lSettings.put( KEY_LOCAL_R, NumberParser.parseDouble( jTextFieldLocalR.getText() ) );
+		return lSettings;
+	}
+
+	@Override
+	public void setSettings( final Map< String, Object > settings )
+	{
+		super.setSettings( settings );
+		if (settings.containsKey(KEY_LOCAL_RADIUS)) {
+			jTextFieldLocalRadius.setText("" + settings.get( KEY_LOCAL_RADIUS));
+		} else {
+			jTextFieldLocalRadius.setText(Integer.toString(DEFAULT_LOCAL_RADIUS));
+		}
+		if (settings.containsKey(KEY_LOCAL_K)) {
+			jTextFieldLocalK.setText("" + settings.get( KEY_LOCAL_K));
+		} else {
+			jTextFieldLocalK.setText(Double.toString(DEFAULT_LOCAL_K));
+		}
+		if (settings.containsKey(KEY_LOCAL_R)) {
+			jTextFieldLocalR.setText("" + settings.get( KEY_LOCAL_R));
+		} else {
+			jTextFieldLocalR.setText(Double.toString(DEFAULT_LOCAL_R));
+		}
+	}
+
+	@Override
+	@SuppressWarnings( "rawtypes" )
+	protected SpotDetectorFactory< ? > getDetectorFactory()
+	{
+		return new LocalThresholdDetectorFactory();
+	}
+
+	@Override
+	protected void initGUI()
+	{
+		super.initGUI();
+		// There is no global threshold to set
+		remove( jLabelThreshold );
+		remove( jTextFieldThreshold );
+		jTextFieldLocalRadius = addField( "Local radius:", TOOLTIP_LOCAL_RADIUS, 279+16 );
+		jTextFieldLocalK = addField( "Local k:", TOOLTIP_LOCAL_K, 279+32 );
+		jTextFieldLocalR = addField( "Local R:", TOOLTIP_LOCAL_R, 279+48 );
+	}
+
+	/**
+	 * Add a labeled numeric field below the threshold fields, at the given
+	 * offset from the top of the panel.
+	 */
+	private JTextField addField( final String labelText, final String toolTip, final int top )
+	{
+		final JLabel label = new JLabel();
+		label.setToolTipText( toolTip );
+		layout.putConstraint( SpringLayout.NORTH, label, top, SpringLayout.NORTH, this );
+		layout.putConstraint( SpringLayout.WEST, label, 16, SpringLayout.WEST, this );
+		this.add( label );
+		label.setText( labelText );
+		label.setFont( FONT );
+
+		final JTextField field = new JNumericTextField();
+		field.setToolTipText( toolTip );
+		layout.putConstraint( SpringLayout.EAST, label, -6, SpringLayout.WEST, field );
+		layout.putConstraint( SpringLayout.WEST, field, 168, SpringLayout.WEST, this );
+		layout.putConstraint( SpringLayout.NORTH, field, top, SpringLayout.NORTH, this );
+		layout.putConstraint( SpringLayout.SOUTH, field, top + 16, SpringLayout.NORTH, this );
+		field.setHorizontalAlignment( SwingConstants.CENTER );
+		field.setColumns( 6 );
+		this.add( field );
+		field.setFont( FONT );
+		return field;
+	}
+
+}
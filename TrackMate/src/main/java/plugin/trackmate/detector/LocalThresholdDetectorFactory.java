@@ -0,0 +1,212 @@
+package plugin.trackmate.detector;
+
+import static plugin.trackmate.detector.ThresholdDetectorKeys.KEY_ABOVE;
+import static plugin.trackmate.detector.ThresholdDetectorKeys.DEFAULT_ABOVE;
+import static plugin.trackmate.detector.ThresholdDetectorKeys.KEY_THRESHOLD_METHOD;
+import static plugin.trackmate.detector.ThresholdDetectorKeys.KEY_DEBUG_MODE;
+import static plugin.trackmate.detector.ThresholdDetectorKeys.DEFAULT_DEBUG_MODE;
+import static plugin.trackmate.detector.ThresholdDetectorKeys.KEY_DEBUG_OUTPATH;
+import static plugin.trackmate.detector.ThresholdDetectorKeys.KEY_LOCAL_RADIUS;
+import static plugin.trackmate.detector.ThresholdDetectorKeys.DEFAULT_LOCAL_RADIUS;
+import static plugin.trackmate.detector.ThresholdDetectorKeys.KEY_LOCAL_K;
+import static plugin.trackmate.detector.ThresholdDetectorKeys.DEFAULT_LOCAL_K;
+import static plugin.trackmate.detector.ThresholdDetectorKeys.KEY_LOCAL_R;
+import static plugin.trackmate.detector.ThresholdDetectorKeys.DEFAULT_LOCAL_R;
+import static fiji.plugin.trackmate.util.TMUtils.checkMapKeys;
+import static fiji.plugin.trackmate.io.IOUtils.readBooleanAttribute;
+import static fiji.plugin.trackmate.io.IOUtils.readDoubleAttribute;
+import static fiji.plugin.trackmate.io.IOUtils.readIntegerAttribute;
+import static fiji.plugin.trackmate.io.IOUtils.writeTargetChannel;
+import static fiji.plugin.trackmate.io.IOUtils.writeAttribute;
+
+import java.util.ArrayList;
+import java.util.HashMap;
+import java.util.List;
+import java.util.Map;
+
+import net.imglib2.Interval;
+import net.imglib2.RandomAccessible;
+import net.imglib2.type.NativeType;
+import net.imglib2.type.numeric.RealType;
+
+import org.jdom2.Element;
+import org.scijava.plugin.Plugin;
+
+import fiji.plugin.trackmate.Model;
+import fiji.plugin.trackmate.Settings;
+import fiji.plugin.trackmate.detection.SpotDetector;
+import fiji.plugin.trackmate.detection.SpotDetectorFactory;
+import fiji.plugin.trackmate.gui.ConfigurationPanel;
+import fiji.plugin.trackmate.util.TMUtils;
+
+@Plugin( type = SpotDetectorFactory.class )
+public class LocalThresholdDetectorFactory< T extends RealType< T > & NativeType< T >> extends ThresholdDetectorFactory< T >
+{
+
+	/*
+	 * CONSTANTS
+	 */
+
+	/** A string key identifying this factory. */
+	public static final String THIS_DETECTOR_KEY = "LOCAL_THRESHOLD_DETECTOR";
+
+	/** The pretty name of the target detector. */
+	public static final String THIS_NAME = "Local Threshold detector";
+
+	/** An html information text. */
+	public static final String THIS_INFO_TEXT = "<html>" + "This segmenter is based on local image thresholding <br> " + "to create a binary mask. The threshold of each pixel is computed from the mean <br> " + "and standard deviation of a window around it (LocalMean or Sauvola), and blobs <br> " + "are detected in the binary mask. </html>";
+
+	/*
+	 * METHODS
+	 */
+
+	@Override
+	public SpotDetector< T > getDetector( final Interval interval, final int frame )
+	{
+		boolean above = DEFAULT_ABOVE;
+		if (settings.containsKey(KEY_ABOVE)) {
+			above = (Boolean)settings.get( KEY_ABOVE );
+		}
+		final String thresholdMethod = (String)settings.get( KEY_THRESHOLD_METHOD );
+		int radius = DEFAULT_LOCAL_RADIUS;
+		if (settings.containsKey(KEY_LOCAL_RADIUS)) {
+			radius = ((Number)settings.get( KEY_LOCAL_RADIUS )).intValue();
+		}
+		double k = DEFAULT_LOCAL_K;
+		if (settings.containsKey(KEY_LOCAL_K)) {
+			k = ((Number)settings.get( KEY_LOCAL_K )).doubleValue();
+		}
+		double r = DEFAULT_LOCAL_R;
+		if (settings.containsKey(KEY_LOCAL_R)) {
+			r = ((Number)settings.get( KEY_LOCAL_R )).doubleValue();
+		}
+
+		final RandomAccessible< T > imFrame = prepareFrameImg( frame );
+		final double[] calibration = TMUtils.getSpatialCalibration( img );
+		final LocalThresholdDetector< T > detector = new LocalThresholdDetector<>(imFrame, interval, calibration, frame, above, thresholdMethod, radius, k, r);
+
+		// Enable debug mode, if set.  The debug outpath is validated by
+		// checkSettings.
+		if (settings.containsKey(KEY_DEBUG_MODE) && (Boolean)settings.get(KEY_DEBUG_MODE)) {
+			detector.setDebugMode(true);
+			detector.setDebugPath((String)settings.get(KEY_DEBUG_OUTPATH));
+		}
+
+		return detector;
+	}
+
+	@Override
+	public String getKey()
+	{
+		return THIS_DETECTOR_KEY;
+	}
+
+	@Override
+	public String getName()
+	{
+		return THIS_NAME;
+	}
+
+	@Override
+	public String getInfoText()
+	{
+		return THIS_INFO_TEXT;
+	}
+
+	@Override
+	public boolean marshall( final Map< String, Object > lSettings, final Element element )
+	{
+		final StringBuilder errorHolder = new StringBuilder();
+		// The local params are optional, so missing ones are written with
+		// the values the detector uses for them
+		final Map< String, Object > allSettings = getDefaultSettings();
+		allSettings.putAll( lSettings );
+		final boolean ok = writeTargetChannel( lSettings, element, errorHolder )
+				&& writeAttribute( lSettings, element, KEY_ABOVE, Boolean.class, errorHolder )
+				&& writeAttribute( lSettings, element, KEY_THRESHOLD_METHOD, String.class, errorHolder )
+				&& writeAttribute( allSettings, element, KEY_LOCAL_RADIUS, Integer.class, errorHolder )
+				&& writeAttribute( allSettings, element, KEY_LOCAL_K, Double.class, errorHolder )
+				&& writeAttribute( allSettings, element, KEY_LOCAL_R, Double.class, errorHolder );
+		if ( !ok )
+		{
+			errorMessage = errorHolder.toString();
+		}
+		return ok;
+	}
+
+	@Override
+	public boolean unmarshall( final Element element, final Map< String, Object > lSettings )
+	{
+		lSettings.clear();
+		final StringBuilder errorHolder = new StringBuilder();
+		boolean ok = true;
+		ok = ok & readBooleanAttribute( element, lSettings, KEY_ABOVE, errorHolder );
+		ok = ok & readIntegerAttribute( element, lSettings, KEY_LOCAL_RADIUS, errorHolder );
+		ok = ok & readDoubleAttribute( element, lSettings, KEY_LOCAL_K, errorHolder );
+		ok = ok & readDoubleAttribute( element, lSettings, KEY_LOCAL_R, errorHolder );
+		if ( !ok )
+		{
+			errorMessage = errorHolder.toString();
+			return false;
+		}
+		String thresholdMethod = element.getAttributeValue( KEY_THRESHOLD_METHOD );
+		if ( null == thresholdMethod )
+		{
+			thresholdMethod = IntegralImageThresholder.SAUVOLA;
+		}
+		lSettings.put( KEY_THRESHOLD_METHOD, thresholdMethod );
+		return checkSettings( lSettings );
+	}
+
+	@Override
+	public ConfigurationPanel getDetectorConfigurationPanel( final Settings lSettings, final Model model )
+	{
+		return new LocalThresholdDetectorConfigurationPanel( lSettings, model, THIS_INFO_TEXT, THIS_NAME );
+	}
+
+	@Override
+	public boolean checkSettings( final Map< String, Object > lSettings )
+	{
+		boolean ok = true;
+		final StringBuilder errorHolder = new StringBuilder();
+		final List< String > mandatoryKeys = new ArrayList<>();
+		mandatoryKeys.add( KEY_THRESHOLD_METHOD );
+		final List< String > optionalKeys = new ArrayList<>();
+		optionalKeys.add( KEY_ABOVE );
+		optionalKeys.add( KEY_LOCAL_RADIUS );
+		optionalKeys.add( KEY_LOCAL_K );
+		optionalKeys.add( KEY_LOCAL_R );
+		optionalKeys.add( KEY_DEBUG_MODE );
+		optionalKeys.add( KEY_DEBUG_OUTPATH );
+		ok = ok & checkMapKeys( lSettings, mandatoryKeys, optionalKeys, errorHolder );
+		if ( ok && !IntegralImageThresholder.isLocalMethod( ( String ) lSettings.get( KEY_THRESHOLD_METHOD ) ) )
+		{
+			errorHolder.append( "Unknown local threshold method: " + lSettings.get( KEY_THRESHOLD_METHOD ) + "\n" );
+			ok = false;
+		}
+		if ( lSettings.containsKey( KEY_DEBUG_MODE ) && ( Boolean ) lSettings.get( KEY_DEBUG_MODE )
+				&& !lSettings.containsKey( KEY_DEBUG_OUTPATH ) )
+		{
+			errorHolder.append( "Debug mode set but not debug outpath is specified!\n" );
+			ok = false;
+		}
+		if ( !ok )
+		{
+			errorMessage = errorHolder.toString();
+		}
+		return ok;
+	}
+
+	@Override
+	public Map<String, Object> getDefaultSettings() {
+		final Map< String, Object > lSettings = new HashMap<>();
+		lSettings.put( KEY_THRESHOLD_METHOD, IntegralImageThresholder.SAUVOLA );
+		lSettings.put( KEY_ABOVE, DEFAULT_ABOVE );
+		lSettings.put( KEY_LOCAL_RADIUS, DEFAULT_LOCAL_RADIUS );
+		lSettings.put( KEY_LOCAL_K, DEFAULT_LOCAL_K );
+		lSettings.put( KEY_LOCAL_R, DEFAULT_LOCAL_R );
+		lSettings.put( KEY_DEBUG_MODE, DEFAULT_DEBUG_MODE );
+		return lSettings;
+	}
+
+}
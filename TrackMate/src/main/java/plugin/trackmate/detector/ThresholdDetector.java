@@ -9,13 +9,17 @@ import fiji.plugin.trackmate.detection.DetectionUtils;
 import fiji.plugin.trackmate.detection.SpotDetector;
 import ij.IJ;
 import ij.ImagePlus;
+import ij.gui.Roi;
+import ij.measure.Calibration;
 import ij.measure.Measurements;
 import ij.measure.ResultsTable;
-import ij.plugin.filter.Analyzer;
 import ij.plugin.filter.ParticleAnalyzer;
+import ij.process.ImageProcessor;
+import ij.process.ImageStatistics;
 import net.imglib2.Interval;
 import net.imglib2.RandomAccessible;
 import net.imglib2.RandomAccessibleInterval;
+import net.imglib2.algorithm.MultiThreaded;
 import net.imglib2.algorithm.binary.Thresholder;
 import net.imglib2.algorithm.neighborhood.RectangleShape;
 import net.imglib2.algorithm.neighborhood.Shape;
@@ -29,7 +33,7 @@ import net.imglib2.type.numeric.RealType;
 import net.imglib2.util.Util;
 import net.imglib2.view.Views;
 
-public class ThresholdDetector< T extends RealType< T > & NativeType< T >> implements SpotDetector< T >
+public class ThresholdDetector< T extends RealType< T > & NativeType< T >> implements SpotDetector< T >, MultiThreaded
 {
 
 	/*
@@ -66,6 +70,8 @@ public class ThresholdDetector< T extends RealType< T > & NativeType< T >> imple
 	int frame;
 	
 	protected String thresholdMethod;
+	
+	protected int numThreads;
 
 	/*
 	 * CONSTRUCTOR
@@ -82,6 +88,7 @@ public class ThresholdDetector< T extends RealType< T > & NativeType< T >> imple
 		this.above = above;
 		this.frame = frame;
 		this.thresholdMethod = thresholdMethod;
+		setNumThreads();
 	}
 
 	/*
@@ -116,28 +123,7 @@ public class ThresholdDetector< T extends RealType< T > & NativeType< T >> imple
 		final ImgFactory< T > factory = Util.getArrayOrCellImgFactory( view, type );
 		Img<T> inputImg = ImgView.wrap(view, factory);
 
-		//System.out.println("Thresholding value: " + threshold);
-		T localThreshold = inputImg.firstElement().createVariable();
-		if (threshold.getRealDouble() == 0) {
-			ImagePlus origImg = ImageJFunctions.wrap(inputImg, "Original");
-			origImg.getProcessor().setAutoThreshold(thresholdMethod);
-			String desc = "";
-			if (isDebug() && debugPath != null) {
-				String[] result = debugPath.split(File.separator);
-				desc = result[result.length - 2];
-			}
-			System.out.println("Thresholding (frame, min, max, desc): " + frame + ", " + origImg.getProcessor().getMinThreshold() + ", " + origImg.getProcessor().getMaxThreshold() + ", " + desc);
-			localThreshold.setReal(origImg.getProcessor().getMaxThreshold());
-		} else {
-			localThreshold = threshold;
-		}
-
-		Img<BitType> threshImg = Thresholder.threshold(inputImg, localThreshold, above, 1);
-
-		List<Shape> strels = new ArrayList<Shape>();
-		strels.add(new RectangleShape(3, false));
-		
-		//Img<BitType> closedImg = Closing.close(threshImg, strels, 1);
+		ImagePlus binaryMask = createBinaryMask(inputImg);
 
 		int minSize = 5;
 		double minCircularity = 0.0001;
@@ -148,16 +134,15 @@ public class ThresholdDetector< T extends RealType< T > & NativeType< T >> imple
 				| Measurements.MIN_MAX | Measurements.CENTROID | Measurements.RECT
 				| Measurements.INTEGRATED_DENSITY | Measurements.MEDIAN;
 		*/
-		ParticleAnalyzer pa = new ParticleAnalyzer(paFlags, Measurements.ALL_STATS, table, minSize, Double.POSITIVE_INFINITY, minCircularity, 1.0);
-        
 		ImagePlus origImg = ImageJFunctions.wrap(inputImg, "Original");
-		ImagePlus binaryMask = ImageJFunctions.wrap(threshImg, "Binary Mask");
-		binaryMask.getProcessor().invertLut(); // This is necessary for the mask to match expectations within ParticleAnalyzer
-		
+		// Measurements are taken on the original image by the analyzer itself,
+		// rather than through the static Analyzer redirect image, so frames can
+		// be analyzed concurrently
+		ParticleAnalyzer pa = new RedirectedParticleAnalyzer(origImg, paFlags, Measurements.ALL_STATS, table, minSize, Double.POSITIVE_INFINITY, minCircularity, 1.0);
+        
 		//origImg.show("Orig");
 		//binaryMask.show("Binary Mask");
 		
-		Analyzer.setRedirectImage(origImg);
 		if (!pa.analyze(binaryMask)) {
 			errorMessage = baseErrorMessage + " error with ParticleAnalyzer!";
 			return false;
@@ -199,6 +184,40 @@ public class ThresholdDetector< T extends RealType< T > & NativeType< T >> imple
 		return true;
 	}
 	
+	/**
+	 * Create the binary mask that particles are detected in, by thresholding
+	 * the input image with a single threshold.
+	 */
+	protected ImagePlus createBinaryMask(Img<T> inputImg)
+	{
+		//System.out.println("Thresholding value: " + threshold);
+		T localThreshold = inputImg.firstElement().createVariable();
+		if (threshold.getRealDouble() == 0) {
+			ImagePlus origImg = ImageJFunctions.wrap(inputImg, "Original");
+			origImg.getProcessor().setAutoThreshold(thresholdMethod);
+			String desc = "";
+			if (isDebug() && debugPath != null) {
+				String[] result = debugPath.split(File.separator);
+				desc = result[result.length - 2];
+			}
+			System.out.println("Thresholding (frame, min, max, desc): " + frame + ", " + origImg.getProcessor().getMinThreshold() + ", " + origImg.getProcessor().getMaxThreshold() + ", " + desc);
+			localThreshold.setReal(origImg.getProcessor().getMaxThreshold());
+		} else {
+			localThreshold = threshold;
+		}
+
+		Img<BitType> threshImg = Thresholder.threshold(inputImg, localThreshold, above, numThreads);
+
+		List<Shape> strels = new ArrayList<Shape>();
+		strels.add(new RectangleShape(3, false));
+		
+		//Img<BitType> closedImg = Closing.close(threshImg, strels, 1);
+
+		ImagePlus binaryMask = ImageJFunctions.wrap(threshImg, "Binary Mask");
+		binaryMask.getProcessor().invertLut(); // This is necessary for the mask to match expectations within ParticleAnalyzer
+		return binaryMask;
+	}
+	
 	@Override
 	public List< Spot > getResult()
 	{
@@ -233,4 +252,56 @@ public class ThresholdDetector< T extends RealType< T > & NativeType< T >> imple
 		this.debugPath = debugPath;
 	}
 
+	@Override
+	public void setNumThreads()
+	{
+		this.numThreads = Runtime.getRuntime().availableProcessors();
+	}
+
+	@Override
+	public void setNumThreads( final int numThreads )
+	{
+		this.numThreads = numThreads;
+	}
+
+	@Override
+	public int getNumThreads()
+	{
+		return numThreads;
+	}
+
+	/**
+	 * A {@link ParticleAnalyzer} that measures each particle on a separate
+	 * image, like {@link ij.plugin.filter.Analyzer#setRedirectImage(ImagePlus)}
+	 * does, but without any static state. Particles are still found (and
+	 * filtered by size) on the analyzed mask, only the saved measurements come
+	 * from the redirect image.
+	 */
+	protected static class RedirectedParticleAnalyzer extends ParticleAnalyzer
+	{
+		private final ImageProcessor redirectIP;
+
+		private final Calibration redirectCal;
+
+		private final int redirectMeasurements;
+
+		public RedirectedParticleAnalyzer(ImagePlus redirectImg, int options, int measurements, ResultsTable rt,
+				double minSize, double maxSize, double minCirc, double maxCirc)
+		{
+			super(options, measurements, rt, minSize, maxSize, minCirc, maxCirc);
+			this.redirectIP = redirectImg.getProcessor();
+			this.redirectCal = redirectImg.getCalibration();
+			this.redirectMeasurements = measurements;
+		}
+
+		@Override
+		protected void saveResults(ImageStatistics stats, Roi roi)
+		{
+			redirectIP.setRoi(roi);
+			ImageStatistics redirectStats = ImageStatistics.getStatistics(redirectIP, redirectMeasurements, redirectCal);
+			redirectIP.resetRoi();
+			super.saveResults(redirectStats, roi);
+		}
+	}
+
 }
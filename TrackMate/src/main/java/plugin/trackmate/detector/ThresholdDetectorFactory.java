@@ -136,13 +136,11 @@ public class ThresholdDetectorFactory< T extends RealType< T > & NativeType< T >
 		final double[] calibration = TMUtils.getSpatialCalibration( img );
 		final ThresholdDetector< T > detector = new ThresholdDetector<>(imFrame, interval, calibration, threshold, frame, above, thresholdMethod);
 
-		// Enable debug mode, if set
+		// Enable debug mode, if set.  The debug outpath is validated by
+		// checkSettings, so this doesn't modify the factory: detectors for
+		// different frames are requested concurrently.
 		if (settings.containsKey(KEY_DEBUG_MODE) && (Boolean)settings.get(KEY_DEBUG_MODE)) {
 			detector.setDebugMode(true);
-			if (!settings.containsKey(KEY_DEBUG_OUTPATH)) {
-				errorMessage = "Debug mode set but not debug outpath is specified!";
-				return null;
-			}
 			detector.setDebugPath((String)settings.get(KEY_DEBUG_OUTPATH));
 		}
 
@@ -220,6 +218,12 @@ public class ThresholdDetectorFactory< T extends RealType< T > & NativeType< T >
 		optionalKeys.add( KEY_DEBUG_MODE );
 		optionalKeys.add( KEY_DEBUG_OUTPATH );
 		ok = ok & checkMapKeys( lSettings, mandatoryKeys, optionalKeys, errorHolder );
+		if ( lSettings.containsKey( KEY_DEBUG_MODE ) && ( Boolean ) lSettings.get( KEY_DEBUG_MODE )
+				&& !lSettings.containsKey( KEY_DEBUG_OUTPATH ) )
+		{
+			errorHolder.append( "Debug mode set but not debug outpath is specified!\n" );
+			ok = false;
+		}
 		if ( !ok )
 		{
 			errorMessage = errorHolder.toString();
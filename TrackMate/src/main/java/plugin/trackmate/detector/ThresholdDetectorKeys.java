@@ -60,5 +60,49 @@ public class ThresholdDetectorKeys
 
 	/** A default value for the {@link #KEY_DEBUG_OUTPATH} parameter. */
 	public static final String DEFAULT_DEBUG_OUTPATH = "/tmp";
+
+	/**
+	 * The key identifying the parameter that sets the window radius, in pixels,
+	 * of the local threshold. Expected values are {@link Integer}s.
+	 * <p>
+	 * Currently used by:
+	 * <ul>
+	 * <li>{@link LocalThresholdDetector}
+	 * </ul>
+	 */
+	public static final String KEY_LOCAL_RADIUS = "LOCAL_RADIUS";
+
+	/** A default value for the {@link #KEY_LOCAL_RADIUS} parameter. */
+	public static final int DEFAULT_LOCAL_RADIUS = 15;
+
+	/**
+	 * The key identifying the parameter that sets the weight of the window
+	 * standard deviation in the local threshold. Expected values are
+	 * {@link Double}s.
+	 * <p>
+	 * Currently used by:
+	 * <ul>
+	 * <li>{@link LocalThresholdDetector}
+	 * </ul>
+	 */
+	public static final String KEY_LOCAL_K = "LOCAL_K";
+
+	/** A default value for the {@link #KEY_LOCAL_K} parameter. */
+	public static final double DEFAULT_LOCAL_K = 0.5;
+
+	/**
+	 * The key identifying the parameter that sets the dynamic range of the
+	 * standard deviation for Sauvola thresholding. Expected values are
+	 * {@link Double}s.
+	 * <p>
+	 * Currently used by:
+	 * <ul>
+	 * <li>{@link LocalThresholdDetector}
+	 * </ul>
+	 */
+	public static final String KEY_LOCAL_R = "LOCAL_R";
+
+	/** A default value for the {@link #KEY_LOCAL_R} parameter. */
+	public static final double DEFAULT_LOCAL_R = 128;
 	
 }
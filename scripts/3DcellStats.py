@@ -16,7 +16,7 @@ import os, glob, re, time, sys
 for path in os.environ['CLASSPATH'].split(os.pathsep):
     sys.path.append(path)
 
-import ELMConfig, ELMImageUtils
+import ELMConfig, ELMImageUtils, ELMStackReader, ELMArrayStore
     
 #
 #
@@ -40,6 +40,11 @@ def printUsage():
     print "            Valid labels: skip, brightfield, red, green, blue, yellow"
     print "chansToSkip - List of channel names that will be skipped if channels are read from XML properties"
     print "analysisRoi - Rectangular area to perform cell detection on, default 0,0,512,480, must be defined in config file"
+    print "memoryMapTiff - Optional, True or False, if True read uncompressed TIFFs through a memory map"
+    print "stackInput - Optional, True or False, if True multi-page and OME-TIFF hyperstacks are read plane by plane, with C, Z and T from their metadata"
+    print "arrayStore - Optional, True or False, if True thresholded masks and grayscale frames are stored in a chunked, compressed store in each well output dir and reused by all scripts"
+    print "arrayStoreChunkSize - Optional, width and height in pixels of the array store chunks, default 512"
+    print "cropToRoi - Optional, True or False, if True crop images to the analysisRoi and exclusion bounds before processing"
     print "wellNames - Optional, list of well names to process, others are ignored"
     print "debugOutput - Optional, True or False, if True output additional info for debugging purposes"
 
@@ -66,6 +71,10 @@ def main(cfg):
     # Sort filenames so they are in order by z and ch
     ELMConfig.sort_nicely(imgFiles)
 
+    # Stacks are replaced by the planes they hold, named like plane files
+    if cfg.hasValue(ELMConfig.stackInput) and cfg.getValue(ELMConfig.stackInput):
+        imgFiles = ELMStackReader.expandStacks(imgFiles, cfg)
+
 # Get the names of all wells that exist in this dataset/plate
     wellNames = []
     # Each well will have a collection of images, but will all fall under the same common prefix descriptor
@@ -256,16 +265,26 @@ def processImages(cfg, wellName, wellPath, c, imgFiles):
         tStr = cfg.getTStr(t)
         for z in range(0, cfg.getValue(ELMConfig.numZ)):
             zStr = cfg.getZStr(z);
-            currIP = IJ.openImage(imgFiles[z][t][0])
-            origImage = currIP.duplicate();
+            currIP, cropOffset = ELMImageUtils.openImage(imgFiles[z][t][0], cfg)
+            # Colors are read from the mapped file when possible, which uses
+            # full frame coordinates, otherwise from a copy of the image
+            origPlane = ELMImageUtils.mapTiffPlane(imgFiles[z][t][0], cfg)
+            if origPlane:
+                origImage = origPlane
+                origOffset = (0, 0)
+            else:
+                origImage = currIP.duplicate();
+                origOffset = cropOffset
             if cfg.getValue(ELMConfig.debugOutput):
                 WindowManager.setTempCurrentImage(currIP);
                 IJ.saveAs('png', os.path.join(wellPath, "Orig_" + wellName + "_" + zStr + "_" + chanStr + ".png"))
                 
             # We need to get to a grayscale image, which will be done differently for different channels
             dbgOutDesc = wellName + "_" + tStr + "_" + zStr + "_" + chanStr
-            currIP = ELMImageUtils.getThresholdedMask(currIP, c, z, 1, chanName, cfg, wellPath, dbgOutDesc)
+            currIP = ELMArrayStore.getStoredMask(cfg, imgFiles[z][t][0], currIP, c, z, t, chanName, wellPath, wellPath, dbgOutDesc, cropOffset)
             if (not currIP) :
+                # The mapped plane holds the file open until it's closed
+                origImage.close()
                 continue
     
             currProcessor = currIP.getProcessor()
@@ -277,10 +296,13 @@ def processImages(cfg, wellName, wellPath, c, imgFiles):
                 for y in range(0,imgHeight) :
                     if not currProcessor.get(x,y) == 0x00000000:
                         ptCount += 1
-                        ptX =  x * cfg.getValue(ELMConfig.pixelWidth)
-                        ptY =  y * cfg.getValue(ELMConfig.pixelHeight)
+                        # Full frame coordinates, in case the image was cropped
+                        frameX = x + cropOffset[0]
+                        frameY = y + cropOffset[1]
+                        ptX =  frameX * cfg.getValue(ELMConfig.pixelWidth)
+                        ptY =  frameY * cfg.getValue(ELMConfig.pixelHeight)
                         ptZ = -z * cfg.getValue(ELMConfig.pixelDepth);
-                        colorPix = origImage.getPixel(x,y)
+                        colorPix = origImage.getPixel(frameX - origOffset[0], frameY - origOffset[1])
                         red   = colorPix[0]
                         green = colorPix[1]
                         blue  = colorPix[2]
@@ -289,7 +311,7 @@ def processImages(cfg, wellName, wellPath, c, imgFiles):
                             or colorPix[chanPixBand] > cfg.getValue(ELMConfig.pcloudColorThresh)
                         # Check that point isn't in exclusion zone
                         outsideExclusion = not (cfg.hasValue(ELMConfig.pcloudExclusionX) and cfg.hasValue(ELMConfig.pcloudExclusionY)) \
-                            or (x < cfg.getValue(ELMConfig.pcloudExclusionX) or y < cfg.getValue(ELMConfig.pcloudExclusionY))
+                            or (frameX < cfg.getValue(ELMConfig.pcloudExclusionX) or frameY < cfg.getValue(ELMConfig.pcloudExclusionY))
     
                         if (aboveColorThresh and outsideExclusion):
                             points.append([ptX, ptY, ptZ, red, green, blue])
@@ -324,7 +346,7 @@ def processImages(cfg, wellName, wellPath, c, imgFiles):
         resultsFile.close()
 
         if numPoints > 0:
-            compute3DStats(cfg, wellPath, wellName, chanName, cloudName, imgWidth, imgHeight)
+            compute3DStats(cfg, wellPath, wellName, chanName, cloudName, imgWidth + cropOffset[0], imgHeight + cropOffset[1])
         else:
             print('Well %s, channel %s (%s) - Skipping 3D stats since we have no points!' % (wellName, chanName, chanStr))
 
@@ -0,0 +1,301 @@
+# Copyright (C) 2011 - 2019, Raytheon BBN Technologies and contributors listed
+# in the AUTHORS file in TASBE Flow Analytics distribution's top directory.
+#
+# This file is part of the TASBE Flow Analytics package, and is distributed
+# under the terms of the GNU General Public License, with a linking
+# exception, as described in the file LICENSE in the TASBE Image Analysis
+# package distribution's top directory.
+
+# A chunked, compressed store of the thresholded masks and grayscale planes of
+# a well, so they can be reused by cellStats, cellStatsTracking and 3DcellStats
+# instead of being recomputed.  The store is a directory in the well's output
+# dir with an array for the masks and one for the grayscale planes.  Each
+# array has dims (c, z, t, y, x) and is split into chunks of one plane and
+# chunkSize x chunkSize pixels, each a gzipped file named c.z.t.y.x by chunk
+# index.  Masks are bit-packed, 8 pixels to a byte, and grayscale planes are
+# 8-bit.  The array's dims are in its .array file, and each stored plane has a
+# c.z.t.plane file, written after its chunks, with the hash of everything that
+# went into it, its offset in the full frame and its size.
+
+from ij import ImagePlus, Prefs
+from ij.process import ByteProcessor
+
+from java.awt.image import BufferedImage
+from java.io import FileInputStream, FileOutputStream, BufferedInputStream, BufferedOutputStream, DataInputStream
+from java.lang import System
+from java.util.zip import GZIPInputStream, GZIPOutputStream
+
+from jarray import zeros
+
+import os, json, threading
+
+import ELMConfig, ELMImageUtils, ELMFrameStack
+
+ARRAY_STORE_DIR = "arrayStore"
+MASK_ARRAY = "masks"
+GRAY_ARRAY = "gray"
+DEFAULT_CHUNK_SIZE = 512
+
+# Params that change the thresholded masks, on top of the grayscale params
+MASK_PARAMS = ELMConfig.GRAYSCALE_PARAMS + [ELMConfig.thresholdMethod, ELMConfig.imageThreshold, ELMConfig.defaultThreshold,
+                                            ELMConfig.maxThreshRange, ELMConfig.localThresholdRadius, ELMConfig.localThresholdK,
+                                            ELMConfig.coarseSegmentation, ELMConfig.coarseSegmentationTolerance]
+
+# Guards the array metadata, which channels processed in parallel share
+metadataLock = threading.Lock()
+
+####
+#
+#  The array store of a well
+#
+####
+class ArrayStore:
+
+    ###
+    #
+    ###
+    def __init__(self, wellPath, cfg):
+        self.path = os.path.join(wellPath, ARRAY_STORE_DIR)
+        self.cfg = cfg
+        chunkSize = DEFAULT_CHUNK_SIZE
+        if cfg.hasValue(ELMConfig.arrayStoreChunkSize):
+            chunkSize = cfg.getValue(ELMConfig.arrayStoreChunkSize)
+        # Chunks of bit-packed masks must start on a byte
+        self.chunkSize = max(8, (chunkSize + 7) / 8 * 8)
+
+    ###
+    #
+    ###
+    def getPlanePath(self, name, c, z, t):
+        return os.path.join(self.path, name, "%d.%d.%d.plane" % (c, z, t))
+
+    ###
+    #
+    ###
+    def getChunkPath(self, name, c, z, t, yi, xi):
+        return os.path.join(self.path, name, "%d.%d.%d.%d.%d" % (c, z, t, yi, xi))
+
+    ###
+    #  Write the dims of an array, if they changed
+    ###
+    def writeArrayMetadata(self, name, width, height):
+        metadata = {'dims' : ['c', 'z', 't', 'y', 'x'],
+                    'shape' : [self.cfg.getValue(ELMConfig.numChannels), self.cfg.getValue(ELMConfig.numZ),
+                               self.cfg.getValue(ELMConfig.numT), height, width],
+                    'chunks' : [1, 1, 1, self.chunkSize, self.chunkSize],
+                    'dtype' : name == MASK_ARRAY and 'bit' or 'uint8',
+                    'compressor' : 'gzip'}
+        arrayPath = os.path.join(self.path, name)
+        metadataPath = os.path.join(arrayPath, ".array")
+        metadataLock.acquire()
+        try:
+            if not os.path.exists(arrayPath):
+                os.makedirs(arrayPath)
+            if os.path.exists(metadataPath):
+                metadataFile = open(metadataPath, "r")
+                oldMetadata = json.load(metadataFile)
+                metadataFile.close()
+                if oldMetadata == metadata:
+                    return
+            metadataFile = open(metadataPath, "w")
+            json.dump(metadata, metadataFile, sort_keys=True)
+            metadataFile.close()
+        finally:
+            metadataLock.release()
+
+    ###
+    #  Read the plane file of a plane.  Returns the offset and size of the
+    #  plane, or None if it isn't stored with the given hash.
+    ###
+    def readPlaneInfo(self, name, c, z, t, planeHash):
+        planePath = self.getPlanePath(name, c, z, t)
+        if not os.path.exists(planePath):
+            return None
+        planeFile = open(planePath, "r")
+        lines = planeFile.read().splitlines()
+        planeFile.close()
+        if not len(lines) == 2 or not lines[0] == planeHash + ":" + str(self.chunkSize):
+            return None
+        return [int(val) for val in lines[1].split(",")]
+
+    ###
+    #  Write a plane as chunks of rows of rowBytes bytes
+    ###
+    def writePlane(self, name, c, z, t, planeHash, data, rowBytes, pixelsPerByte, offset, width, height):
+        self.writeArrayMetadata(name, width, height)
+        # The old plane is invalid until all of the new chunks are written
+        planePath = self.getPlanePath(name, c, z, t)
+        if os.path.exists(planePath):
+            os.remove(planePath)
+
+        chunkBytes = self.chunkSize / pixelsPerByte
+        for yi in range(0, (height + self.chunkSize - 1) / self.chunkSize):
+            y0 = yi * self.chunkSize
+            y1 = min(height, y0 + self.chunkSize)
+            for xi in range(0, (rowBytes + chunkBytes - 1) / chunkBytes):
+                x0 = xi * chunkBytes
+                chunkWidth = min(rowBytes, x0 + chunkBytes) - x0
+                chunk = zeros(chunkWidth * (y1 - y0), 'b')
+                for y in range(y0, y1):
+                    System.arraycopy(data, y * rowBytes + x0, chunk, (y - y0) * chunkWidth, chunkWidth)
+                out = BufferedOutputStream(GZIPOutputStream(FileOutputStream(self.getChunkPath(name, c, z, t, yi, xi))))
+                try:
+                    out.write(chunk)
+                finally:
+                    out.close()
+
+        planeFile = open(planePath, "w")
+        planeFile.write(planeHash + ":" + str(self.chunkSize) + "\n")
+        planeFile.write("%d,%d,%d,%d\n" % (offset[0], offset[1], width, height))
+        planeFile.close()
+
+    ###
+    #  Read a plane from its chunks, as rows of rowBytes bytes
+    ###
+    def readPlane(self, name, c, z, t, rowBytes, pixelsPerByte, height):
+        data = zeros(rowBytes * height, 'b')
+        chunkBytes = self.chunkSize / pixelsPerByte
+        for yi in range(0, (height + self.chunkSize - 1) / self.chunkSize):
+            y0 = yi * self.chunkSize
+            y1 = min(height, y0 + self.chunkSize)
+            for xi in range(0, (rowBytes + chunkBytes - 1) / chunkBytes):
+                x0 = xi * chunkBytes
+                chunkWidth = min(rowBytes, x0 + chunkBytes) - x0
+                chunk = zeros(chunkWidth * (y1 - y0), 'b')
+                chunkIn = DataInputStream(BufferedInputStream(GZIPInputStream(FileInputStream(self.getChunkPath(name, c, z, t, yi, xi)))))
+                try:
+                    chunkIn.readFully(chunk)
+                finally:
+                    chunkIn.close()
+                for y in range(y0, y1):
+                    System.arraycopy(chunk, (y - y0) * chunkWidth, data, y * rowBytes + x0, chunkWidth)
+        return data
+
+    ###
+    #  Store a thresholded mask, with 255 for foreground and 0 for background
+    ###
+    def saveMask(self, c, z, t, planeHash, maskIP, offset):
+        width = maskIP.getWidth()
+        height = maskIP.getHeight()
+        self.writePlane(MASK_ARRAY, c, z, t, planeHash, packMask(maskIP), (width + 7) / 8, 8, offset, width, height)
+
+    ###
+    #  Load a stored mask, in the same form as getThresholdedMask creates.
+    #  Returns the mask and its offset, or None if it isn't stored with the
+    #  given hash.
+    ###
+    def loadMask(self, c, z, t, planeHash):
+        planeInfo = self.readPlaneInfo(MASK_ARRAY, c, z, t, planeHash)
+        if planeInfo is None:
+            return None
+        x, y, width, height = planeInfo
+        packed = self.readPlane(MASK_ARRAY, c, z, t, (width + 7) / 8, 8, height)
+        return unpackMask(packed, width, height), (x, y)
+
+    ###
+    #  Store an 8-bit grayscale plane
+    ###
+    def saveGray(self, c, z, t, planeHash, ip, offset):
+        if not isinstance(ip, ByteProcessor):
+            return
+        self.writePlane(GRAY_ARRAY, c, z, t, planeHash, ip.getPixels(), ip.getWidth(), 1, offset, ip.getWidth(), ip.getHeight())
+
+    ###
+    #  Load a stored grayscale plane.  Returns the processor and its offset,
+    #  or None if it isn't stored with the given hash.
+    ###
+    def loadGray(self, c, z, t, planeHash):
+        planeInfo = self.readPlaneInfo(GRAY_ARRAY, c, z, t, planeHash)
+        if planeInfo is None:
+            return None
+        x, y, width, height = planeInfo
+        return ByteProcessor(width, height, self.readPlane(GRAY_ARRAY, c, z, t, width, 1, height)), (x, y)
+
+
+####
+#
+#  Bit-pack a mask, with 255 for foreground and 0 for background, 8 pixels to
+#  a byte with rows starting on a byte.  Java2D does the packing.
+#
+####
+def packMask(maskIP):
+    ip = maskIP.getProcessor().duplicate()
+    if ip.isInvertedLut():
+        ip.invertLut()
+    binaryImage = BufferedImage(maskIP.getWidth(), maskIP.getHeight(), BufferedImage.TYPE_BYTE_BINARY)
+    graphics = binaryImage.createGraphics()
+    graphics.drawImage(ip.getBufferedImage(), 0, 0, None)
+    graphics.dispose()
+    return binaryImage.getRaster().getDataBuffer().getData()
+
+
+####
+#
+#  Unpack a mask packed by packMask, in the same form as getThresholdedMask
+#  creates
+#
+####
+def unpackMask(packed, width, height):
+    binaryImage = BufferedImage(width, height, BufferedImage.TYPE_BYTE_BINARY)
+    System.arraycopy(packed, 0, binaryImage.getRaster().getDataBuffer().getData(), 0, len(packed))
+    grayImage = BufferedImage(width, height, BufferedImage.TYPE_BYTE_GRAY)
+    graphics = grayImage.createGraphics()
+    graphics.drawImage(binaryImage, 0, 0, None)
+    graphics.dispose()
+    ip = ByteProcessor(width, height, grayImage.getRaster().getDataBuffer().getData())
+    if not Prefs.blackBackground:
+        ip.invertLut()
+    return ImagePlus("Mask", ip)
+
+
+####
+#
+#  Check if the array store is enabled
+#
+####
+def isEnabled(cfg):
+    return cfg.hasValue(ELMConfig.arrayStore) and cfg.getValue(ELMConfig.arrayStore)
+
+
+####
+#
+#  Get the hash of the mask of an image, see getStoredMask
+#
+####
+def getMaskHash(cfg, c, imgPath, thresh):
+    return cfg.getParamsHash(MASK_PARAMS, [c, ELMFrameStack.getFileSignature(imgPath), "thresh=" + str(thresh)])
+
+
+####
+#
+#  Get the hash of the grayscale plane of an image
+#
+####
+def getGrayHash(cfg, c, imgPath):
+    return cfg.getParamsHash(ELMConfig.GRAYSCALE_PARAMS, [c, ELMFrameStack.getFileSignature(imgPath)])
+
+
+####
+#
+#  Get the thresholded mask of an image from the array store, or compute it
+#  with getThresholdedMask and store it.  currIP is the image read from
+#  imgPath, which is closed if the mask is loaded from the store.
+#
+####
+def getStoredMask(cfg, imgPath, currIP, c, z, t, chanName, wellPath, outputPath, dbgOutDesc, offset=(0, 0), thresh=None):
+    if not isEnabled(cfg) or imgPath is None:
+        return ELMImageUtils.getThresholdedMask(currIP, c, z, t, chanName, cfg, outputPath, dbgOutDesc, offset, thresh)
+
+    store = ArrayStore(wellPath, cfg)
+    planeHash = getMaskHash(cfg, c, imgPath, thresh)
+    stored = store.loadMask(c, z, t, planeHash)
+    if not stored is None:
+        maskIP = stored[0]
+        maskIP.setCalibration(currIP.getCalibration())
+        currIP.close()
+        return maskIP
+
+    maskIP = ELMImageUtils.getThresholdedMask(currIP, c, z, t, chanName, cfg, outputPath, dbgOutDesc, offset, thresh)
+    if maskIP:
+        store.saveMask(c, z, t, planeHash, maskIP, offset)
+    return maskIP
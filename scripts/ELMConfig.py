@@ -17,7 +17,7 @@ SKIP = "Skip"
 
 UM_AREA = "Area (um^2)"
 
-import re, os,  ConfigParser
+import re, os,  ConfigParser, hashlib, math
 import xml.etree.ElementTree as ElementTree
 import TIFF_Tags as TiffTags
 
@@ -90,9 +90,100 @@ lutPath = "lutPath"
 createSegMask = "createSegMask"
 invertLut = "invertLut"
 thresholdFromWholeRange = "thresholdFromWholeRange"
+cropToRoi = "cropToRoi" # if True, crop loaded images to the analysisRoi/exclusion bounds before processing
+channelFanOut = "channelFanOut" # if True, decode each image file once and split it into every channel it contains
+memoryMapTiff = "memoryMapTiff" # if True, read uncompressed TIFFs through a memory map instead of IJ.openImage
+stackInput = "stackInput" # if True, multi-page and OME-TIFF hyperstacks are read plane by plane
+arrayStore = "arrayStore" # if True, thresholded masks and grayscale planes are kept in a chunked store in each well output dir
+arrayStoreChunkSize = "arrayStoreChunkSize" # Width and height, in pixels, of the chunks of the array store
+segmentationCache = "segmentationCache" # if True, cellStats caches the particles and mask of each image, keyed by the image and segmentation params
+segmentationCacheDir = "segmentationCacheDir" # Dir of the segmentation cache, outputDir/segmentationCache by default
+segmentationCacheSize = "segmentationCacheSize" # Size limit of the segmentation cache in MB, least recently used entries are removed
+segmentationCacheByContent = "segmentationCacheByContent" # if True, images are identified in the segmentation cache by a hash of their contents
+refilterOnly = "refilterOnly" # if True, cellStats applies the area thresholds to the unfiltered particle tables of an earlier run instead of processing images
+frameCacheSize = "frameCacheSize" # Number of frames per channel kept in memory while tracking
+renderAvi = "renderAvi" # if False, the tracking overlay video is not rendered
+renderInBackground = "renderInBackground" # if True, tracking overlay videos are rendered by a background worker
+writeTrackModelXml = "writeTrackModelXml" # if True, the track model is also written as TrackMate XML
+cacheDetections = "cacheDetections" # if True, detected spots are saved and reused while the detector config is unchanged
+linkingOnly = "linkingOnly" # if True, tracking only runs the tracker on cached detections
+linkingMaxDistance = "linkingMaxDistance" # Tracker max linking distance, in pixels
+gapClosingMaxDistance = "gapClosingMaxDistance" # Tracker max gap closing distance, in pixels
+gapClosingMaxFrameGap = "gapClosingMaxFrameGap" # Tracker max number of frames in a closed gap
+mergingMaxDistance = "mergingMaxDistance" # Tracker max merging distance, in pixels
+trackerSweep = "trackerSweep" # if True, run the tracker for every combination of the tracker param values
+numThreads = "numThreads" # Number of threads TrackMate uses for detection and feature analysis
+parallelChannels = "parallelChannels" # if True, the channels of a well are tracked concurrently
+localThresholdRadius = "localThresholdRadius" # Window radius, in pixels, of the LocalMean and Sauvola threshold methods
+localThresholdK = "localThresholdK" # Weight of the window std dev in the LocalMean and Sauvola threshold methods
+linkParticles = "linkParticles" # if True, cellStats links the particles of each channel into tracks
+liveTracking = "liveTracking" # if True, tracking follows the wells frame by frame while they are acquired
+livePollInterval = "livePollInterval" # Seconds between checks for new frames in live tracking
+liveTimeout = "liveTimeout" # Live tracking finishes after this many seconds without a new frame
+frameStride = "frameStride" # Only every frameStride-th timestep of each well is processed
+frameWindow = "frameWindow" # First and last timestep to process, as numbered in the filenames
+skipEmptyFrames = "skipEmptyFrames" # if True, cellStats skips frames with no pixels above the fixed threshold
+reuseDuplicateFrames = "reuseDuplicateFrames" # if True, cellStats reuses the previous frame's results when the frame fingerprint is unchanged
+coarseSegmentation = "coarseSegmentation" # if True, fluorescent channels are masked only in candidate regions found on a downsampled frame
+coarseSegmentationTolerance = "coarseSegmentationTolerance" # if set, coarse masks are checked against the full frame mask, max fraction of differing pixels
+tileSize = "tileSize" # if set, cellStats reads, thresholds and analyzes each frame in square tiles of this many pixels
+tileOverlap = "tileOverlap" # Margin, in pixels, read around each tile so its mask matches the whole frame mask
+firstT = "firstT" # Internal, index from minT of the first selected timestep
+sourceNumT = "sourceNumT" # Internal, number of timesteps of the well before frame selection
+
+# Params that change the grayscale images produced from the input images
+GRAYSCALE_PARAMS = [chanLabel, chansToSkip, imgType, analysisRoi, cropToRoi,
+                    upperLeftExclusionX, upperLeftExclusionY, lowerRightExclusionX, lowerRightExclusionY]
+
+# Tracker params that can be set (or swept) from the config, with their defaults
+TRACKER_PARAMS = [linkingMaxDistance, gapClosingMaxDistance, gapClosingMaxFrameGap, mergingMaxDistance]
+TRACKER_PARAM_DEFAULTS = {
+    linkingMaxDistance : 220.0,
+    gapClosingMaxDistance : 120.0,
+    gapClosingMaxFrameGap : 8,
+    mergingMaxDistance : 45.0
+}
 
 CYTATION_METADATA_TIFF_TAG = 270
 
+####
+#
+#  Get the list of values of a tracker param, the config value if it is set,
+#  otherwise the default
+#
+####
+def getTrackerParamValues(cfg, param):
+    if cfg.hasValue(param):
+        values = cfg.getValue(param)
+    else:
+        values = [TRACKER_PARAM_DEFAULTS[param]]
+
+    # Cells move further between selected frames when frames are skipped, and
+    # a gap covers fewer selected frames
+    stride = cfg.getFrameStride()
+    if stride > 1:
+        if param == gapClosingMaxFrameGap:
+            values = [max(1, int(math.ceil(float(v) / stride))) for v in values]
+        else:
+            values = [v * stride for v in values]
+    return values
+
+
+####
+#
+#  Get the tracker params to use for a single tracking run
+#
+####
+def getTrackerParams(cfg):
+    trackerParams = {}
+    for param in TRACKER_PARAMS:
+        values = getTrackerParamValues(cfg, param)
+        if len(values) > 1 and not (cfg.hasValue(trackerSweep) and cfg.getValue(trackerSweep)):
+            print("Warning, " + param + " has multiple values but trackerSweep is not enabled, using " + str(values[0]))
+        trackerParams[param] = values[0]
+    return trackerParams
+
+
 ####
 #
 #  The Config Class - storing configuration info
@@ -160,6 +251,18 @@ class ConfigParams:
     def hasValue(self, key):
         return key in self.params
 
+    ###
+    #  Get a hash of the values of the given params, along with any extra
+    #  strings, used to tell if cached results are still valid for the config
+    ###
+    def getParamsHash(self, keys, extra=[]):
+        md5 = hashlib.md5()
+        for key in sorted(keys):
+            md5.update(key + "=" + repr(self.getValue(key)) + ";")
+        for item in extra:
+            md5.update(str(item) + ";")
+        return md5.hexdigest()
+
     ###
     #
     ###
@@ -180,6 +283,68 @@ class ConfigParams:
                 print("\t" + key + ":\t" + self.params[key])
         print("")
 
+    ###
+    #  Get the frame stride, 1 if every frame is processed
+    ###
+    def getFrameStride(self):
+        if self.hasValue(frameStride):
+            return self.getValue(frameStride)
+        return 1
+
+    ###
+    #  Determine if only some of the frames of each well are processed
+    ###
+    def hasFrameSelection(self):
+        return self.getFrameStride() > 1 or self.hasValue(frameWindow)
+
+    ###
+    #  Select the timesteps of a well to process, from all of its timesteps:
+    #  those within frameWindow, then every frameStride-th one.  Frame t is
+    #  then the t-th selected timestep, so skipped timesteps are never opened.
+    #  minT and numT must already be set for the well.  Returns the selected
+    #  timesteps.
+    ###
+    def selectFrames(self, timesteps):
+        selected = sorted(timesteps)
+        if self.hasValue(frameWindow):
+            first, last = self.getValue(frameWindow)
+            selected = [t for t in selected if t >= first and t <= last]
+        selected = selected[::self.getFrameStride()]
+        if not selected:
+            return selected
+
+        if self.params[imgType] == "png":
+            self.params[tList] = selected
+        else:
+            # Timesteps are numbered consecutively, as numT assumes
+            self.params[firstT] = selected[0] - self.getValue(minT)
+            self.params[sourceNumT] = self.params[numT]
+        self.params[numT] = min(self.params[numT], len(selected))
+        return selected
+
+    ###
+    #  Get the index from minT of the timestep that frame t was read from
+    ###
+    def getSourceT(self, t):
+        if not self.hasValue(firstT):
+            return t
+        return self.params[firstT] + t * self.getFrameStride()
+
+    ###
+    #  Get the frame of a timestep index from minT, or None if the timestep
+    #  isn't selected
+    ###
+    def getFrameT(self, t):
+        if not self.hasValue(firstT):
+            return t
+        t -= self.params[firstT]
+        if t < 0 or not t % self.getFrameStride() == 0:
+            return None
+        t /= self.getFrameStride()
+        if t >= self.params[numT]:
+            return None
+        return t
+
     ###
     #  Get the Z string in the filename, given the current Z and using the configs max num Z
     ###
@@ -207,13 +372,23 @@ class ConfigParams:
     def getTStr(self, t):
         if self.params[imgType] == "png":
             return '%(time)0.1f' % {"time" : self.params[tList][t]}
-        elif self.isCytation:
-            if self.params[numT] < 100:
+        return self.formatTStr(self.getSourceT(t))
+
+
+    ###
+    #  Format a timestep index from minT the way it is in the filename
+    ###
+    def formatTStr(self, t):
+        numSourceT = self.params[numT]
+        if self.hasValue(sourceNumT):
+            numSourceT = self.params[sourceNumT]
+        if self.isCytation:
+            if numSourceT < 100:
                 return '%(time)02d' % {"time" : t};
             else:
                 return '%(time)03d' % {"time" : t};
         else:
-            if self.params[numT] < 100:
+            if numSourceT < 100:
                 return 't%(time)02d' % {"time" : t};
             else:
                 return 't%(time)03d' % {"time" : t};
@@ -239,8 +414,8 @@ class ConfigParams:
         cMatch = cStr in fileName
         zMatch = self.getValue(noZInFile) or zStr in fileName
         if self.isCytation:
-            t = t + 1 # Cytation starts at a timestep of 1, so offset time indices
-            tStr = self.getTStr(t) 
+            # Cytation starts at a timestep of 1, so offset time indices
+            tStr = self.formatTStr(self.getSourceT(t) + 1)
             tMatch = self.getValue(noTInFile) or tStr == fileToks[-1]
         else:
             tMatch = self.getValue(noTInFile) or tStr in fileName
@@ -298,6 +473,7 @@ class ConfigParams:
             t = int(tStr.replace('t',''))
             if self.hasValue(minT):
                 t -= self.getValue(minT)
+            t = self.getFrameT(t)
         return chan, z, t
 
 
@@ -407,8 +583,8 @@ class ConfigParams:
             elif option == analysisRoi.lower():
                 toks = cfgParser.get(cfgSection, option).split(",")
                 if not len(toks) == 4:
-                    print "Improper value for analysisRoi config, expected " + 4+ " comma separated values!  Received " + str(len(toks))
-                self.params[analysisRoi] = [toks[0],toks[1],toks[2],toks[3]]
+                    print "Improper value for analysisRoi config, expected 4 comma separated values!  Received " + str(len(toks))
+                self.params[analysisRoi] = [int(toks[0]), int(toks[1]), int(toks[2]), int(toks[3])]
             elif option == wellNames.lower():
                 toks = cfgParser.get(cfgSection, option).split(",")
                 self.params[wellNames] = []
@@ -427,6 +603,89 @@ class ConfigParams:
                 self.params[invertLut] = cfgParser.get(cfgSection, option) == "True"
             elif option == thresholdFromWholeRange.lower():
                 self.params[thresholdFromWholeRange] = cfgParser.get(cfgSection, option) == "True"
+            elif option == cropToRoi.lower():
+                self.params[cropToRoi] = cfgParser.get(cfgSection, option) == "True"
+            elif option == channelFanOut.lower():
+                self.params[channelFanOut] = cfgParser.get(cfgSection, option) == "True"
+            elif option == memoryMapTiff.lower():
+                self.params[memoryMapTiff] = cfgParser.get(cfgSection, option) == "True"
+            elif option == stackInput.lower():
+                self.params[stackInput] = cfgParser.get(cfgSection, option) == "True"
+            elif option == arrayStore.lower():
+                self.params[arrayStore] = cfgParser.get(cfgSection, option) == "True"
+            elif option == arrayStoreChunkSize.lower():
+                self.params[arrayStoreChunkSize] = int(cfgParser.get(cfgSection, option))
+            elif option == segmentationCache.lower():
+                self.params[segmentationCache] = cfgParser.get(cfgSection, option) == "True"
+            elif option == segmentationCacheDir.lower():
+                self.params[segmentationCacheDir] = cfgParser.get(cfgSection, option)
+            elif option == segmentationCacheSize.lower():
+                self.params[segmentationCacheSize] = int(cfgParser.get(cfgSection, option))
+            elif option == segmentationCacheByContent.lower():
+                self.params[segmentationCacheByContent] = cfgParser.get(cfgSection, option) == "True"
+            elif option == refilterOnly.lower():
+                self.params[refilterOnly] = cfgParser.get(cfgSection, option) == "True"
+            elif option == frameCacheSize.lower():
+                self.params[frameCacheSize] = int(cfgParser.get(cfgSection, option))
+            elif option == renderAvi.lower():
+                self.params[renderAvi] = cfgParser.get(cfgSection, option) == "True"
+            elif option == renderInBackground.lower():
+                self.params[renderInBackground] = cfgParser.get(cfgSection, option) == "True"
+            elif option == writeTrackModelXml.lower():
+                self.params[writeTrackModelXml] = cfgParser.get(cfgSection, option) == "True"
+            elif option == cacheDetections.lower():
+                self.params[cacheDetections] = cfgParser.get(cfgSection, option) == "True"
+            elif option == linkingOnly.lower():
+                self.params[linkingOnly] = cfgParser.get(cfgSection, option) == "True"
+            elif option == linkingMaxDistance.lower():
+                toks = cfgParser.get(cfgSection, option).split(",")
+                self.params[linkingMaxDistance] = [float(t) for t in toks]
+            elif option == gapClosingMaxDistance.lower():
+                toks = cfgParser.get(cfgSection, option).split(",")
+                self.params[gapClosingMaxDistance] = [float(t) for t in toks]
+            elif option == mergingMaxDistance.lower():
+                toks = cfgParser.get(cfgSection, option).split(",")
+                self.params[mergingMaxDistance] = [float(t) for t in toks]
+            elif option == gapClosingMaxFrameGap.lower():
+                toks = cfgParser.get(cfgSection, option).split(",")
+                self.params[gapClosingMaxFrameGap] = [int(t) for t in toks]
+            elif option == trackerSweep.lower():
+                self.params[trackerSweep] = cfgParser.get(cfgSection, option) == "True"
+            elif option == numThreads.lower():
+                self.params[numThreads] = int(cfgParser.get(cfgSection, option))
+            elif option == parallelChannels.lower():
+                self.params[parallelChannels] = cfgParser.get(cfgSection, option) == "True"
+            elif option == localThresholdRadius.lower():
+                self.params[localThresholdRadius] = int(cfgParser.get(cfgSection, option))
+            elif option == localThresholdK.lower():
+                self.params[localThresholdK] = float(cfgParser.get(cfgSection, option))
+            elif option == linkParticles.lower():
+                self.params[linkParticles] = cfgParser.get(cfgSection, option) == "True"
+            elif option == liveTracking.lower():
+                self.params[liveTracking] = cfgParser.get(cfgSection, option) == "True"
+            elif option == livePollInterval.lower():
+                self.params[livePollInterval] = float(cfgParser.get(cfgSection, option))
+            elif option == liveTimeout.lower():
+                self.params[liveTimeout] = float(cfgParser.get(cfgSection, option))
+            elif option == skipEmptyFrames.lower():
+                self.params[skipEmptyFrames] = cfgParser.get(cfgSection, option) == "True"
+            elif option == reuseDuplicateFrames.lower():
+                self.params[reuseDuplicateFrames] = cfgParser.get(cfgSection, option) == "True"
+            elif option == coarseSegmentation.lower():
+                self.params[coarseSegmentation] = cfgParser.get(cfgSection, option) == "True"
+            elif option == coarseSegmentationTolerance.lower():
+                self.params[coarseSegmentationTolerance] = float(cfgParser.get(cfgSection, option))
+            elif option == tileSize.lower():
+                self.params[tileSize] = int(cfgParser.get(cfgSection, option))
+            elif option == tileOverlap.lower():
+                self.params[tileOverlap] = int(cfgParser.get(cfgSection, option))
+            elif option == frameStride.lower():
+                self.params[frameStride] = int(cfgParser.get(cfgSection, option))
+            elif option == frameWindow.lower():
+                toks = cfgParser.get(cfgSection, option).split(",")
+                if not len(toks) == 2:
+                    print "Improper value for frameWindow config, expected 2 comma separated values!  Received " + str(len(toks))
+                self.params[frameWindow] = [float(toks[0]), float(toks[1])]
             else:
                 print "Warning, unrecognized config option: " + option   
         
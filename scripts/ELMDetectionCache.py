@@ -0,0 +1,116 @@
+# Copyright (C) 2011 - 2019, Raytheon BBN Technologies and contributors listed
+# in the AUTHORS file in TASBE Flow Analytics distribution's top directory.
+#
+# This file is part of the TASBE Flow Analytics package, and is distributed
+# under the terms of the GNU General Public License, with a linking
+# exception, as described in the file LICENSE in the TASBE Image Analysis
+# package distribution's top directory.
+
+from fiji.plugin.trackmate import Spot, SpotCollection
+
+from java.lang import Integer
+
+import os
+
+import ELMConfig, ELMFrameStack
+
+# Detector settings that change which spots are detected
+DETECTOR_SETTINGS_KEYS = ['THRESHOLD', 'ABOVE', 'THRESHOLD_METHOD', 'LOCAL_RADIUS', 'LOCAL_K', 'LOCAL_R']
+
+# Spot features that are passed to the Spot constructor
+SPOT_CTOR_FEATURES = ['POSITION_X', 'POSITION_Y', 'POSITION_Z', 'RADIUS', 'QUALITY']
+
+####
+#
+#  Get the path of the detection cache for a channel of a well
+#
+####
+def getCachePath(wellPath, chanName):
+    return os.path.join(wellPath, chanName + "_detections.csv")
+
+
+####
+#
+#  Compute a hash of everything that affects the detected spots: the frames,
+#  the config params that change the grayscale frames and the detector settings
+#
+####
+def getDetectionHash(cfg, c, framePaths, detectorSettings):
+    extra = [c]
+    for key in DETECTOR_SETTINGS_KEYS:
+        extra.append(key + "=" + str(detectorSettings.get(key)))
+    extra += [ELMFrameStack.getFileSignature(path) for path in framePaths]
+    return cfg.getParamsHash(ELMConfig.GRAYSCALE_PARAMS, extra)
+
+
+####
+#
+#  Write every detected spot (visible or not) with all of its features.  The
+#  first line holds the detection hash.
+#
+####
+def saveSpots(cachePath, detectionHash, spots):
+    featureNames = set()
+    for spot in spots.iterable(False):
+        featureNames.update(spot.getFeatures().keySet())
+    featureNames = SPOT_CTOR_FEATURES + sorted([name for name in featureNames if not name in SPOT_CTOR_FEATURES and not name == 'FRAME'])
+
+    cacheFile = open(cachePath, "w")
+    cacheFile.write("# " + detectionHash + "\n")
+    cacheFile.write("FRAME," + ",".join(featureNames) + "\n")
+    for spot in spots.iterable(False):
+        data = [str(int(spot.getFeature('FRAME')))]
+        for name in featureNames:
+            value = spot.getFeature(name)
+            if value is None:
+                data.append("")
+            else:
+                data.append(repr(float(value)))
+        cacheFile.write(",".join(data) + "\n")
+    cacheFile.close()
+
+
+####
+#
+#  Load the cached spots into a SpotCollection, if the cache exists and was
+#  created with the same detection hash.  Returns None otherwise.
+#
+####
+def loadSpots(cachePath, detectionHash):
+    if not os.path.exists(cachePath):
+        return None
+    cacheFile = open(cachePath, "r")
+    if not cacheFile.readline().strip() == "# " + detectionHash:
+        cacheFile.close()
+        return None
+
+    featureNames = cacheFile.readline().strip().split(",")[1:]
+    spots = SpotCollection()
+    for line in cacheFile:
+        toks = line.rstrip("\n").split(",")
+        frame = int(toks[0])
+        values = dict()
+        for i in range(0, len(featureNames)):
+            if toks[i + 1]:
+                values[featureNames[i]] = float(toks[i + 1])
+        spot = Spot(values['POSITION_X'], values['POSITION_Y'], values['POSITION_Z'], values['RADIUS'], values['QUALITY'])
+        for name in values:
+            if not name in SPOT_CTOR_FEATURES:
+                spot.putFeature(name, values[name])
+        spots.add(spot, Integer(frame))
+    cacheFile.close()
+    return spots
+
+
+####
+#
+#  Declare the features of the spot analyzers in a model.  TrackMate does this
+#  when it computes spot features, which is skipped when spots are loaded
+#  from the cache.
+#
+####
+def declareAnalyzerFeatures(model, settings):
+    fm = model.getFeatureModel()
+    for factory in settings.getSpotAnalyzerFactories():
+        fm.declareSpotFeatures(factory.getFeatures(), factory.getFeatureNames(), factory.getFeatureShortNames(), \
+                               factory.getFeatureDimensions(), factory.getIsIntFeature())
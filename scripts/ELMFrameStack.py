@@ -0,0 +1,216 @@
+# Copyright (C) 2011 - 2019, Raytheon BBN Technologies and contributors listed
+# in the AUTHORS file in TASBE Flow Analytics distribution's top directory.
+#
+# This file is part of the TASBE Flow Analytics package, and is distributed
+# under the terms of the GNU General Public License, with a linking
+# exception, as described in the file LICENSE in the TASBE Image Analysis
+# package distribution's top directory.
+
+from ij import ImagePlus, VirtualStack
+from ij.process import AutoThresholder, StackStatistics
+
+from collections import OrderedDict
+import os, threading
+
+import ELMConfig, ELMImageUtils, ELMStackReader
+
+DEFAULT_CACHE_SIZE = 8
+
+####
+#
+#  A virtual stack of frames that are read from disk only when requested.
+#  Each frame is opened (and cropped, if configured) with ELMImageUtils and,
+#  for grayscale stacks, converted with getGrayScaleImage.  The most recently
+#  used frames are kept in a small LRU cache, so memory use is bounded by the
+#  cache size rather than the number of frames.  Grayscale frames can also be
+#  read from and written to an array store, given the (z, t, hash) of each
+#  frame's plane in framePlanes.
+#
+####
+class FrameStack(VirtualStack):
+
+    ###
+    #
+    ###
+    def __init__(self, width, height, framePaths, c, chanName, cfg, grayScale, cacheSize=DEFAULT_CACHE_SIZE, store=None, framePlanes=None):
+        VirtualStack.__init__(self, width, height, None, None)
+        self.framePaths = framePaths
+        self.c = c
+        self.chanName = chanName
+        self.cfg = cfg
+        self.grayScale = grayScale
+        self.store = store
+        self.framePlanes = framePlanes
+        self.cacheSize = max(1, cacheSize)
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    ###
+    #  Open a frame, n is 1-based like all ImageStack indices
+    ###
+    def loadProcessor(self, n):
+        useStore = self.grayScale and not self.store is None
+        if useStore:
+            z, t, planeHash = self.framePlanes[n - 1]
+            stored = self.store.loadGray(self.c, z, t, planeHash)
+            if not stored is None:
+                return stored[0]
+
+        currIP, cropOffset = ELMImageUtils.openImage(self.framePaths[n - 1], self.cfg)
+        if self.grayScale:
+            currIP = ELMImageUtils.getGrayScaleImage(currIP, self.c, self.chanName, self.cfg, cropOffset)
+        ip = currIP.getProcessor()
+        currIP.close()
+        if useStore:
+            self.store.saveGray(self.c, z, t, planeHash, ip, cropOffset)
+        return ip
+
+    ###
+    #
+    ###
+    def getProcessor(self, n):
+        self.lock.acquire()
+        try:
+            if n in self.cache:
+                ip = self.cache.pop(n)
+                self.cache[n] = ip
+                return ip
+        finally:
+            self.lock.release()
+
+        ip = self.loadProcessor(n)
+
+        self.lock.acquire()
+        try:
+            self.cache[n] = ip
+            while len(self.cache) > self.cacheSize:
+                self.cache.popitem(last=False)
+        finally:
+            self.lock.release()
+        return ip
+
+    ###
+    #
+    ###
+    def getPixels(self, n):
+        return self.getProcessor(n).getPixels()
+
+    ###
+    #  Frames are read only
+    ###
+    def setPixels(self, pixels, n):
+        pass
+
+    ###
+    #
+    ###
+    def getSize(self):
+        return len(self.framePaths)
+
+    ###
+    #
+    ###
+    def getSliceLabel(self, n):
+        return os.path.basename(self.framePaths[n - 1])
+
+    ###
+    #
+    ###
+    def getFileName(self, n):
+        return os.path.basename(self.framePaths[n - 1])
+
+    ###
+    #
+    ###
+    def getDirectory(self):
+        return os.path.dirname(self.framePaths[0])
+
+
+
+####
+#
+#  Create a FrameStack, using the first frame to determine the frame size
+#
+####
+def openFrameStack(framePaths, c, chanName, cfg, grayScale, cacheSize=DEFAULT_CACHE_SIZE):
+    currIP, cropOffset = ELMImageUtils.openImage(framePaths[0], cfg)
+    width = currIP.getWidth()
+    height = currIP.getHeight()
+    currIP.close()
+    return FrameStack(width, height, framePaths, c, chanName, cfg, grayScale, cacheSize)
+
+
+####
+#
+#  Get a string that changes whenever the file at path changes
+#
+####
+def getFileSignature(path):
+    fileStat = os.stat(ELMStackReader.getSourceFile(path))
+    return "%s:%d:%d" % (path, fileStat.st_size, int(fileStat.st_mtime))
+
+
+####
+#
+#  Compute the histogram of all frames of a grayscale stack.  The frames are
+#  streamed through the stack, and the bins are summed by StackStatistics.
+#
+####
+def computeStackHistogram(stack):
+    stackStats = StackStatistics(ImagePlus("Histogram", stack))
+    return [int(count) for count in stackStats.histogram]
+
+
+####
+#
+#  Get the histogram of every frame of a channel, for thresholdFromWholeRange.
+#  This is a histogram-only pass over the frames, which is cached in the well
+#  output dir, keyed by a hash of the frames and the config params that affect
+#  the grayscale images.
+#
+####
+def getWholeRangeHistogram(cfg, wellPath, c, chanName, framePaths):
+    extra = [c] + [getFileSignature(path) for path in framePaths]
+    configHash = cfg.getParamsHash(ELMConfig.GRAYSCALE_PARAMS, extra)
+    cachePath = os.path.join(wellPath, chanName + "_wholeRangeHist.txt")
+    if os.path.exists(cachePath):
+        cacheFile = open(cachePath, "r")
+        lines = cacheFile.read().splitlines()
+        cacheFile.close()
+        if len(lines) == 2 and lines[0] == configHash:
+            print("\tUsing cached whole range histogram: " + cachePath)
+            return [int(count) for count in lines[1].split(",")]
+
+    stack = openFrameStack(framePaths, c, chanName, cfg, True, 1)
+    totalHist = computeStackHistogram(stack)
+
+    cacheFile = open(cachePath, "w")
+    cacheFile.write(configHash + "\n")
+    cacheFile.write(",".join([str(count) for count in totalHist]) + "\n")
+    cacheFile.close()
+    return totalHist
+
+
+####
+#
+#  Compute a single threshold for a channel from the histogram of all frames
+#
+####
+def getWholeRangeThreshold(cfg, wellPath, c, chanName, framePaths):
+    totalHist = getWholeRangeHistogram(cfg, wellPath, c, chanName, framePaths)
+    return getHistogramThreshold(cfg, totalHist)
+
+
+####
+#
+#  Compute a threshold from the summed histogram of a set of frames
+#
+####
+def getHistogramThreshold(cfg, totalHist):
+    threshMethod = "Otsu" # Default works very poorly for this data
+    if cfg.hasValue(ELMConfig.thresholdMethod):
+        threshMethod = cfg.getValue(ELMConfig.thresholdMethod)
+    thresholder = AutoThresholder()
+    computedThresh = thresholder.getThreshold(threshMethod, totalHist)
+    print("\tComputed threshold from total hist (" + threshMethod + "): " + str(computedThresh))
+    return computedThresh
@@ -6,36 +6,289 @@
 # exception, as described in the file LICENSE in the TASBE Image Analysis
 # package distribution's top directory.
 
-from ij.process import ImageConverter, ImageProcessor, ByteProcessor
-from ij.plugin import ChannelSplitter, ImageCalculator
-from ij import IJ, ImagePlus, WindowManager
+from ij.process import ImageConverter, ImageProcessor, ByteProcessor, ImageStatistics, Blitter, AutoThresholder
+from ij.measure import Measurements
+from ij.plugin import ChannelSplitter, ImageCalculator, Binner
+from ij.plugin.filter import ThresholdToSelection
+from ij.gui import ShapeRoi
+from ij import IJ, ImagePlus, WindowManager, Prefs
 
 from java.awt import Color
 
-import os
+from jarray import array
 
-import ELMConfig
+import os, hashlib
 
-def getGrayScaleImage(currIP, c, chanName, cfg):
+import ELMConfig, ELMTiffReader, ELMStackReader
+
+# Columns of a particle analysis table that hold calibrated image coordinates
+PARTICLE_COORD_COLS_X = ["X", "XM", "BX"]
+PARTICLE_COORD_COLS_Y = ["Y", "YM", "BY"]
+
+# Threshold methods that compute a threshold per pixel from a window around it,
+# see IntegralImageThresholder in the TrackMate plugin
+LOCAL_THRESHOLD_METHODS = ["LocalMean", "Sauvola"]
+DEFAULT_LOCAL_THRESHOLD_RADIUS = 15
+DEFAULT_LOCAL_THRESHOLD_K = 0.5
+DEFAULT_LOCAL_THRESHOLD_R = 128.0
+
+# Frame fingerprints are a hash of the pixels of the frame downsampled by
+# FINGERPRINT_DOWNSAMPLE in each dimension, quantized to FINGERPRINT_LEVELS
+# intensity levels
+FINGERPRINT_DOWNSAMPLE = 4
+FINGERPRINT_LEVELS = 64
+
+# Coarse to fine segmentation finds candidate regions on a frame downsampled
+# by COARSE_DOWNSAMPLE, then pads them by COARSE_PADDING full resolution pixels.
+# The padding must cover the neighborhood of the mask close.
+COARSE_DOWNSAMPLE = 4
+COARSE_PADDING = 8
+
+###
+#
+#  Get the exclusion zone bounds in the coordinates of the given image.  The
+#  configured exclusion coordinates are for the full frame, so an image that
+#  was cropped at offset needs them shifted.
+#
+###
+def getExclusionBounds(currIP, cfg, offset=(0, 0)):
     if (cfg.hasValue(ELMConfig.upperLeftExclusionX)):
-        ulExclusionX = cfg.getValue(ELMConfig.upperLeftExclusionX)
+        ulExclusionX = max(0, cfg.getValue(ELMConfig.upperLeftExclusionX) - offset[0])
     else:
         ulExclusionX = 0
 
     if (cfg.hasValue(ELMConfig.upperLeftExclusionY)):
-        ulExclusionY = cfg.getValue(ELMConfig.upperLeftExclusionY)
+        ulExclusionY = max(0, cfg.getValue(ELMConfig.upperLeftExclusionY) - offset[1])
     else:
         ulExclusionY = 0
 
     if (cfg.hasValue(ELMConfig.lowerRightExclusionX)):
-        lrExclusionX = cfg.getValue(ELMConfig.lowerRightExclusionX)
+        lrExclusionX = max(0, cfg.getValue(ELMConfig.lowerRightExclusionX) - offset[0])
     else:
         lrExclusionX = currIP.getWidth()
 
     if (cfg.hasValue(ELMConfig.lowerRightExclusionY)):
-        lrExclusionY = cfg.getValue(ELMConfig.lowerRightExclusionY)
+        lrExclusionY = max(0, cfg.getValue(ELMConfig.lowerRightExclusionY) - offset[1])
     else:
         lrExclusionY = currIP.getHeight()
+    return ulExclusionX, ulExclusionY, lrExclusionX, lrExclusionY
+
+
+###
+#
+#  Compute the effective analysis rectangle (x, y, width, height) for a frame
+#  of the given size.  This is the analysisRoi clipped to the frame, further
+#  shrunk by any exclusion zone that spans the whole rectangle in one
+#  dimension.  Exclusion zones that only cover a corner of the rectangle are
+#  left to be cleared by getThresholdedMask.
+#
+###
+def getAnalysisRect(cfg, width, height):
+    if cfg.hasValue(ELMConfig.analysisRoi):
+        roi = cfg.getValue(ELMConfig.analysisRoi)
+        x0 = max(0, roi[0])
+        y0 = max(0, roi[1])
+        x1 = min(width, roi[0] + roi[2])
+        y1 = min(height, roi[1] + roi[3])
+    else:
+        x0 = 0
+        y0 = 0
+        x1 = width
+        y1 = height
+
+    # Lower right exclusion covers everything right of X and below Y
+    if cfg.hasValue(ELMConfig.lowerRightExclusionX) and cfg.hasValue(ELMConfig.lowerRightExclusionY):
+        lrX = cfg.getValue(ELMConfig.lowerRightExclusionX)
+        lrY = cfg.getValue(ELMConfig.lowerRightExclusionY)
+        if lrX <= x0:
+            y1 = min(y1, lrY)
+        elif lrY <= y0:
+            x1 = min(x1, lrX)
+
+    # Upper left exclusion covers everything left of X and above Y
+    if cfg.hasValue(ELMConfig.upperLeftExclusionX) and cfg.hasValue(ELMConfig.upperLeftExclusionY):
+        ulX = cfg.getValue(ELMConfig.upperLeftExclusionX)
+        ulY = cfg.getValue(ELMConfig.upperLeftExclusionY)
+        if ulX >= x1:
+            y0 = max(y0, ulY)
+        elif ulY >= y1:
+            x0 = max(x0, ulX)
+
+    if x1 <= x0 or y1 <= y0:
+        print "Warning: analysisRoi and exclusions leave no area to analyze, using the full frame!"
+        return 0, 0, width, height
+    return x0, y0, x1 - x0, y1 - y0
+
+
+###
+#
+#  Open an image, cropping it to the effective analysis rectangle if cropToRoi
+#  is set.  Returns the image and the (x, y) offset of its upper left corner
+#  within the full frame.
+#
+###
+def openImage(imgPath, cfg):
+    cropToRoi = cfg.hasValue(ELMConfig.cropToRoi) and cfg.getValue(ELMConfig.cropToRoi)
+
+    # Uncompressed TIFFs can be read straight out of a memory map, and only
+    # the rows within the analysis rectangle need to be read
+    plane = mapTiffPlane(imgPath, cfg)
+    if plane:
+        if cropToRoi:
+            rect = getAnalysisRect(cfg, plane.width, plane.height)
+        else:
+            rect = (0, 0, plane.width, plane.height)
+        currIP = plane.getImagePlus(rect)
+        plane.close()
+        return currIP, (rect[0], rect[1])
+
+    # Planes of a stack are decoded on their own, by page
+    stackPlane = ELMStackReader.getStackPlane(imgPath)
+    if stackPlane:
+        currIP = IJ.openImage(stackPlane[0], stackPlane[1] + 1)
+    else:
+        currIP = IJ.openImage(imgPath)
+    if not currIP or not cropToRoi:
+        return currIP, (0, 0)
+    return cropImage(currIP, cfg)
+
+
+###
+#
+#  Memory-map the pixel plane of an image, if memoryMapTiff is set and the
+#  image is an uncompressed TIFF, or a plane of one.  Returns None otherwise.
+#
+###
+def mapTiffPlane(imgPath, cfg):
+    if not cfg.hasValue(ELMConfig.memoryMapTiff) or not cfg.getValue(ELMConfig.memoryMapTiff):
+        return None
+    return ELMStackReader.mapPlane(imgPath)
+
+
+###
+#
+#  Crop an already loaded full frame image to the effective analysis rectangle
+#
+###
+def cropImage(currIP, cfg):
+    x, y, width, height = getAnalysisRect(cfg, currIP.getWidth(), currIP.getHeight())
+    if x == 0 and y == 0 and width == currIP.getWidth() and height == currIP.getHeight():
+        return currIP, (0, 0)
+    currIP.setRoi(x, y, width, height)
+    croppedIP = currIP.crop()
+    croppedIP.setTitle(currIP.getTitle())
+    croppedIP.setCalibration(currIP.getCalibration())
+    currIP.close()
+    return croppedIP, (x, y)
+
+
+###
+#
+#  Map the coordinates in a particle stats dict (column name -> values) from a
+#  cropped image back to full frame coordinates.
+#
+###
+def shiftParticleStats(stats, offset, calib):
+    if offset[0] == 0 and offset[1] == 0:
+        return
+    dx = offset[0] * calib.pixelWidth
+    dy = offset[1] * calib.pixelHeight
+    for col in PARTICLE_COORD_COLS_X:
+        if col in stats and stats[col]:
+            stats[col] = [val + dx for val in stats[col]]
+    for col in PARTICLE_COORD_COLS_Y:
+        if col in stats and stats[col]:
+            stats[col] = [val + dy for val in stats[col]]
+
+
+###
+#
+#  Split a single decoded image into an image for each of the given channels.
+#  RGB images are split into their color planes once, with the Yellow channel
+#  being the average of the red and green planes and brightfield using the
+#  whole image.  Returns a dict from channel index to image; each image is
+#  owned by the caller.  The input image is closed.
+#
+###
+def splitChannelImages(img, chans, cfg, offset=(0, 0)):
+    chanImages = dict()
+    imgType = img.getType()
+    if not (imgType == ImagePlus.COLOR_RGB or imgType == ImagePlus.COLOR_256):
+        for c in chans[1:]:
+            chanImages[c] = img.duplicate()
+        chanImages[chans[0]] = img
+        return chanImages
+
+    planes = ChannelSplitter.split(img)
+    # Clear the Exclusion zone, so it doesn't mess with  thresholding
+    ulExclusionX, ulExclusionY, lrExclusionX, lrExclusionY = getExclusionBounds(img, cfg, offset)
+    for plane in planes:
+        imgProc = plane.getProcessor();
+        imgProc.setColor(Color(0,0,0))
+        imgProc.fillRect(lrExclusionX, lrExclusionY, plane.getWidth(), plane.getHeight())
+        imgProc.fillRect(0, 0, ulExclusionX, ulExclusionY)
+
+    usedPlanes = set()
+    for c in chans:
+        chanName = cfg.getValue(ELMConfig.chanLabel)[c]
+        if (chanName == ELMConfig.BRIGHTFIELD):
+            chanImages[c] = img.duplicate()
+            continue
+        elif (chanName == ELMConfig.YELLOW):
+            # Create a new image that consists of the average of the red & green channels
+            ic = ImageCalculator()
+            chanImages[c] = ic.run("Average create", planes[0], planes[1])
+            chanImages[c].setTitle(img.getTitle())
+            continue
+        elif (chanName == ELMConfig.RED):
+            chanIdx = 0
+        elif (chanName == ELMConfig.GREEN):
+            chanIdx = 1
+        elif (chanName == ELMConfig.BLUE):
+            chanIdx = 2
+        else:
+            # Let the thresholding report the unrecognized channel
+            chanImages[c] = img.duplicate()
+            continue
+
+        if chanIdx in usedPlanes:
+            chanImages[c] = planes[chanIdx].duplicate()
+        else:
+            chanImages[c] = planes[chanIdx]
+            usedPlanes.add(chanIdx)
+
+    for chanIdx in range(0, len(planes)):
+        if not chanIdx in usedPlanes:
+            planes[chanIdx].close()
+    img.close()
+    return chanImages
+
+
+###
+#
+#  Get a cheap fingerprint of a channel image, to tell frames that are
+#  unchanged from the previous one, and the max intensity of the image in
+#  the 8-bit range it is thresholded in, to tell frames with no foreground.
+#  The fingerprint hashes the downsampled pixels in place, so frames whose
+#  cells moved don't match even if their intensities are the same.
+#  Returns (fingerprint, max intensity).
+#
+###
+def getFrameFingerprint(currIP):
+    ip = currIP.getProcessor()
+    if not isinstance(ip, ByteProcessor):
+        ip = ip.convertToByte(True)
+    maxValue = ImageStatistics.getStatistics(ip, Measurements.MIN_MAX, None).max
+
+    small = ip.resize(max(1, ip.getWidth() / FINGERPRINT_DOWNSAMPLE), max(1, ip.getHeight() / FINGERPRINT_DOWNSAMPLE), True)
+    levelWidth = 256 / FINGERPRINT_LEVELS
+    small.applyTable(array([(i / levelWidth) * levelWidth for i in range(0, 256)], 'i'))
+    fingerprint = hashlib.md5(small.getPixels().tostring()).hexdigest()
+    return fingerprint, maxValue
+
+
+def getGrayScaleImage(currIP, c, chanName, cfg, offset=(0, 0)):
+    ulExclusionX, ulExclusionY, lrExclusionX, lrExclusionY = getExclusionBounds(currIP, cfg, offset)
     
     imgType = currIP.getType()
     if (chanName in cfg.getValue(ELMConfig.chansToSkip)): # Don't process skip channels
@@ -98,28 +351,13 @@ def getGrayScaleImage(currIP, c, chanName, cfg):
 
 ###
 #
+#  Threshold a channel image into a mask.  If frameHist is given, the auto
+#  threshold is computed from it instead of from the image's own histogram,
+#  so the tiles of a frame are thresholded like the whole frame.
 #
 ###
-def getThresholdedMask(currIP, c, z, t, chanName, cfg, wellPath, dbgOutDesc):
-    if (cfg.hasValue(ELMConfig.upperLeftExclusionX)):
-        ulExclusionX = cfg.getValue(ELMConfig.upperLeftExclusionX)
-    else:
-        ulExclusionX = 0
-
-    if (cfg.hasValue(ELMConfig.upperLeftExclusionY)):
-        ulExclusionY = cfg.getValue(ELMConfig.upperLeftExclusionY)
-    else:
-        ulExclusionY = 0
-
-    if (cfg.hasValue(ELMConfig.lowerRightExclusionX)):
-        lrExclusionX = cfg.getValue(ELMConfig.lowerRightExclusionX)
-    else:
-        lrExclusionX = currIP.getWidth()
-
-    if (cfg.hasValue(ELMConfig.lowerRightExclusionY)):
-        lrExclusionY = cfg.getValue(ELMConfig.lowerRightExclusionY)
-    else:
-        lrExclusionY = currIP.getHeight()
+def getThresholdedMask(currIP, c, z, t, chanName, cfg, wellPath, dbgOutDesc, offset=(0, 0), thresh=None, frameHist=None):
+    ulExclusionX, ulExclusionY, lrExclusionX, lrExclusionY = getExclusionBounds(currIP, cfg, offset)
     
     imgType = currIP.getType()
     if (chanName in cfg.getValue(ELMConfig.chansToSkip)): # Don't process skip channels
@@ -198,19 +436,25 @@ def getThresholdedMask(currIP, c, z, t, chanName, cfg, wellPath, dbgOutDesc):
 
     upperThreshImg = currIP.duplicate()
 
-    # If threshold value is set, use it
-    if (cfg.hasValue(ELMConfig.imageThreshold)):
+    # If threshold value is given or set, use it
+    if thresh is None and cfg.hasValue(ELMConfig.imageThreshold):
         thresh = cfg.getValue(ELMConfig.imageThreshold)
+    if not thresh is None:
         if (darkBackground):
             currIP.getProcessor().setThreshold(thresh, 255, ImageProcessor.NO_LUT_UPDATE)
         else:
             currIP.getProcessor().setThreshold(0, thresh, ImageProcessor.NO_LUT_UPDATE)
+    elif isLocalThresholdMethod(cfg):
+        localThresholdMask(currIP, cfg, darkBackground)
     else: # Otherise, automatically compute threshold
         threshMethod = "Default"
         if cfg.hasValue(ELMConfig.thresholdMethod):
             threshMethod = cfg.getValue(ELMConfig.thresholdMethod)
     
-        currIP.getProcessor().setAutoThreshold(threshMethod, darkBackground, ImageProcessor.NO_LUT_UPDATE)
+        if frameHist is None:
+            currIP.getProcessor().setAutoThreshold(threshMethod, darkBackground, ImageProcessor.NO_LUT_UPDATE)
+        else:
+            setHistogramThreshold(currIP.getProcessor(), threshMethod, darkBackground, frameHist)
         threshRange = currIP.getProcessor().getMaxThreshold() - currIP.getProcessor().getMinThreshold()
         #print "\t\tZ = " + str(z) + ", T = " + str(t) +  ", chan " + chanName + ": Using default threshold of minThresh: " + str(currIP.getProcessor().getMinThreshold()) + ", maxThresh: " + str(currIP.getProcessor().getMaxThreshold())
         if currIP.getType() != ImagePlus.GRAY8:
@@ -228,14 +472,11 @@ def getThresholdedMask(currIP, c, z, t, chanName, cfg, wellPath, dbgOutDesc):
                 currIP.close()
                 return None
 
-    IJ.run(currIP, "Convert to Mask", "")
-    
-    # Clear out exclusion zones
-    imgProc = currIP.getProcessor();
-    imgProc.fillRect(lrExclusionX, lrExclusionY, currIP.getWidth(), currIP.getHeight())
-    imgProc.fillRect(0, 0, ulExclusionX, ulExclusionY)
-    
-    IJ.run(currIP, "Close-", "")
+    exclusionBounds = (ulExclusionX, ulExclusionY, lrExclusionX, lrExclusionY)
+    if useCoarseToFine(cfg, chanName, darkBackground):
+        currIP = getCoarseToFineMask(currIP, cfg, exclusionBounds, z, t, chanName)
+    else:
+        maskAndClose(currIP, exclusionBounds)
     
     # Brightfield has an additional thresholding step
     if cfg.getValue(ELMConfig.chanLabel)[c] == ELMConfig.BRIGHTFIELD:
@@ -262,4 +503,199 @@ def getThresholdedMask(currIP, c, z, t, chanName, cfg, wellPath, dbgOutDesc):
             IJ.saveAs('png', os.path.join(wellPath, "Binary_" + dbgOutDesc + ".png"))
     
     upperThreshImg.close()
-    return currIP
\ No newline at end of file
+    return currIP
+
+
+
+####
+#
+#  Set the threshold of an 8-bit image from the auto threshold of hist, with
+#  the same range ImageProcessor.setAutoThreshold sets from the image's own
+#  histogram.
+#
+####
+def setHistogramThreshold(ip, threshMethod, darkBackground, hist):
+    thresh = AutoThresholder().getThreshold(threshMethod, hist)
+    if darkBackground == ip.isInvertedLut():
+        ip.setThreshold(0, thresh, ImageProcessor.NO_LUT_UPDATE)
+    else:
+        ip.setThreshold(min(thresh + 1, 255), 255, ImageProcessor.NO_LUT_UPDATE)
+
+
+####
+#
+#  Convert a thresholded image to a mask, clear the exclusion zones and close
+#  it.  The image can be a crop at offset (x, y) of the full frame.
+#
+####
+def maskAndClose(currIP, exclusionBounds, offset=(0, 0)):
+    ulExclusionX, ulExclusionY, lrExclusionX, lrExclusionY = exclusionBounds
+    dx, dy = offset
+    IJ.run(currIP, "Convert to Mask", "")
+    
+    # Clear out exclusion zones
+    imgProc = currIP.getProcessor();
+    imgProc.fillRect(lrExclusionX - dx, lrExclusionY - dy, lrExclusionX + currIP.getWidth(), lrExclusionY + currIP.getHeight())
+    imgProc.fillRect(-dx, -dy, ulExclusionX, ulExclusionY)
+    
+    IJ.run(currIP, "Close-", "")
+
+
+
+####
+#
+#  Check if a channel is segmented coarse to fine.  Only fluorescent channels
+#  with a global threshold are, since their clusters cover a small part of the
+#  frame.
+#
+####
+def useCoarseToFine(cfg, chanName, darkBackground):
+    if not (cfg.hasValue(ELMConfig.coarseSegmentation) and cfg.getValue(ELMConfig.coarseSegmentation)):
+        return False
+    return darkBackground and not chanName == ELMConfig.BRIGHTFIELD and not isLocalThresholdMethod(cfg)
+
+
+
+####
+#
+#  Merge overlapping boxes, given as [x0, y0, x1, y1], until none overlap
+#
+####
+def mergeBoxes(boxes):
+    merged = True
+    while merged:
+        merged = False
+        disjoint = []
+        for box in boxes:
+            for other in disjoint:
+                if box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]:
+                    other[0] = min(other[0], box[0])
+                    other[1] = min(other[1], box[1])
+                    other[2] = max(other[2], box[2])
+                    other[3] = max(other[3], box[3])
+                    merged = True
+                    break
+            else:
+                disjoint.append(list(box))
+        boxes = disjoint
+    return boxes
+
+
+
+####
+#
+#  Find the regions of a thresholded 8-bit image that can have foreground,
+#  from a max binned copy of it, so no foreground pixel is missed.  Returns
+#  the padded, disjoint bounding boxes of the regions, as [x0, y0, x1, y1].
+#
+####
+def getCandidateBoxes(currIP):
+    ip = currIP.getProcessor()
+    width = currIP.getWidth()
+    height = currIP.getHeight()
+    scale = COARSE_DOWNSAMPLE
+
+    # Pad to a multiple of the downsample, so edge pixels are binned too
+    padded = ByteProcessor(((width + scale - 1) / scale) * scale, ((height + scale - 1) / scale) * scale)
+    padded.insert(ip, 0, 0)
+    coarse = Binner().shrink(ImagePlus("coarse", padded), scale, scale, 1, Binner.MAX)
+    coarse.getProcessor().setThreshold(ip.getMinThreshold(), ip.getMaxThreshold(), ImageProcessor.NO_LUT_UPDATE)
+    roi = ThresholdToSelection.run(coarse)
+    coarse.close()
+    if roi is None:
+        return []
+
+    if isinstance(roi, ShapeRoi):
+        rois = roi.getRois()
+    else:
+        rois = [roi]
+    boxes = []
+    for r in rois:
+        bounds = r.getBounds()
+        boxes.append([max(0, bounds.x * scale - COARSE_PADDING), max(0, bounds.y * scale - COARSE_PADDING),
+                      min(width, (bounds.x + bounds.width) * scale + COARSE_PADDING),
+                      min(height, (bounds.y + bounds.height) * scale + COARSE_PADDING)])
+    return mergeBoxes(boxes)
+
+
+
+####
+#
+#  Build the mask of a thresholded 8-bit image by masking and closing only the
+#  candidate regions found on a downsampled copy.  If coarseSegmentationTolerance
+#  is set, the mask is checked against the full frame mask, which is used
+#  instead if the fraction of differing pixels is over the tolerance.  The
+#  input image is closed.
+#
+####
+def getCoarseToFineMask(currIP, cfg, exclusionBounds, z, t, chanName):
+    ip = currIP.getProcessor()
+    boxes = getCandidateBoxes(currIP)
+
+    mask = ByteProcessor(currIP.getWidth(), currIP.getHeight())
+    for x0, y0, x1, y1 in boxes:
+        ip.setRoi(x0, y0, x1 - x0, y1 - y0)
+        crop = ip.crop()
+        crop.setThreshold(ip.getMinThreshold(), ip.getMaxThreshold(), ImageProcessor.NO_LUT_UPDATE)
+        cropIP = ImagePlus(currIP.getTitle(), crop)
+        maskAndClose(cropIP, exclusionBounds, (x0, y0))
+        mask.copyBits(cropIP.getProcessor(), x0, y0, Blitter.COPY)
+        cropIP.close()
+    ip.resetRoi()
+    # Match the pixel values and LUT of Convert to Mask
+    if not Prefs.blackBackground:
+        mask.invertLut()
+    maskIP = ImagePlus(currIP.getTitle(), mask)
+    maskIP.setCalibration(currIP.getCalibration())
+
+    if cfg.hasValue(ELMConfig.coarseSegmentationTolerance):
+        maskAndClose(currIP, exclusionBounds)
+        diffIP = ImageCalculator().run("Difference create", maskIP, currIP)
+        numDiff = diffIP.getWidth() * diffIP.getHeight() - diffIP.getProcessor().getHistogram()[0]
+        numForeground = currIP.getProcessor().getHistogram()[255]
+        diffIP.close()
+        diffFraction = float(numDiff) / max(1, numForeground)
+        if diffFraction > cfg.getValue(ELMConfig.coarseSegmentationTolerance):
+            print "\t\tZ = " + str(z) + ", T = " + str(t) +  ", chan " + chanName + ": Coarse segmentation differs from full frame by " \
+                + str(diffFraction) + " of the foreground, using the full frame mask"
+            maskIP.close()
+            return currIP
+
+    currIP.close()
+    WindowManager.setTempCurrentImage(maskIP)
+    return maskIP
+
+
+
+####
+#
+#  Check if the configured thresholdMethod is a local threshold method
+#
+####
+def isLocalThresholdMethod(cfg):
+    return cfg.hasValue(ELMConfig.thresholdMethod) and cfg.getValue(ELMConfig.thresholdMethod) in LOCAL_THRESHOLD_METHODS
+
+
+####
+#
+#  Replace the processor of currIP with a local threshold mask of it, and
+#  threshold the mask so it is converted to a mask like any other threshold.
+#  The threshold of each pixel comes from the mean and std dev of a window
+#  around it, computed from summed-area tables, so the cost doesn't depend on
+#  the window size.
+#
+####
+def localThresholdMask(currIP, cfg, darkBackground):
+    # Only required for the local threshold methods
+    from plugin.trackmate.detector import IntegralImageThresholder
+
+    radius = DEFAULT_LOCAL_THRESHOLD_RADIUS
+    if cfg.hasValue(ELMConfig.localThresholdRadius):
+        radius = cfg.getValue(ELMConfig.localThresholdRadius)
+    k = DEFAULT_LOCAL_THRESHOLD_K
+    if cfg.hasValue(ELMConfig.localThresholdK):
+        k = cfg.getValue(ELMConfig.localThresholdK)
+    mask = IntegralImageThresholder.threshold(currIP.getProcessor(), cfg.getValue(ELMConfig.thresholdMethod), \
+                                              radius, k, DEFAULT_LOCAL_THRESHOLD_R, darkBackground)
+    mask.setThreshold(255, 255, ImageProcessor.NO_LUT_UPDATE)
+    currIP.setProcessor(mask)
@@ -0,0 +1,271 @@
+# Copyright (C) 2011 - 2019, Raytheon BBN Technologies and contributors listed
+# in the AUTHORS file in TASBE Flow Analytics distribution's top directory.
+#
+# This file is part of the TASBE Flow Analytics package, and is distributed
+# under the terms of the GNU General Public License, with a linking
+# exception, as described in the file LICENSE in the TASBE Image Analysis
+# package distribution's top directory.
+
+from net.imglib2.img.display.imagej import ImageJFunctions
+from fiji.plugin.trackmate.util import TMUtils
+
+from plugin.trackmate.detector import ThresholdDetector, LocalThresholdDetector
+
+import os, time
+
+import ELMConfig, ELMImageUtils, ELMParticleLinker, ELMFrameStack
+
+DEFAULT_POLL_INTERVAL = 30.0 # seconds
+DEFAULT_TIMEOUT = 3600.0 # seconds
+
+# Spots with a lower quality (area) are dropped, as in cellStatsTracking
+MIN_SPOT_QUALITY = 150
+
+####
+#
+#  Tracks the channels of a well while it is being acquired.  Each poll hands
+#  the well its new image files, and every frame that has an image for all
+#  channels is detected and linked, in order, with an OnlineLinker per
+#  channel.  Only the wells found when live tracking starts are tracked, a
+#  well whose first image arrives later is not picked up.
+#
+####
+class LiveWell:
+
+    ###
+    #
+    ###
+    def __init__(self, cfg, wellName, wellPath, xmlFile):
+        self.wellName = wellName
+        self.wellPath = wellPath
+        self.xmlFile = xmlFile
+        self.minT = cfg.getValue(ELMConfig.minT)
+
+        self.chans = []
+        for c in range(0, cfg.getValue(ELMConfig.numChannels)):
+            if not cfg.getValue(ELMConfig.chanLabel)[c] in cfg.getValue(ELMConfig.chansToSkip):
+                self.chans.append(c)
+        trackerParams = ELMConfig.getTrackerParams(cfg)
+        self.linkers = dict()
+        for c in self.chans:
+            self.linkers[c] = ELMParticleLinker.OnlineLinker(trackerParams, wellPath, cfg.getValue(ELMConfig.chanLabel)[c])
+
+        # With thresholdFromWholeRange, each frame is thresholded from the
+        # summed histogram of every frame of its channel acquired so far,
+        # since the whole range isn't known until the acquisition ends
+        self.wholeRangeHists = None
+        if cfg.hasValue(ELMConfig.thresholdFromWholeRange) and cfg.getValue(ELMConfig.thresholdFromWholeRange) == True \
+                and not ELMImageUtils.isLocalThresholdMethod(cfg):
+            self.wholeRangeHists = dict()
+            for c in self.chans:
+                self.wholeRangeHists[c] = [0] * 256
+
+        # Image paths of the frames that have not been tracked yet, t -> c -> path
+        self.frameFiles = dict()
+        self.nextT = 0
+        # The frame that was last reported as missing channels
+        self.waitingT = None
+
+    ###
+    #  Apply the config values that differ between wells
+    ###
+    def applyConfig(self, cfg):
+        cfg.setValue(ELMConfig.minT, self.minT)
+        if self.xmlFile:
+            cfg.updateCfgWithXML(self.xmlFile)
+
+    ###
+    #  Check if an image file belongs to this well
+    ###
+    def hasFile(self, fileName):
+        return "_" + self.wellName + "_" in "_" + os.path.splitext(fileName)[0] + "_"
+
+    ###
+    #  Add a new image file of this well
+    ###
+    def addFile(self, cfg, fileName, imgPath):
+        c, z, t = cfg.getCZTFromFilename(fileName)
+        if not z == 0 or not c in self.chans:
+            return
+        self.frameFiles.setdefault(t, dict())[c] = imgPath
+
+    ###
+    #  Detect and link every frame, in order, that has an image for all
+    #  channels.  Returns the number of frames tracked.
+    ###
+    def processReadyFrames(self, cfg):
+        numFrames = 0
+        while self.nextT in self.frameFiles and len(self.frameFiles[self.nextT]) == len(self.chans):
+            start = time.time()
+            for c in self.chans:
+                wholeRangeHist = None
+                if not self.wholeRangeHists is None:
+                    wholeRangeHist = self.wholeRangeHists[c]
+                particles = detectParticles(cfg, self.frameFiles[self.nextT][c], c, self.nextT, wholeRangeHist)
+                self.linkers[c].addFrame(self.nextT, particles)
+            del self.frameFiles[self.nextT]
+            print("Tracked well " + self.wellName + " frame " + str(self.nextT) + " in " + str(time.time() - start) + " s")
+            self.nextT += 1
+            numFrames += 1
+
+        # A frame missing a channel holds up every later frame of the well
+        if not self.waitingT == self.nextT and self.getLaterFrames():
+            self.waitingT = self.nextT
+            print("Well " + self.wellName + " frame " + str(self.nextT) + " is missing channels " + \
+                  str(self.getMissingChans()) + ", waiting for them to track later frames")
+        return numFrames
+
+    ###
+    #  Get the channels the next frame has no image for yet
+    ###
+    def getMissingChans(self):
+        return [c for c in self.chans if not c in self.frameFiles.get(self.nextT, dict())]
+
+    ###
+    #  Get the frames after the next frame that have images
+    ###
+    def getLaterFrames(self):
+        return sorted([t for t in self.frameFiles if t > self.nextT])
+
+    ###
+    #  Write the track tables of every channel.  Returns the track stats of the
+    #  last channel, like cellStatsTracking.processImages.
+    ###
+    def finish(self):
+        laterFrames = self.getLaterFrames()
+        if laterFrames:
+            print("WARNING: Well " + self.wellName + " frame " + str(self.nextT) + " never got channels " + \
+                  str(self.getMissingChans()) + ", frames " + str(laterFrames[0]) + " to " + str(laterFrames[-1]) + \
+                  " were not tracked")
+        trackDat = {}
+        for c in self.chans:
+            trackDat = self.linkers[c].finish()
+        return trackDat
+
+
+####
+#
+#  Detect the particles in a single frame with the threshold detector used by
+#  cellStatsTracking, and the same threshold: imageThreshold if it is set,
+#  otherwise one computed on the frame.  If wholeRangeHist is given, the
+#  frame's histogram is added to it and the frame is thresholded from the
+#  sum.
+#
+####
+def detectParticles(cfg, imgPath, c, frame, wholeRangeHist=None):
+    chanName = cfg.getValue(ELMConfig.chanLabel)[c]
+    currIP, cropOffset = ELMImageUtils.openImage(imgPath, cfg)
+    currIP = ELMImageUtils.getGrayScaleImage(currIP, c, chanName, cfg, cropOffset)
+    if currIP is None:
+        return []
+
+    img = ImageJFunctions.wrap(currIP)
+    calibration = TMUtils.getSpatialCalibration(currIP)
+    if cfg.hasValue(ELMConfig.thresholdMethod):
+        threshMethod = cfg.getValue(ELMConfig.thresholdMethod)
+    else:
+        threshMethod = "Default"
+
+    if ELMImageUtils.isLocalThresholdMethod(cfg):
+        localRadius = ELMImageUtils.DEFAULT_LOCAL_THRESHOLD_RADIUS
+        if cfg.hasValue(ELMConfig.localThresholdRadius):
+            localRadius = cfg.getValue(ELMConfig.localThresholdRadius)
+        localK = ELMImageUtils.DEFAULT_LOCAL_THRESHOLD_K
+        if cfg.hasValue(ELMConfig.localThresholdK):
+            localK = cfg.getValue(ELMConfig.localThresholdK)
+        detector = LocalThresholdDetector(img, img, calibration, frame, True, threshMethod, localRadius, localK, \
+                                          ELMImageUtils.DEFAULT_LOCAL_THRESHOLD_R)
+    else:
+        # A threshold of 0 makes the detector compute one with the method
+        threshValue = 0
+        if not wholeRangeHist is None:
+            frameHist = currIP.getProcessor().getHistogram()
+            for i in range(0, len(wholeRangeHist)):
+                wholeRangeHist[i] += frameHist[i]
+            threshValue = ELMFrameStack.getHistogramThreshold(cfg, wholeRangeHist)
+        elif cfg.hasValue(ELMConfig.imageThreshold):
+            threshValue = cfg.getValue(ELMConfig.imageThreshold)
+        threshold = img.firstElement().createVariable()
+        threshold.setReal(threshValue)
+        detector = ThresholdDetector(img, img, calibration, threshold, frame, True, threshMethod)
+
+    if not detector.checkInput() or not detector.process():
+        print "ERROR: Detection failed for " + imgPath + ": " + str(detector.getErrorMessage())
+        currIP.close()
+        return []
+
+    # Report particle coordinates in the full frame, if the frame was cropped
+    dx = cropOffset[0] * calibration[0]
+    dy = cropOffset[1] * calibration[1]
+    particles = []
+    for spot in detector.getResult():
+        if spot.getFeature('QUALITY') < MIN_SPOT_QUALITY:
+            continue
+        particles.append({'x' : spot.getFeature('POSITION_X') + dx, 'y' : spot.getFeature('POSITION_Y') + dy,
+                          'area' : spot.getFeature('Area'), 'totalIntensity' : spot.getFeature('RawIntDen')})
+    currIP.close()
+    return particles
+
+
+####
+#
+#  Find the new image files of the input dir and hand each to the wells it
+#  belongs to.  The dir is listed once per poll for all wells, and only files
+#  not seen before are checked, so the work of a poll grows with the number
+#  of new files rather than with the frames already tracked.  Files modified
+#  within the last settleTime seconds may still be being written, so they are
+#  left for a later scan.
+#
+####
+def scanInputDir(cfg, liveWells, seenFiles, settleTime):
+    inputDir = cfg.getValue(ELMConfig.inputDir)
+    now = time.time()
+    for fileName in os.listdir(inputDir):
+        if fileName in seenFiles:
+            continue
+        if not fileName.endswith("." + cfg.getValue(ELMConfig.imgType)):
+            seenFiles.add(fileName)
+            continue
+        imgPath = os.path.join(inputDir, fileName)
+        if now - os.path.getmtime(imgPath) < settleTime:
+            continue
+        seenFiles.add(fileName)
+        for well in liveWells:
+            if well.hasFile(fileName):
+                well.applyConfig(cfg)
+                well.addFile(cfg, fileName, imgPath)
+
+
+####
+#
+#  Poll the input dir and track new frames of the wells until no new frame
+#  has arrived for liveTimeout seconds.  Returns the track stats of each well.
+#
+####
+def trackLive(cfg, liveWells):
+    pollInterval = DEFAULT_POLL_INTERVAL
+    if cfg.hasValue(ELMConfig.livePollInterval):
+        pollInterval = cfg.getValue(ELMConfig.livePollInterval)
+    timeout = DEFAULT_TIMEOUT
+    if cfg.hasValue(ELMConfig.liveTimeout):
+        timeout = cfg.getValue(ELMConfig.liveTimeout)
+
+    print("Live tracking " + str(len(liveWells)) + " wells, polling every " + str(pollInterval) + " s")
+    lastFrameTime = time.time()
+    seenFiles = set()
+    while time.time() - lastFrameTime < timeout:
+        scanInputDir(cfg, liveWells, seenFiles, pollInterval)
+        numFrames = 0
+        for well in liveWells:
+            well.applyConfig(cfg)
+            numFrames += well.processReadyFrames(cfg)
+        if numFrames > 0:
+            lastFrameTime = time.time()
+        else:
+            time.sleep(pollInterval)
+    print("No new frames for " + str(timeout) + " s, finishing live tracking")
+
+    trackDat = {}
+    for well in liveWells:
+        trackDat[well.wellName] = well.finish()
+    return trackDat
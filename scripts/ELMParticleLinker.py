@@ -0,0 +1,655 @@
+# Copyright (C) 2011 - 2019, Raytheon BBN Technologies and contributors listed
+# in the AUTHORS file in TASBE Flow Analytics distribution's top directory.
+#
+# This file is part of the TASBE Flow Analytics package, and is distributed
+# under the terms of the GNU General Public License, with a linking
+# exception, as described in the file LICENSE in the TASBE Image Analysis
+# package distribution's top directory.
+
+# Links the particles of the per-frame stats tables written by cellStats into
+# tracks, either all at once or one frame at a time as the frames are
+# acquired.  This only uses plain Python, so it doesn't need TrackMate or any
+# other part of Fiji, and writes the same spotToTrackMap, mergeEdgeSet and
+# trackSummary tables as cellStatsTracking.
+
+import os, heapq
+
+import ELMConfig, ELMTrackStats
+
+# Linking cost feature penalties, matching the TrackMate tracker configuration.
+# Gap closing and merging have no feature penalties, as in ELMTracking.
+LINKING_FEATURE_PENALTIES = {'area' : 1.0, 'x' : 1.0, 'y' : 1.0}
+
+# The cost of not linking a particle is ALTERNATIVE_COST_FACTOR times the
+# largest frame to frame cost, or times the CUTOFF_PERCENTILE percentile of
+# the gap closing and merging costs, as in the TrackMate tracker settings
+ALTERNATIVE_COST_FACTOR = 1.05
+CUTOFF_PERCENTILE = 0.9
+
+####
+#
+#  A 2D KD-tree over a list of points, used to find the candidate particles
+#  within a distance of a point without comparing against every particle.
+#
+####
+class KDTree:
+
+    ###
+    #
+    ###
+    def __init__(self, points):
+        self.points = points
+        # Each node is [point index, axis, left child, right child]
+        self.root = self.build(range(0, len(points)), 0)
+
+    ###
+    #  Build the subtree for a list of point indexes, split on the median
+    ###
+    def build(self, indexes, depth):
+        if not indexes:
+            return None
+        axis = depth % 2
+        indexes = sorted(indexes, key=lambda i: self.points[i][axis])
+        median = len(indexes) / 2
+        return [indexes[median], axis, self.build(indexes[:median], depth + 1), self.build(indexes[median + 1:], depth + 1)]
+
+    ###
+    #  Get the indexes of all points within radius of (x, y)
+    ###
+    def queryRadius(self, x, y, radius):
+        found = []
+        radiusSq = radius * radius
+        toVisit = [self.root]
+        while toVisit:
+            node = toVisit.pop()
+            if node is None:
+                continue
+            idx, axis, left, right = node
+            px, py = self.points[idx]
+            if (px - x) * (px - x) + (py - y) * (py - y) <= radiusSq:
+                found.append(idx)
+            diff = (x, y)[axis] - (px, py)[axis]
+            if diff <= radius:
+                toVisit.append(left)
+            if diff >= -radius:
+                toVisit.append(right)
+        return found
+
+
+####
+#
+#  Read the particles of a stats table written by cellStats.  Each particle is
+#  a dict with its centroid, area and total intensity (mean * area).
+#
+####
+def readParticles(statsPath):
+    statsFile = open(statsPath, "r")
+    header = [key.strip() for key in statsFile.readline().split(",")]
+    for key in ["X", "Y", "Area"]:
+        if not key in header:
+            print "ERROR: No " + key + " column in stats file " + statsPath
+            statsFile.close()
+            return None
+
+    particles = []
+    for line in statsFile:
+        if not line.strip():
+            continue
+        values = dict()
+        for key, tok in zip(header, line.split(",")):
+            tok = tok.strip()
+            if not tok == "N/A":
+                values[key] = float(tok)
+        particle = {'x' : values['X'], 'y' : values['Y'], 'area' : values['Area'], 'totalIntensity' : None}
+        if 'Mean' in values:
+            particle['totalIntensity'] = values['Mean'] * values['Area']
+        particles.append(particle)
+    statsFile.close()
+    return particles
+
+
+####
+#
+#  Compute the squared distance between two particles, the gap closing and
+#  merging cost
+#
+####
+def getSquareDistance(src, dst):
+    return (src['x'] - dst['x']) ** 2 + (src['y'] - dst['y']) ** 2
+
+
+####
+#
+#  Compute the cost of linking two particles: the squared distance, weighted
+#  by the difference in their features the same way TrackMate does
+#
+####
+def getLinkingCost(src, dst):
+    penalty = 1.0
+    for feature in LINKING_FEATURE_PENALTIES:
+        total = src[feature] + dst[feature]
+        if not total == 0:
+            penalty += LINKING_FEATURE_PENALTIES[feature] * 1.5 * abs(src[feature] - dst[feature]) / (total / 2.0)
+    return getSquareDistance(src, dst) * penalty * penalty
+
+
+####
+#
+#  Find candidate links from each source particle to the particles in a KD-tree
+#  within maxDistance, as (cost, source ID, target ID) tuples
+#
+####
+def getCandidateLinks(sources, targets, targetTree, maxDistance, costFunc=getLinkingCost):
+    maxCost = maxDistance * maxDistance
+    candidates = []
+    for src in sources:
+        for idx in targetTree.queryRadius(src['x'], src['y'], maxDistance):
+            cost = costFunc(src, targets[idx])
+            if cost <= maxCost:
+                candidates.append((cost, src['id'], targets[idx]['id']))
+    return candidates
+
+
+####
+#
+#  Get the p percentile of a list of values, the way TrackMate computes the
+#  cutoff of the alternative cost
+#
+####
+def getPercentile(values, p):
+    values = sorted(values)
+    pos = p * (len(values) + 1)
+    if pos < 1:
+        return values[0]
+    if pos >= len(values):
+        return values[-1]
+    lower = values[int(pos) - 1]
+    upper = values[int(pos)]
+    return lower + (pos - int(pos)) * (upper - lower)
+
+
+####
+#
+#  Solve the linear assignment problem of a set of candidate links, as
+#  TrackMate's Jaqaman linker does.  Its cost matrix has the link costs, an
+#  alternative cost for leaving each source and each target unlinked, and
+#  the smallest link cost for every link in the transposed block, so taking a
+#  link changes the total cost by cost + minCost - 2 * alternativeCost.  The
+#  links that minimize the total are found with successive shortest
+#  augmenting paths over the sparse candidate links, where every source can
+#  also take its own "unlinked" target.  Returns the (source ID, target ID)
+#  links taken.
+#
+####
+def solveAssignment(candidates, alternativeCost):
+    if not candidates:
+        return []
+    minCost = min([cost for cost, srcId, dstId in candidates])
+    linkCosts = [cost + minCost - 2.0 * alternativeCost for cost, srcId, dstId in candidates]
+    # Every source takes exactly one target, so shifting all of its costs by
+    # the same amount keeps the assignment and makes the costs non-negative
+    shift = max(0.0, -min(linkCosts))
+
+    srcIds = sorted(set([srcId for cost, srcId, dstId in candidates]))
+    dstIds = sorted(set([dstId for cost, srcId, dstId in candidates]))
+    srcIdx = dict([(srcId, i) for i, srcId in enumerate(srcIds)])
+    dstIdx = dict([(dstId, j) for j, dstId in enumerate(dstIds)])
+    # Targets past the real ones are the unlinked targets of each source
+    numDst = len(dstIds)
+    adjacency = [[(numDst + i, shift)] for i in range(0, len(srcIds))]
+    for (cost, srcId, dstId), linkCost in zip(candidates, linkCosts):
+        adjacency[srcIdx[srcId]].append((dstIdx[dstId], linkCost + shift))
+
+    # Dual potentials, with u[i] + v[j] <= cost for every link and equality
+    # for the links taken
+    u = [0.0] * len(srcIds)
+    v = [0.0] * (numDst + len(srcIds))
+    srcOfDst = dict()
+    dstOfSrc = dict()
+    for s in range(0, len(srcIds)):
+        # Dijkstra over the reduced costs, from s to the nearest free target
+        srcDist = {s : 0.0}
+        dstDist = dict()
+        prevSrc = dict()
+        heap = []
+        for j, cost in adjacency[s]:
+            heapq.heappush(heap, (cost - u[s] - v[j], j, s))
+        while True:
+            dist, j, i = heapq.heappop(heap)
+            if j in dstDist:
+                continue
+            dstDist[j] = dist
+            prevSrc[j] = i
+            if not j in srcOfDst:
+                break
+            i2 = srcOfDst[j]
+            srcDist[i2] = dist
+            for j2, cost in adjacency[i2]:
+                if not j2 in dstDist:
+                    heapq.heappush(heap, (dist + cost - u[i2] - v[j2], j2, i2))
+
+        # Update the potentials so the path is tight, then augment along it
+        endDist = dist
+        for i, d in srcDist.items():
+            if d < endDist:
+                u[i] += endDist - d
+        for j2, d in dstDist.items():
+            if d < endDist:
+                v[j2] -= endDist - d
+        while True:
+            i = prevSrc[j]
+            prevDst = dstOfSrc.get(i)
+            srcOfDst[j] = i
+            dstOfSrc[i] = j
+            if i == s:
+                break
+            j = prevDst
+
+    return [(srcIds[srcOfDst[j]], dstIds[j]) for j in sorted(srcOfDst.keys()) if j < numDst]
+
+
+####
+#
+#  Solve the frame to frame links among a set of candidates
+#
+####
+def getFrameToFrameLinks(candidates):
+    if not candidates:
+        return []
+    alternativeCost = ALTERNATIVE_COST_FACTOR * max([cost for cost, srcId, dstId in candidates])
+    return solveAssignment(candidates, alternativeCost)
+
+
+####
+#
+#  Solve the gap closing and merging links among a set of candidates
+#
+####
+def getSegmentLinks(candidates):
+    if not candidates:
+        return []
+    alternativeCost = ALTERNATIVE_COST_FACTOR * getPercentile([cost for cost, srcId, dstId in candidates], CUTOFF_PERCENTILE)
+    return solveAssignment(candidates, alternativeCost)
+
+
+####
+#
+#  Link particles into tracks.  frames maps a frame number to the list of
+#  particles in it, and every particle needs a unique 'id'.  Particles are
+#  first linked frame to frame into segments, then segment ends are linked to
+#  the starts of later segments (gap closing) or to the middle of another
+#  segment in the next frame (merging).  Each step solves the assignment of
+#  its candidate links like TrackMate's sparse LAP tracker.  Returns the list
+#  of (source ID, target ID) edges.
+#
+####
+def linkParticles(frames, trackerParams):
+    linkingMaxDistance = float(trackerParams[ELMConfig.linkingMaxDistance])
+    gapClosingMaxDistance = float(trackerParams[ELMConfig.gapClosingMaxDistance])
+    gapClosingMaxFrameGap = int(trackerParams[ELMConfig.gapClosingMaxFrameGap])
+    mergingMaxDistance = float(trackerParams[ELMConfig.mergingMaxDistance])
+
+    frameNums = sorted(frames.keys())
+    trees = dict()
+    for frame in frameNums:
+        trees[frame] = KDTree([(p['x'], p['y']) for p in frames[frame]])
+
+    edges = []
+    incoming = dict()
+    outgoing = dict()
+    def addEdge(srcId, dstId):
+        edges.append((srcId, dstId))
+        incoming.setdefault(dstId, []).append(srcId)
+        outgoing.setdefault(srcId, []).append(dstId)
+
+    # Frame to frame linking
+    for frame in frameNums:
+        if not frame + 1 in frames:
+            continue
+        candidates = getCandidateLinks(frames[frame], frames[frame + 1], trees[frame + 1], linkingMaxDistance)
+        for srcId, dstId in getFrameToFrameLinks(candidates):
+            addEdge(srcId, dstId)
+
+    # Gap closing and merging, from the segment ends.  Gaps are closed to
+    # segment starts up to gapClosingMaxFrameGap frames later, and merges are
+    # to the middle of a segment, neither its first nor its last particle.
+    candidates = []
+    for frame in frameNums:
+        ends = [p for p in frames[frame] if not p['id'] in outgoing]
+        if not ends:
+            continue
+        for gap in range(1, gapClosingMaxFrameGap + 1):
+            if not frame + gap in frames:
+                continue
+            candidates += [(cost, srcId, dstId) for cost, srcId, dstId in \
+                           getCandidateLinks(ends, frames[frame + gap], trees[frame + gap], gapClosingMaxDistance, getSquareDistance) \
+                           if not dstId in incoming]
+        if frame + 1 in frames:
+            candidates += [(cost, srcId, dstId) for cost, srcId, dstId in \
+                           getCandidateLinks(ends, frames[frame + 1], trees[frame + 1], mergingMaxDistance, getSquareDistance) \
+                           if dstId in incoming and dstId in outgoing]
+
+    for srcId, dstId in getSegmentLinks(candidates):
+        addEdge(srcId, dstId)
+
+    return edges
+
+
+####
+#
+#  Group linked particles into tracks.  Returns a list of (track ID, list of
+#  particle IDs) with the tracks numbered in order of their first particle.
+#  Particles without any links are not part of a track.
+#
+####
+def getTracks(edges):
+    parent = dict()
+    def find(pId):
+        root = pId
+        while not parent[root] == root:
+            root = parent[root]
+        while not parent[pId] == root:
+            parent[pId], pId = root, parent[pId]
+        return root
+
+    for srcId, dstId in edges:
+        parent.setdefault(srcId, srcId)
+        parent.setdefault(dstId, dstId)
+        srcRoot = find(srcId)
+        dstRoot = find(dstId)
+        if not srcRoot == dstRoot:
+            parent[max(srcRoot, dstRoot)] = min(srcRoot, dstRoot)
+
+    trackSpots = dict()
+    for pId in sorted(parent.keys()):
+        trackSpots.setdefault(find(pId), []).append(pId)
+    return [(tId, trackSpots[root]) for tId, root in enumerate(sorted(trackSpots.keys()))]
+
+
+####
+#
+#  Index the edges of a set of tracks: for every spot ID, the list of spot IDs
+#  linked by incoming edges (ancestors) and by outgoing edges (descendants).
+#
+####
+def buildEdgeIndex(spotIds, edges):
+    incoming = dict([(spotId, []) for spotId in spotIds])
+    outgoing = dict([(spotId, []) for spotId in spotIds])
+    for srcId, dstId in edges:
+        incoming[dstId].append(srcId)
+        outgoing[srcId].append(dstId)
+    return incoming, outgoing
+
+
+####
+#
+#  Label a spot and its ancestors with a sub-track, stopping at merges.  This
+#  walks the ancestors with an explicit stack rather than recursion, so long
+#  tracks don't hit the recursion limit, and each spot is visited once.
+#
+####
+def labelSubTrackAncestors(edgeIndex, frames, spotToSubTrackMap, spotId, subTrackId, trackId, lastSpot):
+    incoming, outgoing = edgeIndex
+    visited = set()
+    toLabel = [spotId]
+    while toLabel:
+        spotId = toLabel.pop()
+        if spotId in visited:
+            continue
+        visited.add(spotId)
+
+        if spotId in spotToSubTrackMap:
+            if lastSpot:
+                print("Warning! Adding last Spot " + str(spotId) + ' to spotToSubTrackMap, but it is already entered!')
+            else:
+                print("Warning! Adding Spot " + str(spotId) + ' to spotToSubTrackMap, but it is already entered!')
+
+        spotToSubTrackMap[spotId] = [str(subTrackId), str(trackId), str(frames[spotId])]
+
+        # Stop labeling at merges
+        spotIncoming = incoming[spotId]
+        if len(spotIncoming) + len(outgoing[spotId]) > 2:
+            continue
+        # Reversed, so ancestors are labeled in the same order as the edges
+        toLabel.extend(reversed(spotIncoming))
+
+
+####
+#
+#  Determine sub-tracks within each track.  Since tracks can merge, we want to
+#  keep track of which track a spot is in prior to the merge.  spotIds lists
+#  every spot, trackIdOf maps a spot ID to its track ID and tracks is a list of
+#  (track ID, list of spot IDs).  Returns a map from spot ID to
+#  [sub-track ID, track ID, frame].
+#
+####
+def labelSubTracks(edgeIndex, frames, spotIds, trackIdOf, tracks):
+    incoming, outgoing = edgeIndex
+
+    spotToSubTrackMap = {}
+    subTrackCount = {}
+    for spotId in spotIds:
+        # We have a merge if we have multiple incoming edges
+        ancestorIds = incoming[spotId]
+        if len(ancestorIds) < 2:
+            continue
+
+        trackId = trackIdOf[spotId]
+        subTrackId = subTrackCount.get(trackId, 1)
+        for ancestorId in ancestorIds:
+            labelSubTrackAncestors(edgeIndex, frames, spotToSubTrackMap, ancestorId, subTrackId, trackId, False)
+            subTrackId += 1
+        subTrackCount[trackId] = subTrackId
+
+    # Spots after the last merge still need to be labeled
+    for tId, trackSpotIds in tracks:
+        lastSpotId = None
+        for spotId in trackSpotIds:
+            if len(outgoing[spotId]) == 0 and len(incoming[spotId]) > 0:
+                lastSpotId = spotId
+
+        subTrackId = subTrackCount.get(tId, 1)
+        if not lastSpotId == None:
+            labelSubTrackAncestors(edgeIndex, frames, spotToSubTrackMap, lastSpotId, subTrackId, tId, True)
+
+    return spotToSubTrackMap
+
+
+####
+#
+#  Write the spotToTrackMap, mergeEdgeSet and trackSummary tables of a set of
+#  linked particles to outPath.  particles maps a particle ID to the particle.
+#  Returns the track stats columns, in the same form as cellStatsTracking.
+#
+####
+def writeTrackTables(particles, edges, outPath, chanName):
+    tracks = getTracks(edges)
+    print "Linked " + str(len(particles)) + " particles into " + str(len(tracks)) + " tracks."
+
+    spotIds = sorted(particles.keys())
+    edgeIndex = buildEdgeIndex(spotIds, edges)
+    spotFrames = dict([(pId, float(particles[pId]['frame'])) for pId in spotIds])
+    trackIdOf = dict()
+    for tId, trackSpotIds in tracks:
+        for spotId in trackSpotIds:
+            trackIdOf[spotId] = tId
+    spotToSubTrackMap = labelSubTracks(edgeIndex, spotFrames, spotIds, trackIdOf, tracks)
+
+    trackFile = open(os.path.join(outPath, chanName + "_spotToTrackMap.csv"), 'w')
+    trackFile.write('Spot Id, Track Sub Id, Track Id, Frame \n')
+    for spotId in spotToSubTrackMap:
+        trackFile.write(str(spotId) + ', ' + ','.join(spotToSubTrackMap[spotId]) + '\n')
+    trackFile.close()
+
+    trackFile = open(os.path.join(outPath, chanName + "_mergeEdgeSet.csv"), 'w')
+    trackFile.write('Track Id, Spot Id, Spot Id \n')
+    for srcId, dstId in edges:
+        if not spotToSubTrackMap[srcId][0] == spotToSubTrackMap[dstId][0]:
+            trackFile.write(str(trackIdOf[srcId]) + ', ' + str(srcId) + ', ' + str(dstId) + '\n')
+    trackFile.close()
+
+    # Stats only cover spots in tracks, like TrackMate
+    trackedIds = [spotId for spotId in spotIds if spotId in trackIdOf]
+    spotColumns = {'Track Id' : [trackIdOf[spotId] for spotId in trackedIds],
+                   'Frame' : [spotFrames[spotId] for spotId in trackedIds],
+                   'X' : [particles[spotId]['x'] for spotId in trackedIds],
+                   'Y' : [particles[spotId]['y'] for spotId in trackedIds],
+                   'Total Intensity' : [particles[spotId]['totalIntensity'] for spotId in trackedIds]}
+    spotIndex = dict([(spotId, i) for i, spotId in enumerate(trackedIds)])
+    edgeColumns = {'Source' : [spotIndex[srcId] for srcId, dstId in edges],
+                   'Target' : [spotIndex[dstId] for srcId, dstId in edges]}
+    trackDat = ELMTrackStats.computeTrackStats(spotColumns, edgeColumns)
+    ELMTrackStats.writeTrackSummary(os.path.join(outPath, chanName + "_trackSummary.csv"), trackDat)
+
+    return trackDat
+
+
+####
+#
+#  Link the particles of a channel and write the spotToTrackMap, mergeEdgeSet
+#  and trackSummary tables to outPath.  statsPaths maps a frame number to the
+#  stats table of that frame.
+#
+####
+def linkStatsFiles(statsPaths, trackerParams, outPath, chanName):
+    # Read particles, numbering them in frame order
+    frames = dict()
+    particles = dict()
+    for frame in sorted(statsPaths.keys()):
+        frameParticles = readParticles(statsPaths[frame])
+        if frameParticles is None:
+            return None
+        for particle in frameParticles:
+            particle['id'] = len(particles)
+            particle['frame'] = frame
+            particles[particle['id']] = particle
+        frames[frame] = frameParticles
+
+    edges = linkParticles(frames, trackerParams)
+    return writeTrackTables(particles, edges, outPath, chanName)
+
+
+####
+#
+#  Links particles one frame at a time, as the frames are acquired.  Only the
+#  open track tails, the particles without an outgoing link from the last
+#  gapClosingMaxFrameGap frames, are linked against, so the time to add a
+#  frame doesn't depend on the number of frames before it.  The same linking,
+#  gap closing and merging steps as linkParticles are used.
+#
+#  Each frame's particles and links are appended to the <chan>_liveSpots.csv
+#  and <chan>_liveEdges.csv tables.  The live track ID of a particle is the ID
+#  of the first particle of its track, when the particle was added.  When
+#  tracks merge, the merged track takes the ID of the older one from then on.
+#
+####
+class OnlineLinker:
+
+    ###
+    #
+    ###
+    def __init__(self, trackerParams, outPath, chanName):
+        self.linkingMaxDistance = float(trackerParams[ELMConfig.linkingMaxDistance])
+        self.gapClosingMaxDistance = float(trackerParams[ELMConfig.gapClosingMaxDistance])
+        self.gapClosingMaxFrameGap = int(trackerParams[ELMConfig.gapClosingMaxFrameGap])
+        self.mergingMaxDistance = float(trackerParams[ELMConfig.mergingMaxDistance])
+        self.outPath = outPath
+        self.chanName = chanName
+
+        # Particles without an outgoing link, by frame
+        self.tails = dict()
+        # Every particle and link so far, for the final track tables
+        self.particles = dict()
+        self.edges = []
+        # Union find of particle IDs, the root of a track is its first particle
+        self.parent = dict()
+
+        self.spotFile = open(os.path.join(outPath, chanName + "_liveSpots.csv"), 'w')
+        self.spotFile.write('Spot Id, Track Id, Frame, X, Y, Area, Total Intensity\n')
+        self.edgeFile = open(os.path.join(outPath, chanName + "_liveEdges.csv"), 'w')
+        self.edgeFile.write('Spot Id, Spot Id\n')
+
+    ###
+    #  Get the live track ID of a particle
+    ###
+    def getTrackId(self, pId):
+        root = pId
+        while not self.parent[root] == root:
+            root = self.parent[root]
+        while not self.parent[pId] == root:
+            self.parent[pId], pId = root, self.parent[pId]
+        return root
+
+    ###
+    #
+    ###
+    def addEdge(self, srcId, dstId):
+        self.edges.append((srcId, dstId))
+        srcRoot = self.getTrackId(srcId)
+        dstRoot = self.getTrackId(dstId)
+        if not srcRoot == dstRoot:
+            self.parent[max(srcRoot, dstRoot)] = min(srcRoot, dstRoot)
+        self.edgeFile.write(str(srcId) + ', ' + str(dstId) + '\n')
+
+    ###
+    #  Link the particles of the next frame to the open track tails, and
+    #  append them to the live tables
+    ###
+    def addFrame(self, frame, particles):
+        for particle in particles:
+            particle['id'] = len(self.particles)
+            particle['frame'] = frame
+            self.particles[particle['id']] = particle
+            self.parent[particle['id']] = particle['id']
+        tree = KDTree([(p['x'], p['y']) for p in particles])
+
+        # Frame to frame linking
+        linkedTails = set()
+        linkedParticles = set()
+        if frame - 1 in self.tails:
+            candidates = getCandidateLinks(self.tails[frame - 1], particles, tree, self.linkingMaxDistance)
+            for srcId, dstId in getFrameToFrameLinks(candidates):
+                linkedTails.add(srcId)
+                linkedParticles.add(dstId)
+                self.addEdge(srcId, dstId)
+
+        # Gap closing and merging, from the tails that are still open.  The
+        # later frames aren't known yet, so a tail of the last frame can merge
+        # into any particle that was just linked, not only the middle of a
+        # segment, and the assignment is solved over this frame's candidates.
+        candidates = []
+        for tailFrame in self.tails:
+            tails = [p for p in self.tails[tailFrame] if not p['id'] in linkedTails]
+            if tailFrame == frame - 1:
+                candidates += [(cost, srcId, dstId) for cost, srcId, dstId in \
+                               getCandidateLinks(tails, particles, tree, self.mergingMaxDistance, getSquareDistance) \
+                               if dstId in linkedParticles]
+            candidates += [(cost, srcId, dstId) for cost, srcId, dstId in \
+                           getCandidateLinks(tails, particles, tree, self.gapClosingMaxDistance, getSquareDistance) \
+                           if not dstId in linkedParticles]
+        for srcId, dstId in getSegmentLinks(candidates):
+            linkedTails.add(srcId)
+            self.addEdge(srcId, dstId)
+
+        # Update the open tails, dropping tails too old to close a gap to the
+        # next frame
+        for tailFrame in self.tails.keys():
+            if tailFrame + self.gapClosingMaxFrameGap <= frame:
+                del self.tails[tailFrame]
+            else:
+                self.tails[tailFrame] = [p for p in self.tails[tailFrame] if not p['id'] in linkedTails]
+        self.tails[frame] = list(particles)
+
+        for particle in particles:
+            data = [particle['id'], self.getTrackId(particle['id']), frame, particle['x'], particle['y'], particle['area'], particle['totalIntensity']]
+            self.spotFile.write(', '.join(['' if val is None else str(val) for val in data]) + '\n')
+        self.spotFile.flush()
+        self.edgeFile.flush()
+
+    ###
+    #  Close the live tables and write the track tables of every frame added
+    ###
+    def finish(self):
+        self.spotFile.close()
+        self.edgeFile.close()
+        return writeTrackTables(self.particles, self.edges, self.outPath, self.chanName)
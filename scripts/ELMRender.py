@@ -0,0 +1,262 @@
+# Copyright (C) 2011 - 2019, Raytheon BBN Technologies and contributors listed
+# in the AUTHORS file in TASBE Flow Analytics distribution's top directory.
+#
+# This file is part of the TASBE Flow Analytics package, and is distributed
+# under the terms of the GNU General Public License, with a linking
+# exception, as described in the file LICENSE in the TASBE Image Analysis
+# package distribution's top directory.
+
+from ij import ImagePlus, VirtualStack
+from ij.plugin.filter import AVI_Writer
+
+from fiji.plugin.trackmate.io import TmXmlReader
+
+from java.awt import Color
+from java.io import File
+from java.lang import Long
+from java.util.concurrent import Callable, Executors, TimeUnit
+
+import os, threading
+
+import ELMImageUtils, ELMTrackModelIO
+
+# Number of previous frames of each track drawn behind its spots
+TRACK_DISPLAY_DEPTH = 2
+AVI_FRAME_RATE = 7
+AVI_JPEG_QUALITY = 90
+
+# Renders submitted to run in the background
+renderExecutor = None
+renderExecutorLock = threading.Lock()
+
+####
+#
+#  Get the path of the list of frames that a channel was tracked on
+#
+####
+def getFrameListPath(wellPath, chanName):
+    return os.path.join(wellPath, chanName + "_frames.txt")
+
+
+####
+#
+#  Save the list of frames that a channel was tracked on, so the overlay video
+#  can be rendered later from the track model
+#
+####
+def saveFrameList(wellPath, chanName, framePaths):
+    frameFile = open(getFrameListPath(wellPath, chanName), "w")
+    for path in framePaths:
+        frameFile.write(path + "\n")
+    frameFile.close()
+
+
+####
+#
+#  Load the list of frames that a channel was tracked on
+#
+####
+def loadFrameList(wellPath, chanName):
+    frameFile = open(getFrameListPath(wellPath, chanName), "r")
+    framePaths = [line.strip() for line in frameFile if line.strip()]
+    frameFile.close()
+    return framePaths
+
+
+####
+#
+#  Get the overlay color of a track, spreading consecutive track IDs around
+#  the hue circle
+#
+####
+def getTrackColor(trackId):
+    if trackId is None:
+        return Color.white
+    return Color.getHSBColor((trackId * 0.618034) % 1.0, 1.0, 1.0)
+
+
+####
+#
+#  A virtual stack of the color frames of a channel with the spots and recent
+#  track edges drawn over them.  Each frame is read and drawn only when it is
+#  requested, so writing the video streams one frame at a time rather than
+#  holding the whole stack.
+#
+####
+class OverlayFrameStack(VirtualStack):
+
+    ###
+    #  frameSpots maps a frame to a list of (x, y, radius, name, track ID), and
+    #  frameEdges maps a frame to a list of (x0, y0, x1, y1, track ID) for the
+    #  edges ending in it, in full frame pixel coordinates
+    ###
+    def __init__(self, width, height, framePaths, cfg, frameSpots, frameEdges):
+        VirtualStack.__init__(self, width, height, None, None)
+        self.framePaths = framePaths
+        self.cfg = cfg
+        self.frameSpots = frameSpots
+        self.frameEdges = frameEdges
+
+    ###
+    #  n is 1-based like all ImageStack indices
+    ###
+    def getProcessor(self, n):
+        frame = n - 1
+        currIP, cropOffset = ELMImageUtils.openImage(self.framePaths[frame], self.cfg)
+        ip = currIP.getProcessor().convertToRGB()
+        currIP.close()
+        dx, dy = cropOffset
+
+        for edgeFrame in range(frame - TRACK_DISPLAY_DEPTH + 1, frame + 1):
+            for x0, y0, x1, y1, trackId in self.frameEdges.get(edgeFrame, []):
+                ip.setColor(getTrackColor(trackId))
+                ip.drawLine(int(round(x0 - dx)), int(round(y0 - dy)), int(round(x1 - dx)), int(round(y1 - dy)))
+        for x, y, radius, name, trackId in self.frameSpots.get(frame, []):
+            ip.setColor(getTrackColor(trackId))
+            r = max(1, int(round(radius)))
+            ip.drawOval(int(round(x - dx)) - r, int(round(y - dy)) - r, 2 * r, 2 * r)
+            if name:
+                ip.drawString(name, int(round(x - dx)) + r, int(round(y - dy)))
+        return ip
+
+    ###
+    #
+    ###
+    def getPixels(self, n):
+        return self.getProcessor(n).getPixels()
+
+    ###
+    #  Frames are read only
+    ###
+    def setPixels(self, pixels, n):
+        pass
+
+    ###
+    #
+    ###
+    def getSize(self):
+        return len(self.framePaths)
+
+    ###
+    #
+    ###
+    def getSliceLabel(self, n):
+        return os.path.basename(self.framePaths[n - 1])
+
+
+####
+#
+#  Render the track overlay video of a channel from its saved track model and
+#  frame list.  The video is written one frame at a time.
+#
+####
+def renderTrackOverlay(cfg, wellPath, chanName):
+    if not os.path.exists(getFrameListPath(wellPath, chanName)):
+        print "No frame list for " + chanName + " in " + wellPath + ", skipping render"
+        return False
+    framePaths = loadFrameList(wellPath, chanName)
+
+    # Prefer the compressed track model, fall back on TrackMate XML
+    modelPath = ELMTrackModelIO.getTrackModelPath(wellPath, chanName)
+    xmlPath = os.path.join(wellPath, chanName + "_trackModel.xml")
+    if os.path.exists(modelPath):
+        model = ELMTrackModelIO.loadTrackModel(modelPath, False)
+        if model is None:
+            return False
+    elif os.path.exists(xmlPath):
+        reader = TmXmlReader(File(xmlPath))
+        model = reader.getModel()
+        if not reader.isReadingOk():
+            print "ERROR: Could not read track model " + xmlPath + ": " + reader.getErrorMessage()
+            return False
+    else:
+        print "No track model for " + chanName + " in " + wellPath + ", skipping render"
+        return False
+
+    # Gather what is drawn in each frame, so frames don't query the model
+    trackModel = model.getTrackModel()
+    frameSpots = dict()
+    for spot in model.getSpots().iterable(True):
+        frame = int(spot.getFeature('FRAME'))
+        trackId = trackModel.trackIDOf(spot)
+        frameSpots.setdefault(frame, []).append((spot.getFeature('POSITION_X'), spot.getFeature('POSITION_Y'), \
+                                                 spot.getFeature('RADIUS'), spot.getName(), trackId))
+    frameEdges = dict()
+    for edge in trackModel.edgeSet():
+        src = trackModel.getEdgeSource(edge)
+        dst = trackModel.getEdgeTarget(edge)
+        frame = int(dst.getFeature('FRAME'))
+        frameEdges.setdefault(frame, []).append((src.getFeature('POSITION_X'), src.getFeature('POSITION_Y'), \
+                                                 dst.getFeature('POSITION_X'), dst.getFeature('POSITION_Y'), trackModel.trackIDOf(edge)))
+
+    firstImage, cropOffset = ELMImageUtils.openImage(framePaths[0], cfg)
+    width = firstImage.getWidth()
+    height = firstImage.getHeight()
+    firstImage.close()
+
+    imp = ImagePlus(chanName + " tracks", OverlayFrameStack(width, height, framePaths, cfg, frameSpots, frameEdges))
+    imp.getCalibration().fps = AVI_FRAME_RATE
+    aviPath = os.path.join(wellPath, chanName + "_out.avi")
+    AVI_Writer().writeImage(imp, aviPath, AVI_Writer.JPEG_COMPRESSION, AVI_JPEG_QUALITY)
+    imp.close()
+    print "Rendered " + aviPath
+    return True
+
+
+####
+#
+#  Renders a channel's overlay video, in the background worker
+#
+####
+class RenderJob(Callable):
+
+    ###
+    #
+    ###
+    def __init__(self, cfg, wellPath, chanName):
+        self.cfg = cfg
+        self.wellPath = wellPath
+        self.chanName = chanName
+
+    ###
+    #
+    ###
+    def call(self):
+        try:
+            return renderTrackOverlay(self.cfg, self.wellPath, self.chanName)
+        except Exception, e:
+            print "ERROR: Rendering " + self.chanName + " in " + self.wellPath + " failed: " + str(e)
+            return False
+
+
+####
+#
+#  Queue a channel's overlay video to be rendered by a background worker,
+#  so tracking can continue with the next channel or well
+#
+####
+def submitRender(cfg, wellPath, chanName):
+    global renderExecutor
+    # Channels can be tracked concurrently, so only one of them creates the worker
+    renderExecutorLock.acquire()
+    try:
+        if renderExecutor is None:
+            renderExecutor = Executors.newSingleThreadExecutor()
+        renderExecutor.submit(RenderJob(cfg, wellPath, chanName))
+    finally:
+        renderExecutorLock.release()
+
+
+####
+#
+#  Wait for all of the queued renders to finish
+#
+####
+def waitForRenders():
+    global renderExecutor
+    if renderExecutor is None:
+        return
+    print "Waiting for background renders to finish..."
+    renderExecutor.shutdown()
+    renderExecutor.awaitTermination(Long.MAX_VALUE, TimeUnit.SECONDS)
+    renderExecutor = None
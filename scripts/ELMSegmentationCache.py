@@ -0,0 +1,275 @@
+# Copyright (C) 2011 - 2019, Raytheon BBN Technologies and contributors listed
+# in the AUTHORS file in TASBE Flow Analytics distribution's top directory.
+#
+# This file is part of the TASBE Flow Analytics package, and is distributed
+# under the terms of the GNU General Public License, with a linking
+# exception, as described in the file LICENSE in the TASBE Image Analysis
+# package distribution's top directory.
+
+from java.io import FileInputStream, FileOutputStream, BufferedInputStream, BufferedOutputStream, DataInputStream, DataOutputStream
+from java.util.zip import GZIPInputStream, GZIPOutputStream
+
+from jarray import zeros
+
+import os, hashlib, threading
+
+import ELMConfig, ELMFrameStack, ELMStackReader, ELMArrayStore
+
+# A cache of the particles and filtered mask of each segmented image, keyed by
+# a hash of the image and everything that changes its segmentation, so
+# unchanged images are not thresholded and analyzed again.  Each entry is a
+# compressed file named by its key:
+#   magic, version
+#   width, height of the mask
+#   number of stats columns, then the name, number of values and values of
+#   each column (-1 values for a missing column)
+#   the unfiltered particle table, as columns in the same form as the stats
+#   number of bytes, then the bytes of the bit-packed mask
+# The unfiltered table is kept with the entry, so a hit restores the table of
+# the run that is served from the cache rather than of the last run.
+# The least recently used entries are removed when the cache grows past its
+# size limit, down to CACHE_EVICT_FRACTION of it, so the cache dir is only
+# scanned once in a while.
+SEGMENTATION_CACHE_MAGIC = "ELMSegmentation"
+SEGMENTATION_CACHE_VERSION = 2
+SEGMENTATION_CACHE_SUFFIX = ".seg.gz"
+SEGMENTATION_CACHE_DIR = "segmentationCache"
+DEFAULT_CACHE_SIZE_MB = 1024
+CACHE_EVICT_FRACTION = 0.9
+
+# Params that change the particles of an image, on top of the mask params
+SEGMENTATION_PARAMS = ELMArrayStore.MASK_PARAMS + [ELMConfig.areaMaxPercentThreshold, ELMConfig.areaAbsoluteThreshold,
+                                                   ELMConfig.pixelWidth, ELMConfig.pixelHeight]
+
+# Content hashes of the files hashed so far, by file signature, so a file
+# that holds several channels is only read once
+contentHashes = dict()
+
+# Total size of the entries in each cache dir, counted by a scan of the dir
+# the first time an entry is saved to it and kept up to date as entries are
+# saved and evicted
+cacheSizes = dict()
+cacheSizesLock = threading.Lock()
+
+####
+#
+#  Check if the segmentation cache is enabled
+#
+####
+def isEnabled(cfg):
+    return cfg.hasValue(ELMConfig.segmentationCache) and cfg.getValue(ELMConfig.segmentationCache)
+
+
+####
+#
+#  Get the dir the cache entries are kept in
+#
+####
+def getCacheDir(cfg):
+    if cfg.hasValue(ELMConfig.segmentationCacheDir):
+        return cfg.getValue(ELMConfig.segmentationCacheDir)
+    return os.path.join(cfg.getValue(ELMConfig.outputDir), SEGMENTATION_CACHE_DIR)
+
+
+####
+#
+#  Get the MD5 of the contents of a file
+#
+####
+def getContentHash(path):
+    signature = ELMFrameStack.getFileSignature(path)
+    if signature in contentHashes:
+        return contentHashes[signature]
+    md5 = hashlib.md5()
+    contentFile = open(path, "rb")
+    block = contentFile.read(1 << 20)
+    while block:
+        md5.update(block)
+        block = contentFile.read(1 << 20)
+    contentFile.close()
+    contentHashes[signature] = md5.hexdigest()
+    return contentHashes[signature]
+
+
+####
+#
+#  Get the cache key of an image.  The image is identified by its path, size
+#  and modification time, or by the hash of its contents if
+#  segmentationCacheByContent is set, so moved or copied images are found.
+#
+####
+def getCacheKey(cfg, c, imgPath, thresh, minSize, minCircularity):
+    if cfg.hasValue(ELMConfig.segmentationCacheByContent) and cfg.getValue(ELMConfig.segmentationCacheByContent):
+        stackPlane = ELMStackReader.getStackPlane(imgPath)
+        if stackPlane is None:
+            source = "content=" + getContentHash(imgPath)
+        else:
+            source = "content=" + getContentHash(stackPlane[0]) + ":" + str(stackPlane[1])
+    else:
+        source = ELMFrameStack.getFileSignature(imgPath)
+    extra = [c, source, "thresh=" + str(thresh), "minSize=" + str(minSize), "minCircularity=" + str(minCircularity)]
+    return cfg.getParamsHash(SEGMENTATION_PARAMS, extra)
+
+
+####
+#
+#  Get the path of a cache entry
+#
+####
+def getEntryPath(cfg, cacheKey):
+    return os.path.join(getCacheDir(cfg), cacheKey + SEGMENTATION_CACHE_SUFFIX)
+
+
+####
+#
+#  Write a dict of columns to a cache entry
+#
+####
+def writeColumns(out, columns):
+    headings = sorted(columns.keys())
+    out.writeInt(len(headings))
+    for heading in headings:
+        out.writeUTF(heading)
+        values = columns[heading]
+        if values is None:
+            out.writeInt(-1)
+            continue
+        out.writeInt(len(values))
+        for value in values:
+            out.writeDouble(value)
+
+
+####
+#
+#  Read a dict of columns written by writeColumns
+#
+####
+def readColumns(entryIn):
+    columns = dict()
+    for i in range(0, entryIn.readInt()):
+        heading = entryIn.readUTF()
+        numValues = entryIn.readInt()
+        if numValues < 0:
+            columns[heading] = None
+        else:
+            columns[heading] = [entryIn.readDouble() for j in range(0, numValues)]
+    return columns
+
+
+####
+#
+#  Add the filtered mask, the stats and the unfiltered particle table of an
+#  image to the cache
+#
+####
+def saveSegmentation(cfg, cacheKey, maskIP, frameStats, unfiltered):
+    cacheDir = getCacheDir(cfg)
+    if not os.path.exists(cacheDir):
+        os.makedirs(cacheDir)
+    entryPath = getEntryPath(cfg, cacheKey)
+    # Written to a temporary file first, so a partial entry is never read
+    tmpPath = entryPath + ".tmp"
+    out = DataOutputStream(BufferedOutputStream(GZIPOutputStream(FileOutputStream(tmpPath))))
+    try:
+        out.writeUTF(SEGMENTATION_CACHE_MAGIC)
+        out.writeInt(SEGMENTATION_CACHE_VERSION)
+        out.writeInt(maskIP.getWidth())
+        out.writeInt(maskIP.getHeight())
+        writeColumns(out, frameStats)
+        writeColumns(out, unfiltered)
+        packed = ELMArrayStore.packMask(maskIP)
+        out.writeInt(len(packed))
+        out.write(packed)
+    finally:
+        out.close()
+    cacheSizesLock.acquire()
+    try:
+        if not cacheDir in cacheSizes:
+            cacheSizes[cacheDir] = sum([size for mtime, size, path in getEntries(cacheDir)])
+        if os.path.exists(entryPath):
+            cacheSizes[cacheDir] -= os.path.getsize(entryPath)
+            os.remove(entryPath)
+        os.rename(tmpPath, entryPath)
+        cacheSizes[cacheDir] += os.path.getsize(entryPath)
+        if cacheSizes[cacheDir] > getMaxCacheSize(cfg):
+            evictEntries(cfg)
+    finally:
+        cacheSizesLock.release()
+
+
+####
+#
+#  Get the filtered mask, the stats and the unfiltered particle table of an
+#  image from the cache.  Returns None if the image isn't cached.
+#
+####
+def loadSegmentation(cfg, cacheKey):
+    entryPath = getEntryPath(cfg, cacheKey)
+    if not os.path.exists(entryPath):
+        return None
+    entryIn = DataInputStream(BufferedInputStream(GZIPInputStream(FileInputStream(entryPath))))
+    try:
+        if not entryIn.readUTF() == SEGMENTATION_CACHE_MAGIC or not entryIn.readInt() == SEGMENTATION_CACHE_VERSION:
+            print "Segmentation cache entry " + entryPath + " is not a known format, ignoring it"
+            return None
+        width = entryIn.readInt()
+        height = entryIn.readInt()
+        frameStats = readColumns(entryIn)
+        unfiltered = readColumns(entryIn)
+        packed = zeros(entryIn.readInt(), 'b')
+        entryIn.readFully(packed)
+    finally:
+        entryIn.close()
+
+    # The modification time orders the entries by when they were last used
+    os.utime(entryPath, None)
+    return ELMArrayStore.unpackMask(packed, width, height), frameStats, unfiltered
+
+
+####
+#
+#  Get the size limit of the cache in bytes, segmentationCacheSize in MB
+#
+####
+def getMaxCacheSize(cfg):
+    maxSize = DEFAULT_CACHE_SIZE_MB
+    if cfg.hasValue(ELMConfig.segmentationCacheSize):
+        maxSize = cfg.getValue(ELMConfig.segmentationCacheSize)
+    return maxSize * 1024 * 1024
+
+
+####
+#
+#  Get the entries of a cache dir as (modification time, size, path), least
+#  recently used first
+#
+####
+def getEntries(cacheDir):
+    entries = []
+    for fileName in os.listdir(cacheDir):
+        if not fileName.endswith(SEGMENTATION_CACHE_SUFFIX):
+            continue
+        entryPath = os.path.join(cacheDir, fileName)
+        fileStat = os.stat(entryPath)
+        entries.append((fileStat.st_mtime, fileStat.st_size, entryPath))
+    entries.sort()
+    return entries
+
+
+####
+#
+#  Remove the least recently used entries until the cache is within
+#  CACHE_EVICT_FRACTION of its size limit.  Called with cacheSizesLock held,
+#  once saving an entry takes the cache past its limit.
+#
+####
+def evictEntries(cfg):
+    cacheDir = getCacheDir(cfg)
+    entries = getEntries(cacheDir)
+    totalSize = sum([size for mtime, size, entryPath in entries])
+    for mtime, size, entryPath in entries:
+        if totalSize <= getMaxCacheSize(cfg) * CACHE_EVICT_FRACTION:
+            break
+        os.remove(entryPath)
+        totalSize -= size
+    cacheSizes[cacheDir] = totalSize
@@ -0,0 +1,258 @@
+# Copyright (C) 2011 - 2019, Raytheon BBN Technologies and contributors listed
+# in the AUTHORS file in TASBE Flow Analytics distribution's top directory.
+#
+# This file is part of the TASBE Flow Analytics package, and is distributed
+# under the terms of the GNU General Public License, with a linking
+# exception, as described in the file LICENSE in the TASBE Image Analysis
+# package distribution's top directory.
+
+# Multi-page TIFF and OME-TIFF hyperstacks as input.  Each plane of a stack is
+# given a path inside the stack's path, named the way the file for that plane
+# would be named if the stack was exploded into one file per plane, e.g.
+# plate1_A1.ome.tif/plate1_A1_z00_t03_ch01.tif.  These plane paths go through
+# the same filename parsing as plane files, into imgFileCats[c][z][t], and are
+# only resolved to a page of the stack when the plane is opened.
+
+from xml.etree import ElementTree
+
+import os, re
+
+import ELMConfig, ELMTiffReader
+
+# Extensions that are stripped from a stack's name to get its planes' names
+STACK_EXTS = [".ome.tif", ".ome.tiff", ".tif", ".tiff"]
+
+# Units of OME physical sizes that are micrometers
+MICROMETER_UNITS = [u"\u00b5m", u"\u03bcm", u"um", u"micron"]
+
+planeRE = re.compile("^.*_z([0-9]+)_t([0-9]+)_ch([0-9]+)$")
+
+# Stack info of each stack path, so each stack's metadata is only read once
+stackInfoCache = dict()
+
+####
+#
+#  The dimensions of a stack, and the order of its planes
+#
+####
+class StackInfo:
+
+    ###
+    #  order is the C, Z, T dimensions from fastest to slowest changing
+    ###
+    def __init__(self, order, sizeC, sizeZ, sizeT):
+        self.order = order
+        self.sizes = {'C' : sizeC, 'Z' : sizeZ, 'T' : sizeT}
+        self.pixelWidth = None
+        self.pixelHeight = None
+        self.pixelDepth = None
+
+    ###
+    #
+    ###
+    def getNumPlanes(self):
+        return self.sizes['C'] * self.sizes['Z'] * self.sizes['T']
+
+    ###
+    #  Get the page of the plane for channel c, slice z and timestep t
+    ###
+    def getPage(self, c, z, t):
+        pos = {'C' : c, 'Z' : z, 'T' : t}
+        page = 0
+        planeStride = 1
+        for dim in self.order:
+            page += pos[dim] * planeStride
+            planeStride *= self.sizes[dim]
+        return page
+
+
+####
+#
+#  Read the dimensions from OME-XML.  Only the first image is read, and its
+#  planes must all be in this file.  Interleaved RGB planes hold
+#  samplesPerPixel channels each.
+#
+####
+def parseOMEDescription(desc, fileName, samplesPerPixel):
+    if not "<OME" in desc:
+        return None
+    try:
+        xmlRoot = ElementTree.fromstring(desc)
+    except Exception, e:
+        print "Could not parse the OME-XML of " + fileName + ": " + str(e)
+        return None
+    pixels = None
+    for ele in xmlRoot.getiterator():
+        if ele.tag.split("}")[-1] == "Pixels":
+            pixels = ele
+            break
+    if pixels is None:
+        return None
+    for ele in pixels.getiterator():
+        if ele.tag.split("}")[-1] == "UUID" and ele.get("FileName") and not ele.get("FileName") == fileName:
+            print "OME-TIFF " + fileName + " has planes in other files, which isn't supported!"
+            return None
+
+    order = pixels.get("DimensionOrder", "XYCZT")[2:]
+    sizeC = max(1, int(pixels.get("SizeC", "1")) / samplesPerPixel)
+    info = StackInfo(order, sizeC, int(pixels.get("SizeZ", "1")), int(pixels.get("SizeT", "1")))
+    if pixels.get("PhysicalSizeX") and pixels.get("PhysicalSizeXUnit", u"\u00b5m") in MICROMETER_UNITS:
+        info.pixelWidth = float(pixels.get("PhysicalSizeX"))
+    if pixels.get("PhysicalSizeY") and pixels.get("PhysicalSizeYUnit", u"\u00b5m") in MICROMETER_UNITS:
+        info.pixelHeight = float(pixels.get("PhysicalSizeY"))
+    if pixels.get("PhysicalSizeZ") and pixels.get("PhysicalSizeZUnit", u"\u00b5m") in MICROMETER_UNITS:
+        info.pixelDepth = float(pixels.get("PhysicalSizeZ"))
+    return info
+
+
+####
+#
+#  Read the dimensions from an ImageJ hyperstack description, which lists
+#  the channels, slices and frames, stored channel fastest
+#
+####
+def parseImageJDescription(desc):
+    if not desc.startswith("ImageJ="):
+        return None
+    values = dict()
+    for line in desc.splitlines():
+        if "=" in line:
+            key, value = line.split("=", 1)
+            values[key.strip()] = value.strip()
+    try:
+        info = StackInfo("CZT", int(values.get("channels", "1")), int(values.get("slices", "1")), int(values.get("frames", "1")))
+        if "spacing" in values and values.get("unit") in MICROMETER_UNITS:
+            info.pixelDepth = float(values["spacing"])
+    except ValueError:
+        return None
+    return info
+
+
+####
+#
+#  Get the dimensions of a multi-page TIFF from its metadata.  Returns None if
+#  the file isn't a stack of more than one plane with C, Z, T metadata.
+#
+####
+def getStackInfo(path):
+    if path in stackInfoCache:
+        return stackInfoCache[path]
+
+    info = None
+    header = ELMTiffReader.readHeader(path)
+    if not header is None:
+        tags, numPages = header
+        desc = ELMTiffReader.getTagString(tags, ELMTiffReader.TAG_IMAGE_DESCRIPTION)
+        samplesPerPixel = tags.get(ELMTiffReader.TAG_SAMPLES_PER_PIXEL, [1])[0]
+        info = parseOMEDescription(desc, os.path.basename(path), samplesPerPixel)
+        if info is None:
+            info = parseImageJDescription(desc)
+        if not info is None and info.getNumPlanes() <= 1:
+            info = None
+        if not info is None and info.getNumPlanes() > numPages:
+            print "Stack " + path + " has " + str(numPages) + " pages, but its metadata lists " \
+                  + str(info.getNumPlanes()) + " planes! Reading it as a single image."
+            info = None
+    stackInfoCache[path] = info
+    return info
+
+
+####
+#
+#  Get the paths of the planes of a stack, for channels below numChannels
+#
+####
+def getPlanePaths(stackPath, info, numChannels):
+    stackName = os.path.basename(stackPath)
+    for ext in STACK_EXTS:
+        if stackName.lower().endswith(ext):
+            stackName = stackName[0:len(stackName) - len(ext)]
+            break
+
+    zFormat = 'z%02d'
+    if info.sizes['Z'] >= 100:
+        zFormat = 'z%03d'
+    tFormat = 't%02d'
+    if info.sizes['T'] >= 100:
+        tFormat = 't%03d'
+    planePaths = []
+    for t in range(0, info.sizes['T']):
+        for z in range(0, info.sizes['Z']):
+            for c in range(0, min(info.sizes['C'], numChannels)):
+                planeName = stackName + "_" + (zFormat % z) + "_" + (tFormat % t) + "_" + ('ch%02d' % c) + ".tif"
+                planePaths.append(os.path.join(stackPath, planeName))
+    return planePaths
+
+
+####
+#
+#  Replace the stacks in a list of image files with the paths of their
+#  planes.  The number of Z slices and the pixel size are taken from the
+#  stacks' metadata, when it has them.
+#
+####
+def expandStacks(imgFiles, cfg):
+    planeFiles = []
+    for imgPath in imgFiles:
+        info = getStackInfo(imgPath)
+        if info is None:
+            planeFiles.append(imgPath)
+            continue
+
+        print "Reading " + os.path.basename(imgPath) + " as a stack of " + str(info.sizes['C']) + " channels, " \
+              + str(info.sizes['Z']) + " slices and " + str(info.sizes['T']) + " timesteps"
+        if info.sizes['C'] > cfg.getValue(ELMConfig.numChannels):
+            print "Warning: stack has more channels than numChannels, the extra channels are ignored!"
+        cfg.setValue(ELMConfig.numZ, info.sizes['Z'])
+        if not info.pixelWidth is None and not info.pixelHeight is None:
+            cfg.setValue(ELMConfig.pixelWidth, info.pixelWidth)
+            cfg.setValue(ELMConfig.pixelHeight, info.pixelHeight)
+        if not info.pixelDepth is None:
+            cfg.setValue(ELMConfig.pixelDepth, info.pixelDepth)
+        planeFiles += getPlanePaths(imgPath, info, cfg.getValue(ELMConfig.numChannels))
+    ELMConfig.sort_nicely(planeFiles)
+    return planeFiles
+
+
+####
+#
+#  Resolve the path of a plane of a stack to the stack's path and the plane's
+#  page.  Returns None if path isn't a plane of a stack.
+#
+####
+def getStackPlane(path):
+    stackPath = os.path.dirname(path)
+    if not os.path.isfile(stackPath):
+        return None
+    match = planeRE.match(os.path.splitext(os.path.basename(path))[0])
+    info = getStackInfo(stackPath)
+    if match is None or info is None:
+        return None
+    z, t, c = [int(val) for val in match.groups()]
+    return stackPath, info.getPage(c, z, t)
+
+
+####
+#
+#  Get the file an image path is read from: the stack for a plane of a stack,
+#  otherwise the path itself
+#
+####
+def getSourceFile(path):
+    stackPlane = getStackPlane(path)
+    if stackPlane is None:
+        return path
+    return stackPlane[0]
+
+
+####
+#
+#  Memory-map an image plane, which can be a plane of a stack.  Returns None if
+#  it can't be mapped, see ELMTiffReader.mapPlane.
+#
+####
+def mapPlane(path):
+    stackPlane = getStackPlane(path)
+    if stackPlane is None:
+        return ELMTiffReader.mapPlane(path)
+    return ELMTiffReader.mapPlane(stackPlane[0], stackPlane[1])
@@ -0,0 +1,411 @@
+# Copyright (C) 2011 - 2019, Raytheon BBN Technologies and contributors listed
+# in the AUTHORS file in TASBE Flow Analytics distribution's top directory.
+#
+# This file is part of the TASBE Flow Analytics package, and is distributed
+# under the terms of the GNU General Public License, with a linking
+# exception, as described in the file LICENSE in the TASBE Image Analysis
+# package distribution's top directory.
+
+from ij import ImagePlus
+from ij.process import ByteProcessor, ShortProcessor, ColorProcessor
+
+from java.awt.image import BufferedImage, DataBufferByte, Raster, ComponentColorModel, DataBuffer
+from java.awt.color import ColorSpace
+from java.awt import Transparency
+from java.io import RandomAccessFile
+from java.nio import ByteBuffer, ByteOrder
+from java.nio.channels import FileChannel
+
+from jarray import zeros, array
+
+import os
+
+# TIFF tags used to locate the pixel data
+TAG_IMAGE_WIDTH = 256
+TAG_IMAGE_LENGTH = 257
+TAG_BITS_PER_SAMPLE = 258
+TAG_COMPRESSION = 259
+TAG_PHOTOMETRIC = 262
+TAG_IMAGE_DESCRIPTION = 270
+TAG_STRIP_OFFSETS = 273
+TAG_SAMPLES_PER_PIXEL = 277
+TAG_ROWS_PER_STRIP = 278
+TAG_STRIP_BYTE_COUNTS = 279
+TAG_X_RESOLUTION = 282
+TAG_Y_RESOLUTION = 283
+TAG_PLANAR_CONFIG = 284
+TAG_RESOLUTION_UNIT = 296
+TAG_TILE_WIDTH = 322
+TAG_TILE_LENGTH = 323
+TAG_TILE_OFFSETS = 324
+TAG_TILE_BYTE_COUNTS = 325
+
+# Size in bytes of each TIFF field type
+TIFF_TYPE_SIZES = {1 : 1, 2 : 1, 3 : 2, 4 : 4, 5 : 8, 6 : 1, 7 : 1, 8 : 2, 9 : 4, 10 : 8, 11 : 4, 12 : 8}
+
+COMPRESSION_NONE = 1
+PHOTOMETRIC_BLACK_IS_ZERO = 1
+PHOTOMETRIC_RGB = 2
+PLANAR_CHUNKY = 1
+
+####
+#
+#  Read the value(s) of an IFD entry as a list of numbers
+#
+####
+def readTagValues(buf, entryPos):
+    fieldType = buf.getShort(entryPos + 2) & 0xffff
+    count = buf.getInt(entryPos + 4)
+    if not fieldType in TIFF_TYPE_SIZES:
+        return []
+    size = TIFF_TYPE_SIZES[fieldType]
+    if size * count <= 4:
+        valuePos = entryPos + 8
+    else:
+        valuePos = int(buf.getInt(entryPos + 8) & 0xffffffff)
+
+    values = []
+    for i in range(0, count):
+        pos = valuePos + i * size
+        if fieldType == 3 or fieldType == 8:
+            values.append(buf.getShort(pos) & 0xffff)
+        elif fieldType == 4 or fieldType == 9:
+            values.append(buf.getInt(pos) & 0xffffffff)
+        elif fieldType == 5 or fieldType == 10:
+            denom = buf.getInt(pos + 4) & 0xffffffff
+            if denom == 0:
+                values.append(0.0)
+            else:
+                values.append(float(buf.getInt(pos) & 0xffffffff) / denom)
+        else:
+            values.append(buf.get(pos) & 0xff)
+    return values
+
+
+####
+#
+#  Read all of the entries of the IFD at ifdPos into a dict of tag -> values
+#
+####
+def readIFD(buf, ifdPos):
+    if ifdPos + 2 > buf.limit():
+        return None
+    numEntries = buf.getShort(ifdPos) & 0xffff
+    tags = dict()
+    for i in range(0, numEntries):
+        entryPos = ifdPos + 2 + i * 12
+        if entryPos + 12 > buf.limit():
+            return None
+        tag = buf.getShort(entryPos) & 0xffff
+        tags[tag] = readTagValues(buf, entryPos)
+    return tags
+
+
+####
+#
+#  Read all of the entries of the first IFD into a dict of tag -> values
+#
+####
+def readFirstIFD(buf):
+    return readIFD(buf, int(buf.getInt(4) & 0xffffffff))
+
+
+####
+#
+#  Get the positions of the IFDs of the first numPages pages, following the
+#  chain of next IFD offsets without reading any entries.  Stops early at the
+#  last page.
+#
+####
+def findIFDs(buf, numPages=None):
+    positions = []
+    ifdPos = int(buf.getInt(4) & 0xffffffff)
+    while ifdPos > 0 and ifdPos + 2 <= buf.limit() and (numPages is None or len(positions) < numPages):
+        positions.append(ifdPos)
+        numEntries = buf.getShort(ifdPos) & 0xffff
+        nextPos = ifdPos + 2 + numEntries * 12
+        if nextPos + 4 > buf.limit():
+            break
+        ifdPos = int(buf.getInt(nextPos) & 0xffffffff)
+        # A corrupt chain could loop forever
+        if ifdPos in positions:
+            break
+    return positions
+
+
+####
+#
+#  A single uncompressed image plane in a memory-mapped TIFF file.  The pixel
+#  data is not read until it is requested and is then read straight out of the
+#  mapped file, so only the requested rows are ever touched.
+#
+####
+class MappedTiffPlane:
+
+    ###
+    #  desc is the ImageJ description of the file, which can hold the unit of
+    #  the resolution tags
+    ###
+    def __init__(self, path, channel, buf, tags, desc=""):
+        self.path = path
+        self.channel = channel
+        self.buf = buf
+        self.width = tags[TAG_IMAGE_WIDTH][0]
+        self.height = tags[TAG_IMAGE_LENGTH][0]
+        self.samplesPerPixel = tags.get(TAG_SAMPLES_PER_PIXEL, [1])[0]
+        self.bitsPerSample = tags.get(TAG_BITS_PER_SAMPLE, [8])[0]
+        self.bytesPerPixel = self.samplesPerPixel * self.bitsPerSample / 8
+        self.photometric = tags[TAG_PHOTOMETRIC][0]
+        if TAG_TILE_OFFSETS in tags:
+            self.tiled = True
+            self.chunkWidth = tags[TAG_TILE_WIDTH][0]
+            self.chunkHeight = tags[TAG_TILE_LENGTH][0]
+            self.chunkOffsets = tags[TAG_TILE_OFFSETS]
+        else:
+            self.tiled = False
+            self.chunkWidth = self.width
+            self.chunkHeight = min(tags.get(TAG_ROWS_PER_STRIP, [self.height])[0], self.height)
+            self.chunkOffsets = tags[TAG_STRIP_OFFSETS]
+        self.chunksAcross = (self.width + self.chunkWidth - 1) / self.chunkWidth
+
+        self.pixelWidth = 0
+        self.pixelHeight = 0
+        self.unit = None
+        # The unit in an ImageJ description takes precedence over the
+        # resolution unit tag, as it does in IJ.openImage
+        resUnit = tags.get(TAG_RESOLUTION_UNIT, [2])[0]
+        descUnit = getImageJUnit(desc)
+        if TAG_X_RESOLUTION in tags and TAG_Y_RESOLUTION in tags and (resUnit == 2 or resUnit == 3 or descUnit):
+            xRes = tags[TAG_X_RESOLUTION][0]
+            yRes = tags[TAG_Y_RESOLUTION][0]
+            if xRes > 0 and yRes > 0:
+                self.pixelWidth = 1.0 / xRes
+                self.pixelHeight = 1.0 / yRes
+                if descUnit:
+                    self.unit = descUnit
+                elif resUnit == 2:
+                    self.unit = "inch"
+                else:
+                    self.unit = "cm"
+
+    ###
+    #  Get the position within the mapped file of the pixel at x, y
+    ###
+    def getPixelPos(self, x, y):
+        chunkIdx = (y / self.chunkHeight) * self.chunksAcross + (x / self.chunkWidth)
+        chunkRow = y % self.chunkHeight
+        chunkCol = x % self.chunkWidth
+        return int(self.chunkOffsets[chunkIdx] + (chunkRow * self.chunkWidth + chunkCol) * self.bytesPerPixel)
+
+    ###
+    #  Get the value of a pixel, in the same form as ImagePlus.getPixel
+    ###
+    def getPixel(self, x, y):
+        pos = self.getPixelPos(x, y)
+        if self.bitsPerSample == 16:
+            return [self.buf.getShort(pos) & 0xffff, 0, 0, 0]
+        elif self.samplesPerPixel >= 3:
+            return [self.buf.get(pos) & 0xff, self.buf.get(pos + 1) & 0xff, self.buf.get(pos + 2) & 0xff, 0]
+        else:
+            return [self.buf.get(pos) & 0xff, 0, 0, 0]
+
+    ###
+    #  Read the raw bytes of a rectangle of the plane into an array, copying
+    #  whole rows out of the mapped file at a time.
+    ###
+    def readRect(self, x, y, width, height):
+        rowBytes = width * self.bytesPerPixel
+        raw = zeros(rowBytes * height, 'b')
+        view = self.buf.duplicate()
+        for row in range(0, height):
+            dst = row * rowBytes
+            col = x
+            while col < x + width:
+                # Copy up to the edge of the current chunk (tile)
+                segWidth = min(x + width, (col / self.chunkWidth + 1) * self.chunkWidth) - col
+                view.position(self.getPixelPos(col, y + row))
+                view.get(raw, dst, segWidth * self.bytesPerPixel)
+                dst += segWidth * self.bytesPerPixel
+                col += segWidth
+        return raw
+
+    ###
+    #  Create an ImageJ processor for a rectangle of the plane
+    ###
+    def getProcessor(self, rect=None):
+        if rect is None:
+            rect = (0, 0, self.width, self.height)
+        x, y, width, height = rect
+        raw = self.readRect(x, y, width, height)
+        if self.samplesPerPixel == 1 and self.bitsPerSample == 8:
+            return ByteProcessor(width, height, raw)
+        elif self.samplesPerPixel == 1 and self.bitsPerSample == 16:
+            pixels = zeros(width * height, 'h')
+            ByteBuffer.wrap(raw).order(self.buf.order()).asShortBuffer().get(pixels)
+            return ShortProcessor(width, height, pixels, None)
+        else:
+            # Let Java deinterleave the color samples
+            colorModel = ComponentColorModel(ColorSpace.getInstance(ColorSpace.CS_sRGB), False, False, Transparency.OPAQUE, DataBuffer.TYPE_BYTE)
+            raster = Raster.createInterleavedRaster(DataBufferByte(raw, len(raw)), width, height, \
+                                                    width * self.samplesPerPixel, self.samplesPerPixel, array([0, 1, 2], 'i'), None)
+            return ColorProcessor(BufferedImage(colorModel, raster, False, None))
+
+    ###
+    #  Create an ImagePlus for a rectangle of the plane
+    ###
+    def getImagePlus(self, rect=None):
+        currIP = ImagePlus(os.path.basename(self.path), self.getProcessor(rect))
+        if self.unit:
+            calib = currIP.getCalibration()
+            calib.pixelWidth = self.pixelWidth
+            calib.pixelHeight = self.pixelHeight
+            calib.setUnit(self.unit)
+        return currIP
+
+    ###
+    #
+    ###
+    def close(self):
+        # The mapping is released when the buffer is garbage collected
+        self.buf = None
+        self.channel.close()
+
+
+####
+#
+#  Memory-map a classic TIFF file.  Returns the file channel and the mapped
+#  buffer, in the file's byte order, or None if the file isn't a classic TIFF.
+#
+####
+def mapFile(path):
+    ext = os.path.splitext(path)[1].lower()
+    if not ext == ".tif" and not ext == ".tiff":
+        return None
+
+    raf = RandomAccessFile(path, "r")
+    channel = raf.getChannel()
+    try:
+        buf = channel.map(FileChannel.MapMode.READ_ONLY, 0, channel.size())
+        if buf.limit() < 8:
+            channel.close()
+            return None
+        byteOrder = buf.getShort(0)
+        if byteOrder == 0x4949:
+            buf.order(ByteOrder.LITTLE_ENDIAN)
+        elif byteOrder == 0x4d4d:
+            buf.order(ByteOrder.BIG_ENDIAN)
+        else:
+            channel.close()
+            return None
+        # Only classic TIFF, BigTIFF uses a different magic number
+        if not buf.getShort(2) == 42:
+            channel.close()
+            return None
+        return channel, buf
+    except:
+        channel.close()
+        return None
+
+
+####
+#
+#  Memory-map a plane (page) of a TIFF file, the first one by default.
+#  Returns None if the file is not a TIFF this reader supports (uncompressed,
+#  chunky, 8-bit gray/RGB or 16-bit gray), or has no such page, in which case
+#  the caller should fall back to IJ.openImage.
+#
+####
+def mapPlane(path, page=0):
+    mapped = mapFile(path)
+    if mapped is None:
+        return None
+    channel, buf = mapped
+    try:
+        ifdPositions = findIFDs(buf, page + 1)
+        if len(ifdPositions) <= page:
+            channel.close()
+            return None
+        tags = readIFD(buf, ifdPositions[page])
+        if tags is None or not isSupported(tags):
+            channel.close()
+            return None
+        # ImageJ only writes its description on the first page of a stack
+        desc = getTagString(tags, TAG_IMAGE_DESCRIPTION)
+        if not desc and page > 0:
+            desc = getTagString(readIFD(buf, ifdPositions[0]), TAG_IMAGE_DESCRIPTION)
+        return MappedTiffPlane(path, channel, buf, tags, desc)
+    except:
+        channel.close()
+        return None
+
+
+####
+#
+#  Read the tags of the first page of a TIFF file and count its pages, without
+#  touching any pixel data.  Returns (tags, numPages), or None if the file
+#  isn't a classic TIFF.
+#
+####
+def readHeader(path):
+    mapped = mapFile(path)
+    if mapped is None:
+        return None
+    channel, buf = mapped
+    try:
+        tags = readFirstIFD(buf)
+        numPages = len(findIFDs(buf))
+    except:
+        tags = None
+    channel.close()
+    if tags is None:
+        return None
+    return tags, numPages
+
+
+####
+#
+#  Get the value of an ASCII tag as a string
+#
+####
+def getTagString(tags, tag):
+    return "".join([chr(value) for value in tags.get(tag, [])]).rstrip("\0")
+
+
+####
+#
+#  Get the unit from an ImageJ image description, or None if there is none
+#
+####
+def getImageJUnit(desc):
+    if not desc.startswith("ImageJ="):
+        return None
+    for line in desc.splitlines():
+        if line.startswith("unit="):
+            # ImageJ reads the description as properties, which may escape
+            # non-ASCII units such as \u00B5m
+            return line[len("unit="):].strip().decode("unicode_escape")
+    return None
+
+
+####
+#
+#  Check that an IFD describes pixel data this reader can map
+#
+####
+def isSupported(tags):
+    if not TAG_IMAGE_WIDTH in tags or not TAG_IMAGE_LENGTH in tags or not TAG_PHOTOMETRIC in tags:
+        return False
+    if not TAG_STRIP_OFFSETS in tags and not TAG_TILE_OFFSETS in tags:
+        return False
+    if not tags.get(TAG_COMPRESSION, [COMPRESSION_NONE])[0] == COMPRESSION_NONE:
+        return False
+    if not tags.get(TAG_PLANAR_CONFIG, [PLANAR_CHUNKY])[0] == PLANAR_CHUNKY:
+        return False
+    bitsPerSample = tags.get(TAG_BITS_PER_SAMPLE, [8])
+    samplesPerPixel = tags.get(TAG_SAMPLES_PER_PIXEL, [1])[0]
+    photometric = tags[TAG_PHOTOMETRIC][0]
+    if photometric == PHOTOMETRIC_BLACK_IS_ZERO and samplesPerPixel == 1:
+        return bitsPerSample[0] == 8 or bitsPerSample[0] == 16
+    elif photometric == PHOTOMETRIC_RGB and samplesPerPixel == 3:
+        return all(bits == 8 for bits in bitsPerSample)
+    return False
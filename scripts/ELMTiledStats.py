@@ -0,0 +1,528 @@
+# Copyright (C) 2011 - 2019, Raytheon BBN Technologies and contributors listed
+# in the AUTHORS file in TASBE Flow Analytics distribution's top directory.
+#
+# This file is part of the TASBE Flow Analytics package, and is distributed
+# under the terms of the GNU General Public License, with a linking
+# exception, as described in the file LICENSE in the TASBE Image Analysis
+# package distribution's top directory.
+
+from ij import ImagePlus
+from ij.process import ImageStatistics, ImageProcessor, ByteProcessor
+from ij.measure import ResultsTable, Measurements
+from ij.plugin.filter import ParticleAnalyzer, Analyzer
+
+from java.lang import Double
+
+import math, time
+
+import ELMConfig, ELMImageUtils, ELMStackReader, ELMUnfilteredStats
+
+# Tiles are read with a margin of overlap pixels on each side, so the mask is
+# exact within the tile's core.  The overlap must cover the close neighborhood
+# and the local threshold window.
+DEFAULT_TILE_SIZE = 2048
+DEFAULT_TILE_OVERLAP = 16
+
+# Particle measurements, the same as cellStats.processImage
+TILE_MEASUREMENTS = Measurements.AREA + Measurements.MEAN + Measurements.STD_DEV + Measurements.MIN_MAX + \
+                    Measurements.CENTROID + Measurements.RECT + Measurements.ELLIPSE
+# The results table headings of TILE_MEASUREMENTS, for frames whose particles
+# all cross a seam, so no tile's table lists them
+TILE_HEADINGS = ['Area', 'Mean', 'StdDev', 'Min', 'Max', 'X', 'Y', 'BX', 'BY', 'Width', 'Height', 'Major', 'Minor', 'Angle']
+
+####
+#
+#  A union-find over the keys of the particles that touch a tile seam
+#
+####
+class ParticleUnion:
+
+    ###
+    #
+    ###
+    def __init__(self):
+        self.parent = dict()
+
+    ###
+    #
+    ###
+    def find(self, key):
+        self.parent.setdefault(key, key)
+        root = key
+        while not self.parent[root] == root:
+            root = self.parent[root]
+        while not self.parent[key] == root:
+            self.parent[key], key = root, self.parent[key]
+        return root
+
+    ###
+    #
+    ###
+    def union(self, key1, key2):
+        root1 = self.find(key1)
+        root2 = self.find(key2)
+        if not root1 == root2:
+            self.parent[max(root1, root2)] = min(root1, root2)
+
+
+####
+#
+#  The moments of the pixels of a particle, or of the part of a particle in
+#  one tile, from which its measurements are computed.  Coordinates are full
+#  frame pixels.
+#
+####
+class ParticleMoments:
+
+    ###
+    #
+    ###
+    def __init__(self):
+        self.n = 0
+        self.sumX = 0.0
+        self.sumY = 0.0
+        self.sumXX = 0.0
+        self.sumYY = 0.0
+        self.sumXY = 0.0
+        self.sumI = 0.0
+        self.sumII = 0.0
+        self.minI = Double.POSITIVE_INFINITY
+        self.maxI = Double.NEGATIVE_INFINITY
+        self.x0 = None
+        self.y0 = None
+        self.x1 = None
+        self.y1 = None
+        self.points = []
+
+    ###
+    #  Add a pixel, with its value in the measured image
+    ###
+    def addPixel(self, x, y, value):
+        # Pixel centers, as ImageJ measures centroids
+        cx = x + 0.5
+        cy = y + 0.5
+        self.n += 1
+        self.sumX += cx
+        self.sumY += cy
+        self.sumXX += cx * cx
+        self.sumYY += cy * cy
+        self.sumXY += cx * cy
+        self.sumI += value
+        self.sumII += value * value
+        self.minI = min(self.minI, value)
+        self.maxI = max(self.maxI, value)
+        self.points.append((x, y))
+        if self.x0 is None:
+            self.x0, self.y0, self.x1, self.y1 = x, y, x + 1, y + 1
+        else:
+            self.x0 = min(self.x0, x)
+            self.y0 = min(self.y0, y)
+            self.x1 = max(self.x1, x + 1)
+            self.y1 = max(self.y1, y + 1)
+
+    ###
+    #
+    ###
+    def merge(self, other):
+        self.n += other.n
+        self.sumX += other.sumX
+        self.sumY += other.sumY
+        self.sumXX += other.sumXX
+        self.sumYY += other.sumYY
+        self.sumXY += other.sumXY
+        self.sumI += other.sumI
+        self.sumII += other.sumII
+        self.minI = min(self.minI, other.minI)
+        self.maxI = max(self.maxI, other.maxI)
+        self.points += other.points
+        self.x0 = min(self.x0, other.x0)
+        self.y0 = min(self.y0, other.y0)
+        self.x1 = max(self.x1, other.x1)
+        self.y1 = max(self.y1, other.y1)
+
+    ###
+    #  Get the measurements of the particle, keyed by results table heading,
+    #  in the units of calib.  The ellipse is fit to the second moments and
+    #  scaled to the particle's area, as ImageJ's EllipseFitter does.
+    ###
+    def getMeasurements(self, calib):
+        n = float(self.n)
+        pw = calib.pixelWidth
+        ph = calib.pixelHeight
+        xm = self.sumX / n
+        ym = self.sumY / n
+        # A pixel has a variance of 1/12 along each axis
+        xx = self.sumXX / n - xm * xm + 1.0 / 12.0
+        yy = self.sumYY / n - ym * ym + 1.0 / 12.0
+        # Angles are counterclockwise, with y up
+        xy = -(self.sumXY / n - xm * ym)
+        common = math.sqrt(((xx - yy) / 2.0) ** 2 + xy * xy)
+        major = 4.0 * math.sqrt((xx + yy) / 2.0 + common)
+        minor = 4.0 * math.sqrt(max((xx + yy) / 2.0 - common, 0.0))
+        if minor > 0:
+            scale = math.sqrt(n / (math.pi / 4.0 * major * minor))
+            major *= scale
+            minor *= scale
+        angle = math.degrees(0.5 * math.atan2(2.0 * xy, xx - yy))
+        if angle < 0:
+            angle += 180.0
+
+        if self.n > 1:
+            stdDev = math.sqrt(max((self.sumII - self.sumI * self.sumI / n) / (n - 1), 0.0))
+        else:
+            stdDev = 0.0
+        return {'Area' : n * pw * ph, 'Mean' : self.sumI / n, 'StdDev' : stdDev, 'Min' : self.minI, 'Max' : self.maxI,
+                'X' : xm * pw, 'Y' : ym * ph, 'BX' : self.x0 * pw, 'BY' : self.y0 * ph,
+                'Width' : (self.x1 - self.x0) * pw, 'Height' : (self.y1 - self.y0) * ph,
+                'Major' : major * pw, 'Minor' : minor * pw, 'Angle' : angle}
+
+    ###
+    #  Get the perimeter of the particle in pixels, traced by the particle
+    #  analyzer as it traces a particle of a whole frame
+    ###
+    def getPerimeter(self):
+        ip = ByteProcessor(self.x1 - self.x0, self.y1 - self.y0)
+        for x, y in self.points:
+            ip.set(x - self.x0, y - self.y0, 255)
+        ip.setThreshold(255, 255, ImageProcessor.NO_LUT_UPDATE)
+        maskIP = ImagePlus("Particle", ip)
+        table = ResultsTable()
+        pa = ParticleAnalyzer(ParticleAnalyzer.CLEAR_WORKSHEET, Measurements.AREA + Measurements.PERIMETER, table, 0, \
+                              Double.POSITIVE_INFINITY, 0.0, 1.0)
+        pa.setHideOutputImage(True)
+        pa.analyze(maskIP)
+        maskIP.close()
+        # Particles in holes of the particle are traced separately
+        perimeter = 0.0
+        maxArea = 0.0
+        for row in range(0, table.size()):
+            if table.getValue('Area', row) > maxArea:
+                maxArea = table.getValue('Area', row)
+                perimeter = table.getValue('Perim.', row)
+        return perimeter
+
+
+####
+#
+#  Get the circularity of a particle from its area and perimeter in pixels,
+#  as the particle analyzer filters particles on it
+#
+####
+def getCircularity(area, perimeter):
+    if perimeter == 0.0:
+        return 0.0
+    return min(4.0 * math.pi * area / (perimeter * perimeter), 1.0)
+
+
+####
+#
+#  Check if tiled processing is enabled
+#
+####
+def isTiled(cfg):
+    return cfg.hasValue(ELMConfig.tileSize) and cfg.getValue(ELMConfig.tileSize) > 0
+
+
+####
+#
+#  Split a rectangle into a grid of tile cores.  Returns a list of rows, each
+#  a list of (x, y, width, height).
+#
+####
+def getTileGrid(rect, tileSize):
+    x0, y0, width, height = rect
+    grid = []
+    for y in range(y0, y0 + height, tileSize):
+        row = []
+        for x in range(x0, x0 + width, tileSize):
+            row.append((x, y, min(tileSize, x0 + width - x), min(tileSize, y0 + height - y)))
+        grid.append(row)
+    return grid
+
+
+####
+#
+#  Read a tile core with its overlap margin, clipped to rect.  Returns the
+#  tile and its offset within the full frame.
+#
+####
+def readTile(plane, core, overlap, rect, displayRange):
+    x = max(rect[0], core[0] - overlap)
+    y = max(rect[1], core[1] - overlap)
+    x1 = min(rect[0] + rect[2], core[0] + core[2] + overlap)
+    y1 = min(rect[1] + rect[3], core[1] + core[3] + overlap)
+    tileIP = plane.getImagePlus((x, y, x1 - x, y1 - y))
+    # Every tile is converted to 8-bit with the range of the whole frame
+    if not displayRange is None:
+        tileIP.getProcessor().setMinAndMax(displayRange[0], displayRange[1])
+    return tileIP, (x, y)
+
+
+####
+#
+#  Get the pixel value range of a 16-bit frame, for converting its tiles to
+#  8-bit the same way the whole frame would be.  Returns None for 8-bit and
+#  RGB frames.
+#
+####
+def getFrameRange(plane, grid):
+    if not plane.bitsPerSample == 16:
+        return None
+    minValue = Double.POSITIVE_INFINITY
+    maxValue = Double.NEGATIVE_INFINITY
+    for row in grid:
+        for core in row:
+            ip = plane.getProcessor(core)
+            tileStats = ImageStatistics.getStatistics(ip, Measurements.MIN_MAX, None)
+            minValue = min(minValue, tileStats.min)
+            maxValue = max(maxValue, tileStats.max)
+    return minValue, maxValue
+
+
+####
+#
+#  Get the histogram of the grayscale tiles of a frame, for computing the auto
+#  threshold of the whole frame, so every tile is thresholded the same way
+#
+####
+def getFrameHistogram(cfg, plane, grid, c, chanName, displayRange):
+    totalHist = [0] * 256
+    for row in grid:
+        for core in row:
+            tileIP, offset = readTile(plane, core, 0, core, displayRange)
+            grayIP = ELMImageUtils.getGrayScaleImage(tileIP, c, chanName, cfg, offset)
+            if grayIP is None:
+                continue
+            hist = grayIP.getProcessor().getHistogram()
+            for i in range(0, 256):
+                totalHist[i] += hist[i]
+            grayIP.close()
+    return totalHist
+
+
+####
+#
+#  Accumulate the moments of a particle within a tile core from the labels of
+#  the core and the measured image
+#
+####
+def getLabelMoments(labelProc, measureProc, label, bounds, offset):
+    moments = ParticleMoments()
+    bx, by, bw, bh = bounds
+    for y in range(by, by + bh):
+        for x in range(bx, bx + bw):
+            if labelProc.get(x, y) == label:
+                moments.addPixel(x + offset[0], y + offset[1], measureProc.getPixelValue(x, y))
+    return moments
+
+
+####
+#
+#  Get the labels along the edges of a tile core, for joining particles
+#  across seams.  Unlabeled pixels are None, labeled ones are the particle key.
+#
+####
+def getCoreEdges(labelProc, tileIdx):
+    width = labelProc.getWidth()
+    height = labelProc.getHeight()
+    def key(x, y):
+        label = labelProc.get(x, y)
+        if label == 0:
+            return None
+        return (tileIdx, label)
+    return {'top' : [key(x, 0) for x in range(0, width)],
+            'bottom' : [key(x, height - 1) for x in range(0, width)],
+            'left' : [key(0, y) for y in range(0, height)],
+            'right' : [key(width - 1, y) for y in range(0, height)]}
+
+
+####
+#
+#  Join the particles on either side of a seam, given the labels along each
+#  side.  Pixels are 8-connected, as in the particle analyzer.
+#
+####
+def joinSeam(union, side1, side2):
+    for i in range(0, len(side1)):
+        if side1[i] is None:
+            continue
+        for j in range(max(0, i - 1), min(len(side2), i + 2)):
+            if not side2[j] is None:
+                union.union(side1[i], side2[j])
+
+
+####
+#
+#  Threshold, measure and stitch the particles of a frame one tile at a time,
+#  reading the tiles out of the memory mapped file, so memory is bounded by
+#  the tile size rather than the frame size.  Particles are limited to minSize
+#  and minCircularity and stats[c][z][t] is filled in like
+#  cellStats.processImage.  Returns False if the image can't be read in tiles,
+#  in which case it should be processed whole.
+#
+####
+def processImageTiled(cfg, wellName, wellPath, c, z, t, imgPath, stats, times, minSize, minCircularity, thresh=None):
+    plane = ELMStackReader.mapPlane(imgPath)
+    if plane is None:
+        print "\tCan't read " + imgPath + " in tiles, processing it whole"
+        return False
+
+    startTime = time.time()
+    chanName = cfg.getValue(ELMConfig.chanLabel)[c]
+    dbgOutDesc = wellName + "_" + cfg.getZStr(z) + "_" + cfg.getCStr(c) + "_" + cfg.getTStr(t)
+    unfilteredPath = ELMUnfilteredStats.getUnfilteredPath(cfg, wellName, wellPath, c, z, t)
+    tileSize = cfg.getValue(ELMConfig.tileSize)
+    overlap = DEFAULT_TILE_OVERLAP
+    if cfg.hasValue(ELMConfig.tileOverlap):
+        overlap = cfg.getValue(ELMConfig.tileOverlap)
+    if ELMImageUtils.isLocalThresholdMethod(cfg):
+        localRadius = ELMImageUtils.DEFAULT_LOCAL_THRESHOLD_RADIUS
+        if cfg.hasValue(ELMConfig.localThresholdRadius):
+            localRadius = cfg.getValue(ELMConfig.localThresholdRadius)
+        overlap = max(overlap, localRadius + 2)
+
+    if cfg.hasValue(ELMConfig.cropToRoi) and cfg.getValue(ELMConfig.cropToRoi):
+        rect = ELMImageUtils.getAnalysisRect(cfg, plane.width, plane.height)
+    else:
+        rect = (0, 0, plane.width, plane.height)
+    grid = getTileGrid(rect, tileSize)
+    displayRange = getFrameRange(plane, grid)
+
+    # Every tile must use the same threshold, so auto thresholds are computed
+    # from the histogram of the whole frame
+    frameHist = None
+    if thresh is None and not cfg.hasValue(ELMConfig.imageThreshold) and not ELMImageUtils.isLocalThresholdMethod(cfg):
+        frameHist = getFrameHistogram(cfg, plane, grid, c, chanName, displayRange)
+
+    headings = []
+    columns = dict()
+    calib = None
+    union = ParticleUnion()
+    seamMoments = dict()
+    tileEdges = dict()
+    for i in range(0, len(grid)):
+        for j in range(0, len(grid[i])):
+            core = grid[i][j]
+            tileIP, offset = readTile(plane, core, overlap, rect, displayRange)
+            measureIP = tileIP.duplicate()
+            maskIP = ELMImageUtils.getThresholdedMask(tileIP, c, z, t, chanName, cfg, wellPath, dbgOutDesc, offset, thresh, frameHist)
+            # A tile without a mask has no particles
+            if maskIP is None:
+                measureIP.close()
+                continue
+
+            # Only the core of the mask is exact
+            coreRect = (core[0] - offset[0], core[1] - offset[1], core[2], core[3])
+            maskIP.setRoi(coreRect[0], coreRect[1], coreRect[2], coreRect[3])
+            coreMask = maskIP.crop()
+            maskIP.close()
+            measureIP.setRoi(coreRect[0], coreRect[1], coreRect[2], coreRect[3])
+            coreMeasure = measureIP.crop()
+            measureIP.close()
+            coreMask.setCalibration(coreMeasure.getCalibration())
+            calib = coreMeasure.getCalibration()
+
+            # Every particle is kept here, the size and circularity limits are
+            # applied once particles are joined across seams
+            table = ResultsTable()
+            paFlags = ParticleAnalyzer.SHOW_ROI_MASKS | ParticleAnalyzer.CLEAR_WORKSHEET
+            pa = ParticleAnalyzer(paFlags, TILE_MEASUREMENTS + Measurements.PERIMETER, table, 0, Double.POSITIVE_INFINITY, 0.0, 1.0)
+            pa.setHideOutputImage(True)
+            Analyzer.setRedirectImage(coreMeasure)
+            if not pa.analyze(coreMask):
+                print "There was a problem in analyzing", coreMask
+            Analyzer.setRedirectImage(None)
+            labelIP = pa.getOutputImage()
+
+            # Keep the same columns as processImage
+            tileColumns = dict()
+            for col in range(0, table.getLastColumn()):
+                newData = table.getColumn(col)
+                if not newData is None:
+                    tileColumns[table.getColumnHeading(col)] = list(newData)
+            tileColumns.pop('Perim.', None)
+            if not headings and tileColumns:
+                headings = [heading for heading in tileColumns]
+                for heading in headings:
+                    columns[heading] = []
+
+            # Particles touching a seam between tiles are measured once they
+            # are joined, the rest are final
+            seamLeft = j > 0
+            seamRight = j < len(grid[i]) - 1
+            seamTop = i > 0
+            seamBottom = i < len(grid) - 1
+            finalRows = []
+            for row in range(0, table.size()):
+                bx = int(round(table.getValue('BX', row) / calib.pixelWidth))
+                by = int(round(table.getValue('BY', row) / calib.pixelHeight))
+                bw = int(round(table.getValue('Width', row) / calib.pixelWidth))
+                bh = int(round(table.getValue('Height', row) / calib.pixelHeight))
+                if (seamLeft and bx == 0) or (seamTop and by == 0) or \
+                        (seamRight and bx + bw >= core[2]) or (seamBottom and by + bh >= core[3]):
+                    key = ((i, j), row + 1)
+                    seamMoments[key] = getLabelMoments(labelIP.getProcessor(), coreMeasure.getProcessor(), row + 1, \
+                                                       (bx, by, bw, bh), core)
+                    union.find(key)
+                else:
+                    area = table.getValue('Area', row) / (calib.pixelWidth * calib.pixelHeight)
+                    perimeter = table.getValue('Perim.', row) / calib.pixelWidth
+                    if area >= minSize and getCircularity(area, perimeter) >= minCircularity:
+                        finalRows.append(row)
+            for heading in tileColumns:
+                tileColumns[heading] = [tileColumns[heading][row] for row in finalRows]
+            ELMImageUtils.shiftParticleStats(tileColumns, core, calib)
+            for heading in headings:
+                columns[heading] += tileColumns.get(heading, [Double.NaN] * len(finalRows))
+
+            if not labelIP is None:
+                tileEdges[(i, j)] = getCoreEdges(labelIP.getProcessor(), (i, j))
+                labelIP.close()
+            coreMask.close()
+            coreMeasure.close()
+    plane.close()
+
+    # Join particles across the seams to the right, below and diagonally below
+    for (i, j), edges in tileEdges.items():
+        right = tileEdges.get((i, j + 1))
+        if right:
+            joinSeam(union, edges['right'], right['left'])
+        below = tileEdges.get((i + 1, j))
+        if below:
+            joinSeam(union, edges['bottom'], below['top'])
+        belowRight = tileEdges.get((i + 1, j + 1))
+        if belowRight and not edges['bottom'][-1] is None and not belowRight['top'][0] is None:
+            union.union(edges['bottom'][-1], belowRight['top'][0])
+        belowLeft = tileEdges.get((i + 1, j - 1))
+        if belowLeft and not edges['bottom'][0] is None and not belowLeft['top'][-1] is None:
+            union.union(edges['bottom'][0], belowLeft['top'][-1])
+
+    joined = dict()
+    for key in sorted(seamMoments.keys()):
+        root = union.find(key)
+        if root in joined:
+            joined[root].merge(seamMoments[key])
+        else:
+            joined[root] = seamMoments[key]
+    if joined and not headings:
+        headings = list(TILE_HEADINGS)
+        for heading in headings:
+            columns[heading] = []
+    for root in sorted(joined.keys()):
+        if joined[root].n < minSize:
+            continue
+        if minCircularity > 0.0 and getCircularity(joined[root].n, joined[root].getPerimeter()) < minCircularity:
+            continue
+        particle = joined[root].getMeasurements(calib)
+        for heading in headings:
+            columns[heading].append(particle.get(heading, Double.NaN))
+
+    # Threshold areas, as processImage does
+    ELMUnfilteredStats.writeUnfilteredStats(unfilteredPath, columns)
+    stats[c][z][t].update(ELMUnfilteredStats.applyAreaFilters(cfg, columns))
+
+    endTime = time.time()
+    if not 'tiled' in times:
+        times['tiled'] = []
+    times['tiled'].append(endTime-startTime)
+    return True
@@ -0,0 +1,197 @@
+# Copyright (C) 2011 - 2019, Raytheon BBN Technologies and contributors listed
+# in the AUTHORS file in TASBE Flow Analytics distribution's top directory.
+#
+# This file is part of the TASBE Flow Analytics package, and is distributed
+# under the terms of the GNU General Public License, with a linking
+# exception, as described in the file LICENSE in the TASBE Image Analysis
+# package distribution's top directory.
+
+from fiji.plugin.trackmate import Model, Settings, TrackMate, Spot, SpotCollection, Dimension, Logger
+from fiji.plugin.trackmate.io import TmXmlWriter
+
+from java.io import File, FileInputStream, FileOutputStream, BufferedInputStream, BufferedOutputStream, DataInputStream, DataOutputStream
+from java.lang import Double, Integer
+from java.util.zip import GZIPInputStream, GZIPOutputStream
+
+import os
+
+import ELMTracking
+
+# The compressed track model format:
+#   magic, version
+#   spot feature names: count, names
+#   edge feature names: count, names
+#   spots: count, then ID, frame, name and the spot feature values of each
+#   edges: count, then source ID, target ID, weight and the edge feature
+#          values of each
+# Missing feature values are written as NaN.
+TRACK_MODEL_MAGIC = "ELMTrackModel"
+TRACK_MODEL_VERSION = 1
+TRACK_MODEL_SUFFIX = "_trackModel.dat.gz"
+
+# Spot features that are passed to the Spot constructor
+SPOT_CTOR_FEATURES = ['POSITION_X', 'POSITION_Y', 'POSITION_Z', 'RADIUS', 'QUALITY']
+
+####
+#
+#  Get the path of the compressed track model of a channel
+#
+####
+def getTrackModelPath(wellPath, chanName):
+    return os.path.join(wellPath, chanName + TRACK_MODEL_SUFFIX)
+
+
+####
+#
+#  Write the spots and edges of a model, with all of their features, to a
+#  compressed file.  Spots and edges are written as they are iterated, so the
+#  model is never serialized in memory.
+#
+####
+def writeTrackModel(model, path):
+    fm = model.getFeatureModel()
+    trackModel = model.getTrackModel()
+    spots = model.getSpots()
+
+    spotFeatures = list(SPOT_CTOR_FEATURES)
+    for feature in list(fm.getSpotFeatures()) + [SpotCollection.VISIBILITY]:
+        if not feature in spotFeatures and not feature == 'FRAME':
+            spotFeatures.append(feature)
+    edgeFeatures = list(fm.getEdgeFeatures())
+
+    out = DataOutputStream(BufferedOutputStream(GZIPOutputStream(FileOutputStream(path))))
+    try:
+        out.writeUTF(TRACK_MODEL_MAGIC)
+        out.writeInt(TRACK_MODEL_VERSION)
+        for features in [spotFeatures, edgeFeatures]:
+            out.writeInt(len(features))
+            for feature in features:
+                out.writeUTF(feature)
+
+        out.writeInt(spots.getNSpots(False))
+        for spot in spots.iterable(False):
+            out.writeInt(spot.ID())
+            out.writeInt(int(spot.getFeature('FRAME')))
+            name = spot.getName()
+            if name is None:
+                name = ""
+            out.writeUTF(name)
+            for feature in spotFeatures:
+                value = spot.getFeature(feature)
+                if value is None:
+                    out.writeDouble(Double.NaN)
+                else:
+                    out.writeDouble(value)
+
+        edges = trackModel.edgeSet()
+        out.writeInt(edges.size())
+        for edge in edges:
+            out.writeInt(trackModel.getEdgeSource(edge).ID())
+            out.writeInt(trackModel.getEdgeTarget(edge).ID())
+            out.writeDouble(trackModel.getEdgeWeight(edge))
+            for feature in edgeFeatures:
+                value = fm.getEdgeFeature(edge, feature)
+                if value is None:
+                    out.writeDouble(Double.NaN)
+                else:
+                    out.writeDouble(value)
+    finally:
+        out.close()
+
+
+####
+#
+#  Declare features read from a track model file that a model doesn't know
+#  about yet
+#
+####
+def declareFeatures(declared, features, declare):
+    newFeatures = [feature for feature in features if not feature in declared]
+    if not newFeatures:
+        return
+    names = dict([(feature, feature) for feature in newFeatures])
+    dimensions = dict([(feature, Dimension.NONE) for feature in newFeatures])
+    isInt = dict([(feature, False) for feature in newFeatures])
+    declare(newFeatures, names, names, dimensions, isInt)
+
+
+####
+#
+#  Rebuild a TrackMate Model from a compressed track model file, e.g. to
+#  inspect it in the TrackMate GUI.  Spots get new IDs, since TrackMate assigns
+#  them.  If computeTrackFeatures is True, the track features are recomputed
+#  with the same analyzers as cellStatsTracking.
+#
+####
+def loadTrackModel(path, computeTrackFeatures=True):
+    model = Model()
+    model.setLogger(Logger.VOID_LOGGER)
+    fm = model.getFeatureModel()
+
+    inp = DataInputStream(BufferedInputStream(GZIPInputStream(FileInputStream(path))))
+    try:
+        if not inp.readUTF() == TRACK_MODEL_MAGIC:
+            print "ERROR: " + path + " is not a track model file!"
+            return None
+        version = inp.readInt()
+        if version > TRACK_MODEL_VERSION:
+            print "ERROR: Unsupported track model version " + str(version) + " in " + path
+            return None
+        spotFeatures = [inp.readUTF() for i in range(0, inp.readInt())]
+        edgeFeatures = [inp.readUTF() for i in range(0, inp.readInt())]
+        declareFeatures(fm.getSpotFeatures(), spotFeatures, fm.declareSpotFeatures)
+        declareFeatures(fm.getEdgeFeatures(), edgeFeatures, fm.declareEdgeFeatures)
+
+        model.beginUpdate()
+        try:
+            spotsById = dict()
+            for i in range(0, inp.readInt()):
+                spotId = inp.readInt()
+                frame = inp.readInt()
+                name = inp.readUTF()
+                values = [inp.readDouble() for feature in spotFeatures]
+                spot = Spot(values[0], values[1], values[2], values[3], values[4])
+                if name:
+                    spot.setName(name)
+                model.addSpotTo(spot, Integer(frame))
+                for feature, value in zip(spotFeatures, values)[len(SPOT_CTOR_FEATURES):]:
+                    if not Double.isNaN(value):
+                        spot.putFeature(feature, value)
+                spotsById[spotId] = spot
+
+            for i in range(0, inp.readInt()):
+                src = spotsById[inp.readInt()]
+                dst = spotsById[inp.readInt()]
+                edge = model.addEdge(src, dst, inp.readDouble())
+                for feature in edgeFeatures:
+                    value = inp.readDouble()
+                    if not Double.isNaN(value):
+                        fm.putEdgeFeature(edge, feature, value)
+        finally:
+            model.endUpdate()
+    finally:
+        inp.close()
+
+    if computeTrackFeatures:
+        settings = Settings()
+        ELMTracking.addTrackAnalyzers(settings)
+        trackmate = TrackMate(model, settings)
+        if not trackmate.computeTrackFeatures(False):
+            print "Warning: Could not compute track features for " + path + ": " + str(trackmate.getErrorMessage())
+    return model
+
+
+####
+#
+#  Convert a compressed track model file into a TrackMate XML file, which can
+#  be opened in the TrackMate GUI
+#
+####
+def convertToXml(path, xmlPath):
+    model = loadTrackModel(path)
+    if model is None:
+        return False
+    writer = TmXmlWriter(File(xmlPath), Logger.VOID_LOGGER)
+    writer.appendModel(model)
+    writer.writeToFile()
+    return True
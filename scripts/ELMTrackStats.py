@@ -0,0 +1,182 @@
+# Copyright (C) 2011 - 2019, Raytheon BBN Technologies and contributors listed
+# in the AUTHORS file in TASBE Flow Analytics distribution's top directory.
+#
+# This file is part of the TASBE Flow Analytics package, and is distributed
+# under the terms of the GNU General Public License, with a linking
+# exception, as described in the file LICENSE in the TASBE Image Analysis
+# package distribution's top directory.
+
+# Track statistics, computed from columns of spot and edge data.  Statistics
+# are kept as numbers in columns, keyed by column name, from the spot table
+# through to the plate summary.  This only uses plain Python, so it is shared
+# by the TrackMate and the particle linker tracking.
+
+import math
+
+# Columns of the track summary table
+TRACK_STATS_COLUMNS = ['Track Id', 'Duration', 'Avg Total Intensity', 'Start Frame', 'Stop Frame',
+                       'Displacement', 'Mean Speed', 'Num Merges', 'Num Spots']
+
+# Track stats that are summarized over a well, and the statistics of each.
+# The original columns come first, in their original order, so readers that
+# index the columns are unaffected; the added statistics follow them.
+PLATE_SUMMARY_STATS = ['Duration', 'Avg Total Intensity']
+PLATE_SUMMARY_FUNCS = ['Mean', 'Max', 'Min']
+PLATE_SUMMARY_EXTRA_FUNCS = ['Median', '10th Percentile', '90th Percentile']
+
+####
+#
+#  Get the value at a percentile (0 - 100) of a sorted list, interpolating
+#  between the closest values
+#
+####
+def percentile(sortedValues, pct):
+    if not sortedValues:
+        return float('nan')
+    pos = (len(sortedValues) - 1) * pct / 100.0
+    lower = int(math.floor(pos))
+    upper = min(lower + 1, len(sortedValues) - 1)
+    return sortedValues[lower] + (sortedValues[upper] - sortedValues[lower]) * (pos - lower)
+
+
+####
+#
+#  Compute the stats of every track from spot and edge columns.  The spot
+#  columns are 'Track Id', 'Frame', 'X', 'Y' and 'Total Intensity' (None if
+#  unknown), and the edge columns are 'Source' and 'Target', the indexes of the
+#  linked spots in the spot columns.  Returns the track stats columns, with
+#  tracks in order of their ID.
+#
+####
+def computeTrackStats(spotColumns, edgeColumns):
+    trackIds = spotColumns['Track Id']
+    frames = spotColumns['Frame']
+    xs = spotColumns['X']
+    ys = spotColumns['Y']
+    intensities = spotColumns['Total Intensity']
+
+    # Spot pass: extent in time, intensity and the first and last positions
+    tracks = dict()
+    for i in xrange(0, len(trackIds)):
+        track = tracks.get(trackIds[i])
+        if track is None:
+            # [start, stop, start spot, stop spot, intensity sum, num spots, merges, speed sum, num edges]
+            track = [frames[i], frames[i], i, i, 0.0, 0, 0, 0.0, 0]
+            tracks[trackIds[i]] = track
+        if frames[i] < track[0]:
+            track[0] = frames[i]
+            track[2] = i
+        if frames[i] > track[1]:
+            track[1] = frames[i]
+            track[3] = i
+        if not intensities[i] is None:
+            track[4] += intensities[i]
+        track[5] += 1
+
+    # Edge pass: speeds, and merges where a spot has more than one incoming edge
+    numIncoming = dict()
+    sources = edgeColumns['Source']
+    targets = edgeColumns['Target']
+    for i in xrange(0, len(sources)):
+        src = sources[i]
+        dst = targets[i]
+        track = tracks[trackIds[dst]]
+        dt = frames[dst] - frames[src]
+        if not dt == 0:
+            track[7] += math.hypot(xs[dst] - xs[src], ys[dst] - ys[src]) / abs(dt)
+            track[8] += 1
+        numIncoming[dst] = numIncoming.get(dst, 0) + 1
+        if numIncoming[dst] == 2:
+            track[6] += 1
+
+    stats = dict([(column, []) for column in TRACK_STATS_COLUMNS])
+    for tId in sorted(tracks.keys()):
+        start, stop, startSpot, stopSpot, intensitySum, numSpots, merges, speedSum, numEdges = tracks[tId]
+        stats['Track Id'].append(tId)
+        stats['Duration'].append(float(stop - start))
+        stats['Avg Total Intensity'].append(intensitySum / numSpots)
+        stats['Start Frame'].append(float(start))
+        stats['Stop Frame'].append(float(stop))
+        stats['Displacement'].append(math.hypot(xs[stopSpot] - xs[startSpot], ys[stopSpot] - ys[startSpot]))
+        if numEdges > 0:
+            stats['Mean Speed'].append(speedSum / numEdges)
+        else:
+            stats['Mean Speed'].append(0.0)
+        stats['Num Merges'].append(merges)
+        stats['Num Spots'].append(numSpots)
+    return stats
+
+
+####
+#
+#  Get the number of tracks in a set of track stats
+#
+####
+def getNumTracks(stats):
+    return len(stats['Track Id'])
+
+
+####
+#
+#  Write the track summary table of a channel
+#
+####
+def writeTrackSummary(path, stats):
+    trackFile = open(path, 'w')
+    trackFile.write(', '.join(TRACK_STATS_COLUMNS) + '\n')
+    for i in xrange(0, getNumTracks(stats)):
+        trackFile.write(','.join([str(stats[column][i]) for column in TRACK_STATS_COLUMNS]) + '\n')
+    trackFile.close()
+
+
+####
+#
+#  Get the header of the plate summary table
+#
+####
+def getPlateSummaryHeader():
+    header = ['Date', 'Wellname', 'Num Tracks']
+    for stat in PLATE_SUMMARY_STATS:
+        header += [func + ' ' + stat for func in PLATE_SUMMARY_FUNCS]
+    for stat in PLATE_SUMMARY_STATS:
+        header += [func + ' ' + stat for func in PLATE_SUMMARY_EXTRA_FUNCS]
+    header += ['Mean Displacement', 'Mean Speed', 'Total Merges']
+    return header
+
+
+####
+#
+#  Summarize the track stats of a well, in the order of the plate summary
+#  header
+#
+####
+def summarizeWell(stats):
+    numTracks = getNumTracks(stats)
+    summary = [numTracks]
+    sortedValues = dict()
+    for stat in PLATE_SUMMARY_STATS:
+        sortedValues[stat] = sorted(stats[stat])
+        values = sortedValues[stat]
+        summary += [sum(values) / numTracks, values[-1], values[0]]
+    for stat in PLATE_SUMMARY_STATS:
+        values = sortedValues[stat]
+        summary += [percentile(values, 50), percentile(values, 10), percentile(values, 90)]
+    summary += [sum(stats['Displacement']) / numTracks, sum(stats['Mean Speed']) / numTracks, sum(stats['Num Merges'])]
+    return summary
+
+
+####
+#
+#  Write the plate summary table, with a row for each well that has tracks.
+#  wellStats maps a well name to its track stats.
+#
+####
+def writePlateSummary(path, date, wellStats):
+    trackFile = open(path, 'w')
+    trackFile.write(', '.join(getPlateSummaryHeader()) + '\n')
+    for wellName in sorted(wellStats.keys()):
+        stats = wellStats[wellName]
+        if not stats or getNumTracks(stats) == 0:
+            continue
+        trackFile.write(','.join([date, wellName] + [str(value) for value in summarizeWell(stats)]) + '\n')
+    trackFile.close()
@@ -0,0 +1,263 @@
+# Copyright (C) 2011 - 2019, Raytheon BBN Technologies and contributors listed
+# in the AUTHORS file in TASBE Flow Analytics distribution's top directory.
+#
+# This file is part of the TASBE Flow Analytics package, and is distributed
+# under the terms of the GNU General Public License, with a linking
+# exception, as described in the file LICENSE in the TASBE Image Analysis
+# package distribution's top directory.
+
+from fiji.plugin.trackmate import Model, Settings, TrackMate, Spot, SpotCollection
+
+from fiji.plugin.trackmate.tracking.sparselap import SparseLAPTrackerFactory
+from fiji.plugin.trackmate.tracking import LAPUtils
+import fiji.plugin.trackmate.tracking.TrackerKeys as TrackerKeys
+
+from fiji.plugin.trackmate.features.track import TrackBranchingAnalyzer, TrackIndexAnalyzer, TrackLocationAnalyzer, TrackSpeedStatisticsAnalyzer, TrackDurationAnalyzer
+
+from java.lang import Integer, Runtime
+from java.util import HashMap
+from java.util.concurrent import Callable, Executors
+
+import itertools
+
+import ELMConfig, ELMParticleLinker, ELMFrameStack, ELMImageUtils
+
+####
+#
+#  Get the threshold passed to the ThresholdDetector for a channel: the whole
+#  range threshold with thresholdFromWholeRange, otherwise imageThreshold.  A
+#  threshold of 0 makes the detector compute one on each frame.
+#
+####
+def getDetectionThreshold(cfg, wellPath, c, chanName, framePaths):
+    if cfg.hasValue(ELMConfig.thresholdFromWholeRange) and cfg.getValue(ELMConfig.thresholdFromWholeRange) == True \
+            and not ELMImageUtils.isLocalThresholdMethod(cfg):
+        return ELMFrameStack.getWholeRangeThreshold(cfg, wellPath, c, chanName, framePaths)
+    if cfg.hasValue(ELMConfig.imageThreshold):
+        print("\tUsing imageThreshold " + str(cfg.getValue(ELMConfig.imageThreshold)))
+        return cfg.getValue(ELMConfig.imageThreshold)
+    print("\tUsing threshold computed on individual images!")
+    return 0
+
+
+####
+#
+#  Get every combination of the tracker param values, for a tracker sweep
+#
+####
+def getTrackerParamGrid(cfg):
+    valueLists = [ELMConfig.getTrackerParamValues(cfg, param) for param in ELMConfig.TRACKER_PARAMS]
+    return [dict(zip(ELMConfig.TRACKER_PARAMS, values)) for values in itertools.product(*valueLists)]
+
+
+####
+#
+#  Configure the tracker of a TrackMate settings object - We want to allow
+#  merges and fusions
+#
+####
+def configureTracker(settings, trackerParams):
+    settings.trackerFactory = SparseLAPTrackerFactory()
+    settings.trackerSettings = LAPUtils.getDefaultLAPSettingsMap() # almost good enough
+
+    # Linking
+    settings.trackerSettings[TrackerKeys.KEY_LINKING_MAX_DISTANCE] = float(trackerParams[ELMConfig.linkingMaxDistance]); # in pixels
+
+    linkFeaturePenalties = HashMap();
+    linkFeaturePenalties['Area'] = 1.0
+    linkFeaturePenalties['POSITION_X'] = 1.0
+    linkFeaturePenalties['POSITION_Y'] = 1.0
+    #linkFeaturePenalties['Circ.'] = 1.0
+    #linkFeaturePenalties['Mean'] = 1.0
+
+    settings.trackerSettings[TrackerKeys.KEY_LINKING_FEATURE_PENALTIES] = linkFeaturePenalties;
+    # Gap closing
+    settings.trackerSettings[TrackerKeys.KEY_ALLOW_GAP_CLOSING] =  True;
+    settings.trackerSettings[TrackerKeys.KEY_GAP_CLOSING_MAX_FRAME_GAP] =  int(trackerParams[ELMConfig.gapClosingMaxFrameGap]);
+    settings.trackerSettings[TrackerKeys.KEY_GAP_CLOSING_MAX_DISTANCE] =  float(trackerParams[ELMConfig.gapClosingMaxDistance]); # in pixels
+    #settings.trackerSettings[TrackerKeys.KEY_GAP_CLOSING_FEATURE_PENALTIES] =  new HashMap<>(DEFAULT_GAP_CLOSING_FEATURE_PENALTIES));
+    # Track splitting
+    settings.trackerSettings[TrackerKeys.KEY_ALLOW_TRACK_SPLITTING] =  False;
+    settings.trackerSettings[TrackerKeys.KEY_SPLITTING_MAX_DISTANCE] =  45.0; # in pixels
+    #settings.trackerSettings[TrackerKeys.KEY_SPLITTING_FEATURE_PENALTIES] =  new HashMap<>(DEFAULT_SPLITTING_FEATURE_PENALTIES));
+    # Track merging
+    settings.trackerSettings[TrackerKeys.KEY_ALLOW_TRACK_MERGING] =  True;
+    settings.trackerSettings[TrackerKeys.KEY_MERGING_MAX_DISTANCE] =  float(trackerParams[ELMConfig.mergingMaxDistance]); # in pixels
+    #settings.trackerSettings[TrackerKeys.KEY_MERGING_FEATURE_PENALTIES] =  new HashMap<>(DEFAULT_MERGING_FEATURE_PENALTIES));
+    # Others
+    settings.trackerSettings[TrackerKeys.KEY_BLOCKING_VALUE] =  float("inf");
+    settings.trackerSettings[TrackerKeys.KEY_ALTERNATIVE_LINKING_COST_FACTOR] =  1.05;
+    settings.trackerSettings[TrackerKeys.KEY_CUTOFF_PERCENTILE] =  0.9;
+
+
+####
+#
+#  Add the track analyzers - By default, out of the GUI, no features are
+#  calculated.
+#
+####
+def addTrackAnalyzers(settings):
+    # The displacement feature is provided by the TrackDurationAnalyzer.
+    settings.addTrackAnalyzer(TrackDurationAnalyzer())
+    settings.addTrackAnalyzer(TrackBranchingAnalyzer())
+    settings.addTrackAnalyzer(TrackIndexAnalyzer())
+    settings.addTrackAnalyzer(TrackLocationAnalyzer())
+    settings.addTrackAnalyzer(TrackSpeedStatisticsAnalyzer())
+
+
+####
+#
+#  Copy every spot of a collection, so that separate models don't share
+#  (and modify) the same Spot objects
+#
+####
+def copySpots(spots):
+    spotsCopy = SpotCollection()
+    for spot in spots.iterable(False):
+        spotCopy = Spot(spot.getFeature('POSITION_X'), spot.getFeature('POSITION_Y'), spot.getFeature('POSITION_Z'), \
+                        spot.getFeature('RADIUS'), spot.getFeature('QUALITY'))
+        for feature in spot.getFeatures().keySet():
+            spotCopy.putFeature(feature, spot.getFeature(feature))
+        spotsCopy.add(spotCopy, Integer(int(spot.getFeature('FRAME'))))
+    return spotsCopy
+
+
+####
+#
+#  Summarize the tracks of a model: number of tracks, mean track duration and
+#  the total number of merges
+#
+####
+def summarizeTracks(model):
+    fm = model.getFeatureModel()
+    trackIds = model.getTrackModel().trackIDs(True)
+    numTracks = trackIds.size()
+    totalDuration = 0.0
+    numMerges = 0
+    for tId in trackIds:
+        totalDuration += fm.getTrackFeature(tId, 'TRACK_DURATION')
+        numMerges += int(fm.getTrackFeature(tId, 'NUMBER_MERGES'))
+    meanDuration = 0.0
+    if numTracks > 0:
+        meanDuration = totalDuration / numTracks
+    return [numTracks, meanDuration, numMerges]
+
+
+####
+#
+#  Runs the tracker for a single combination of tracker params, on its own
+#  copy of the detected spots
+#
+####
+class TrackerSweepJob(Callable):
+
+    ###
+    #
+    ###
+    def __init__(self, spots, spotFilters, trackerParams):
+        self.spots = spots
+        self.spotFilters = spotFilters
+        self.trackerParams = trackerParams
+
+    ###
+    #
+    ###
+    def call(self):
+        model = Model()
+        settings = Settings()
+        for spotFilter in self.spotFilters:
+            settings.addSpotFilter(spotFilter)
+        configureTracker(settings, self.trackerParams)
+        addTrackAnalyzers(settings)
+
+        trackmate = TrackMate(model, settings)
+        trackmate.setNumThreads(1)
+        model.setSpots(copySpots(self.spots), False)
+        ok = trackmate.execSpotFiltering(False) \
+            and trackmate.execTracking() \
+            and trackmate.computeTrackFeatures(False)
+        if not ok:
+            print("Tracker sweep failed for " + str(self.trackerParams) + ": " + str(trackmate.getErrorMessage()))
+            return None
+        return summarizeTracks(model)
+
+
+####
+#
+#  Run the tracker for every combination of the tracker params in the config,
+#  in parallel, on one set of detected spots.  Writes a table with the track
+#  summary of each combination.
+#
+####
+def runTrackerSweep(cfg, spots, spotFilters, sweepPath):
+    paramGrid = getTrackerParamGrid(cfg)
+    numThreads = min(len(paramGrid), Runtime.getRuntime().availableProcessors())
+    print("Running tracker sweep over " + str(len(paramGrid)) + " combinations with " + str(numThreads) + " threads...")
+
+    executor = Executors.newFixedThreadPool(numThreads)
+    try:
+        futures = [executor.submit(TrackerSweepJob(spots, spotFilters, trackerParams)) for trackerParams in paramGrid]
+        results = [future.get() for future in futures]
+    finally:
+        executor.shutdown()
+
+    sweepFile = open(sweepPath, 'w')
+    sweepFile.write(', '.join(ELMConfig.TRACKER_PARAMS) + ', Num Tracks, Mean Duration, Num Merges\n')
+    for trackerParams, result in zip(paramGrid, results):
+        if result is None:
+            continue
+        data = [str(trackerParams[param]) for param in ELMConfig.TRACKER_PARAMS] + [str(val) for val in result]
+        sweepFile.write(','.join(data) + '\n')
+    sweepFile.close()
+
+
+####
+#
+#  Index the edges of a track model: for every spot ID, the list of spot IDs
+#  linked by incoming edges (ancestors) and by outgoing edges (descendants).
+#  Each edge is only looked up once per end, so later passes don't need to
+#  query the track model again.
+#
+####
+def buildEdgeIndex(trackModel, spots):
+    incoming = {}
+    outgoing = {}
+    for spot in spots.iterable(False):
+        spotIncoming = []
+        spotOutgoing = []
+        for edge in trackModel.edgesOf(spot):
+            src = trackModel.getEdgeSource(edge)
+            dst = trackModel.getEdgeTarget(edge)
+            if dst.ID() == spot.ID():
+                spotIncoming.append(src.ID())
+            else:
+                spotOutgoing.append(dst.ID())
+        incoming[spot.ID()] = spotIncoming
+        outgoing[spot.ID()] = spotOutgoing
+    return incoming, outgoing
+
+
+####
+#
+#  Determine sub-tracks within each track of a model.  Since tracks can merge,
+#  we want to keep track of which track a spot is in prior to the merge.
+#  Returns a map from spot ID to [sub-track ID, track ID, frame].
+#
+####
+def labelSubTracks(model):
+    trackModel = model.getTrackModel()
+    edgeIndex = buildEdgeIndex(trackModel, model.getSpots())
+
+    spotIds = []
+    frames = {}
+    for spot in model.getSpots().iterable(False):
+        spotIds.append(spot.ID())
+        frames[spot.ID()] = spot.getFeature('FRAME')
+
+    trackIdOf = {}
+    for tId in trackModel.trackIDs(False):
+        for spot in trackModel.trackSpots(tId):
+            trackIdOf[spot.ID()] = tId
+    tracks = [(tId, [spot.ID() for spot in trackModel.trackSpots(tId)]) for tId in trackModel.trackIDs(True)]
+
+    return ELMParticleLinker.labelSubTracks(edgeIndex, frames, spotIds, trackIdOf, tracks)
@@ -0,0 +1,142 @@
+# Copyright (C) 2011 - 2019, Raytheon BBN Technologies and contributors listed
+# in the AUTHORS file in TASBE Flow Analytics distribution's top directory.
+#
+# This file is part of the TASBE Flow Analytics package, and is distributed
+# under the terms of the GNU General Public License, with a linking
+# exception, as described in the file LICENSE in the TASBE Image Analysis
+# package distribution's top directory.
+
+# The particle tables of each frame before the area thresholds are applied.
+# cellStats writes one for every frame it segments, in full frame
+# coordinates, so areaMaxPercentThreshold and areaAbsoluteThreshold can be
+# applied again without reading or segmenting any images.  Each table is a
+# CSV with a line of column names, then a line of values per particle.  Values
+# are written with repr so they are read back exactly, and a column with no
+# values is written as N/A.
+
+import os, shutil
+
+import ELMConfig
+
+UNFILTERED_DIR = "unfiltered"
+NO_VALUE = "N/A"
+
+####
+#
+#  Get the path of the unfiltered particle table of a frame
+#
+####
+def getUnfilteredPath(cfg, wellName, wellPath, c, z, t):
+    fileName = wellName + '_' + cfg.getCStr(c) + '_' + cfg.getZStr(z) + '_' + cfg.getTStr(t) + "_unfiltered.csv"
+    return os.path.join(wellPath, UNFILTERED_DIR, fileName)
+
+
+####
+#
+#  Write a particle table, a dict from column name to values (or None)
+#
+####
+def writeUnfilteredStats(path, columns):
+    tableDir = os.path.dirname(path)
+    if not os.path.exists(tableDir):
+        os.makedirs(tableDir)
+    headings = sorted(columns.keys())
+    numParticles = 0
+    for heading in headings:
+        if columns[heading]:
+            numParticles = len(columns[heading])
+            break
+
+    tableFile = open(path, "w")
+    tableFile.write(", ".join(headings) + "\n")
+    for particle in range(0, numParticles):
+        values = []
+        for heading in headings:
+            if columns[heading]:
+                values.append(repr(float(columns[heading][particle])))
+            else:
+                values.append(NO_VALUE)
+        tableFile.write(", ".join(values) + "\n")
+    tableFile.close()
+
+
+####
+#
+#  Read a particle table written by writeUnfilteredStats.  Returns None if the
+#  frame has no table.
+#
+####
+def readUnfilteredStats(path):
+    if not os.path.exists(path):
+        return None
+    tableFile = open(path, "r")
+    headings = [heading.strip() for heading in tableFile.readline().split(",") if heading.strip()]
+    columns = dict()
+    for heading in headings:
+        columns[heading] = []
+    for line in tableFile:
+        if not line.strip():
+            continue
+        values = [value.strip() for value in line.split(",")]
+        for i in range(0, len(headings)):
+            if values[i] == NO_VALUE:
+                columns[headings[i]] = None
+            elif not columns[headings[i]] is None:
+                columns[headings[i]].append(float(values[i]))
+    tableFile.close()
+    return columns
+
+
+####
+#
+#  Give a frame that was skipped the unfiltered particle table of the frame
+#  it took its results from, or an empty table if it has no particles
+#
+####
+def copyUnfilteredStats(sourcePath, path):
+    if sourcePath is None or not os.path.exists(sourcePath):
+        writeUnfilteredStats(path, dict())
+        return
+    tableDir = os.path.dirname(path)
+    if not os.path.exists(tableDir):
+        os.makedirs(tableDir)
+    shutil.copyfile(sourcePath, path)
+
+
+####
+#
+#  Get the indexes of the particles that pass the area thresholds, given their
+#  areas in um^2.  Particles smaller than areaMaxPercentThreshold times the
+#  largest particle, or smaller than areaAbsoluteThreshold, are removed.
+#
+####
+def getKeptParticles(cfg, umAreas):
+    keep = range(0, len(umAreas))
+    if umAreas and cfg.hasValue(ELMConfig.areaMaxPercentThreshold):
+        maxArea = max(umAreas)
+        keep = [k for k in keep if umAreas[k] >= cfg.getValue(ELMConfig.areaMaxPercentThreshold) * maxArea]
+    if cfg.hasValue(ELMConfig.areaAbsoluteThreshold):
+        keep = [k for k in keep if umAreas[k] >= cfg.getValue(ELMConfig.areaAbsoluteThreshold)]
+    return keep
+
+
+####
+#
+#  Apply the area thresholds to an unfiltered particle table.  Returns the
+#  frame stats, the kept particles of each column plus their areas in um^2.
+#
+####
+def applyAreaFilters(cfg, columns):
+    umAreas = []
+    if columns.get('Area'):
+        umAreas = [a * cfg.getValue(ELMConfig.pixelHeight) * cfg.getValue(ELMConfig.pixelWidth) for a in columns['Area']]
+    keep = getKeptParticles(cfg, umAreas)
+
+    frameStats = dict()
+    for heading in columns:
+        if columns[heading] is None:
+            frameStats[heading] = None
+        else:
+            frameStats[heading] = [columns[heading][k] for k in keep]
+    frameStats[ELMConfig.UM_AREA] = [umAreas[k] for k in keep]
+    return frameStats
@@ -22,7 +22,7 @@ import os, glob, re, time, sys
 for path in os.environ['CLASSPATH'].split(os.pathsep):
     sys.path.append(path)
 
-import ELMConfig, ELMImageUtils
+import ELMConfig, ELMImageUtils, ELMFrameStack, ELMParticleLinker, ELMTiledStats, ELMStackReader, ELMArrayStore, ELMSegmentationCache, ELMUnfilteredStats
 
 #
 #
@@ -30,7 +30,7 @@ import ELMConfig, ELMImageUtils
 def printUsage():
     global numChannels;
     global numZ;
-    
+
     print "This script will read tif or png files from an input directory and compute statistics on the cell images."
     print "The script must be pointed to a configuration ini file that will define several important aspects."
     print "The input and output dirs must be defined in the config file, however all of the rest of the config"
@@ -48,6 +48,34 @@ def printUsage():
     print "            Valid labels: skip, brightfield, red, green, blue, yellow"
     print "chansToSkip - List of channel names that will be skipped if channels are read from XML properties"
     print "analysisRoi - Rectangular area to perform cell detection on, default 0,0,512,480, must be defined in config file"
+    print "channelFanOut - Optional, True or False, if True decode each image file once and split it into all channels read from it"
+    print "thresholdFromWholeRange - Optional, True or False, if True threshold each channel with one value computed from all of its images"
+    print "memoryMapTiff - Optional, True or False, if True read uncompressed TIFFs through a memory map"
+    print "stackInput - Optional, True or False, if True multi-page and OME-TIFF hyperstacks are read plane by plane, with C, Z and T from their metadata"
+    print "arrayStore - Optional, True or False, if True thresholded masks and grayscale frames are stored in a chunked, compressed store in each well output dir and reused by all scripts"
+    print "arrayStoreChunkSize - Optional, width and height in pixels of the array store chunks, default 512"
+    print "segmentationCache - Optional, True or False, if True the particles and mask of each image are cached and reused while the image and segmentation params are unchanged"
+    print "segmentationCacheDir - Optional, dir of the segmentation cache, default is segmentationCache in the outputDir"
+    print "segmentationCacheSize - Optional, size limit of the segmentation cache in MB, default 1024, least recently used entries are removed"
+    print "segmentationCacheByContent - Optional, True or False, if True images are found in the segmentation cache by a hash of their contents instead of their path, size and modification time"
+    print "refilterOnly - Optional, True or False, if True no images are read, the area thresholds are applied to the particles found in an earlier run and the results tables are written again"
+    print "thresholdMethod - Optional, ImageJ auto threshold method, or LocalMean or Sauvola for a local threshold"
+    print "localThresholdRadius - Optional, window radius in pixels for the LocalMean and Sauvola methods, default 15"
+    print "localThresholdK - Optional, weight of the window std dev for the LocalMean and Sauvola methods, default 0.5"
+    print "linkParticles - Optional, True or False, if True link the particles of each channel into tracks"
+    print "frameStride - Optional, only process every frameStride-th timestep of each well, tracker distances and gaps are scaled to match"
+    print "frameWindow - Optional, first and last timestep to process, as numbered in the filenames, comma separated"
+    print "skipEmptyFrames - Optional, True or False, if True skip fluorescent frames with no pixels above imageThreshold or the whole range threshold"
+    print "coarseSegmentation - Optional, True or False, if True fluorescent channels are masked only in candidate regions found on a 4x downsampled frame"
+    print "coarseSegmentationTolerance - Optional, if set, coarse masks are checked against the full frame mask and replaced if the fraction of differing pixels is higher"
+    print "tileSize - Optional, if set, uncompressed TIFF frames are processed in square tiles of this many pixels, to bound memory use on large stitched images"
+    print "tileOverlap - Optional, margin in pixels read around each tile, default 16, raised to cover the local threshold radius"
+    print "reuseDuplicateFrames - Optional, True or False, if True reuse the previous frame's results when its fingerprint is unchanged"
+    print "linkingMaxDistance - Optional, max distance in pixels to link particles in consecutive frames, default 220"
+    print "gapClosingMaxDistance - Optional, max distance in pixels to link particles across a gap, default 120"
+    print "gapClosingMaxFrameGap - Optional, max number of frames in a closed gap, default 8"
+    print "mergingMaxDistance - Optional, max distance in pixels to merge a track into another, default 45"
+    print "cropToRoi - Optional, True or False, if True crop images to the analysisRoi and exclusion bounds before processing"
     print "wellNames - Optional, list of well names to process, others are ignored"
     print "debugOutput - Optional, True or False, if True output additional info for debugging purposes"
 
@@ -102,6 +130,10 @@ def main(cfg):
         if not cfg.hasValue(ELMConfig.chanLabel):
             cfg.getCytationChanNames(imgFiles)
 
+    # Stacks are replaced by the planes they hold, named like plane files
+    if cfg.hasValue(ELMConfig.stackInput) and cfg.getValue(ELMConfig.stackInput):
+        imgFiles = ELMStackReader.expandStacks(imgFiles, cfg)
+
     # Get the names of all wells that exist in this dataset/plate
     wellNames = []
     # Each well will have a collection of images, but will all fall under the same common prefix descriptor
@@ -114,6 +146,8 @@ def main(cfg):
     numZ = dict()
     pngTimesteps = dict()
     pngZSlices = dict()
+    wellTimesteps = dict()
+    imgTimesteps = dict()
 
     # Analyze image filenames to get different pieces of information
     # We care about a time, Z, channel, and the well name
@@ -182,6 +216,7 @@ def main(cfg):
             if wellName not in pngTimesteps:
                 pngTimesteps[wellName] = set()
             pngTimesteps[wellName].add(timestep)
+            imgTimesteps[filePath] = timestep
             maxT[wellName] = len(pngTimesteps[wellName])
             minT[wellName] = 1
 
@@ -202,6 +237,10 @@ def main(cfg):
                 maxT[wellName] = timestep
             if wellName not in minT or timestep < minT[wellName]:
                 minT[wellName] = timestep
+            if wellName not in wellTimesteps:
+                wellTimesteps[wellName] = set()
+            wellTimesteps[wellName].add(timestep)
+            imgTimesteps[filePath] = timestep
         # Set channel file index
         if not chIdx == sys.maxint:
             cfg.setValue(ELMConfig.cIdx, chIdx)
@@ -269,6 +308,15 @@ def main(cfg):
                 zSlices = list(pngZSlices[wellName]);
                 zSlices.sort()
                 cfg.setValue(ELMConfig.zList, zSlices)
+            wellTimesteps[wellName] = pngTimesteps[wellName]
+
+        # Skipped frames are dropped from the well's files, so they are never opened
+        if cfg.hasFrameSelection() and wellName in wellTimesteps:
+            selected = set(cfg.selectFrames(wellTimesteps[wellName]))
+            if not selected:
+                print "No frames of well " + wellName + " in the frame window! Skipping well."
+                continue
+            dsImgFiles = [imgPath for imgPath in dsImgFiles if imgTimesteps[imgPath] in selected]
 
         cfg.setValue(ELMConfig.noZInFile, noZInFile[wellName] or cfg.getValue(ELMConfig.numZ) == 1)
         cfg.setValue(ELMConfig.noTInFile, noTInFile[wellName] or cfg.getValue(ELMConfig.numT) == 1)
@@ -314,6 +362,9 @@ def processDataset(cfg, datasetName, imgFiles):
         for imgPath in imgFiles:
             fileName = os.path.basename(imgPath)
             c,z,t = cfg.getCZTFromFilename(fileName)
+            # Skipped frames
+            if t is None:
+                continue
             imgFileCats[c][z][t].append(imgPath)
             if (len(imgFileCats[c][z][t]) > 1):
                 print "ERROR: More than one image for c,z,t: " + str(c) + ", " + str(z) + ", "+ str(t)
@@ -333,11 +384,14 @@ def processDataset(cfg, datasetName, imgFiles):
         quit(-1)
 
     fileTime = time.time()
-    # Process images
-    stats = processImages(cfg, datasetName, datasetPath, imgFileCats)
+    # Process images, or only filter the particles they were segmented into
+    if cfg.hasValue(ELMConfig.refilterOnly) and cfg.getValue(ELMConfig.refilterOnly):
+        stats = refilterImages(cfg, datasetName, datasetPath)
+    else:
+        stats = processImages(cfg, datasetName, datasetPath, imgFileCats)
 
     statsTime = time.time()
-    
+
     outputChans = [];
     for chan in cfg.getValue(ELMConfig.chanLabel):
         if not chan in cfg.params[ELMConfig.chansToSkip] and not chan == ELMConfig.BRIGHTFIELD:
@@ -428,7 +482,10 @@ def processDataset(cfg, datasetName, imgFiles):
 
     resultsFile.write(resultsString)
     resultsFile.close()
-    
+
+    if cfg.hasValue(ELMConfig.linkParticles) and cfg.getValue(ELMConfig.linkParticles):
+        linkDatasetParticles(cfg, datasetName, datasetPath)
+
     outputTime = time.time();
     print("Well times: fileTime: %f, statsTime: %f, outputTime: %f" % (fileTime - startTime, statsTime-fileTime, outputTime - statsTime))
     return resultsString
@@ -437,319 +494,586 @@ def processDataset(cfg, datasetName, imgFiles):
 
 ####
 #
-#  All of the processing that happens for each image
+#  Link the particles in the per-frame stats tables of each channel and z
+#  slice into tracks
 #
 ####
-def processImages(cfg, wellName, wellPath, images):
+def linkDatasetParticles(cfg, datasetName, datasetPath):
+    trackerParams = ELMConfig.getTrackerParams(cfg)
+    for c in range(0, cfg.getValue(ELMConfig.numChannels)):
+        if cfg.getValue(ELMConfig.chanLabel)[c] in cfg.getValue(ELMConfig.chansToSkip):
+            continue
+        for z in range(0, cfg.getValue(ELMConfig.numZ)):
+            chanStr = '_' + cfg.getCStr(c)
+            zStr = '_' + cfg.getZStr(z)
+            # Frames without particles have no stats table
+            statsPaths = dict()
+            for t in range(0, cfg.getValue(ELMConfig.numT)):
+                statsPath = os.path.join(datasetPath, datasetName + chanStr + zStr + '_' + cfg.getTStr(t) + "_stats.csv")
+                if os.path.exists(statsPath):
+                    statsPaths[t] = statsPath
+            chanName = cfg.getValue(ELMConfig.chanLabel)[c]
+            if cfg.getValue(ELMConfig.numZ) > 1:
+                chanName += zStr
+            ELMParticleLinker.linkStatsFiles(statsPaths, trackerParams, datasetPath, chanName)
+
 
+
+####
+#
+#  Apply the area thresholds to the unfiltered particle tables written when
+#  the images of a well were segmented, without reading the images.  Frames
+#  that were never segmented are an error.
+#
+####
+def refilterImages(cfg, wellName, wellPath):
     stats = [[[dict() for t in range(cfg.getValue(ELMConfig.numT))] for z in range(cfg.getValue(ELMConfig.numZ))] for c in range(cfg.getValue(ELMConfig.numChannels))]
-    times = {}
+    missingTable = False
     for c in range(0, cfg.getValue(ELMConfig.numChannels)):
-        chanStr = 'ch%(channel)02d' % {"channel" : c};
-        chanName = cfg.getValue(ELMConfig.chanLabel)[c]
-
-        # Set some config based upon channel
         if (cfg.getValue(ELMConfig.chanLabel)[c] in cfg.getValue(ELMConfig.chansToSkip)):
             continue
-        if (cfg.getValue(ELMConfig.chanLabel)[c] == ELMConfig.BRIGHTFIELD):
-            minCircularity = 0.001 # We want to identify one big cell ball, so ignore small less circular objects
-            if cfg.params[ELMConfig.imgType] == "png":
-                minSize = 5;
-            else:
-                minSize = 500
-        elif (cfg.getValue(ELMConfig.chanLabel)[c] == ELMConfig.BLUE) \
-                or (cfg.getValue(ELMConfig.chanLabel)[c] == ELMConfig.RED) \
-                or (cfg.getValue(ELMConfig.chanLabel)[c] == ELMConfig.GREEN): #
-            minCircularity = 0.001
-            minSize = 5
-        elif (cfg.getValue(ELMConfig.chanLabel)[c] == ELMConfig.YELLOW):
-            minCircularity = 0.001
-            minSize = 5
-
-        # Process images in Z stack
         for z in range(0, cfg.getValue(ELMConfig.numZ)):
-            zStr = cfg.getZStr(z);
             for t in range(0, cfg.getValue(ELMConfig.numT)):
-                tStr = cfg.getTStr(t)
-                if (cfg.getValue(ELMConfig.imgType) == "png"):
-                    # Brightfield uses the whole iamge
-                    if (cfg.getValue(ELMConfig.chanLabel)[c] == ELMConfig.BRIGHTFIELD):
-                        currIP = IJ.openImage(images[c][z][t][0])
-                    else: # otherwise, we'll plit off channels
-                        chanIdx = 2
-                        if (cfg.getValue(ELMConfig.chanLabel)[c] == ELMConfig.RED):
-                            chanIdx = 0
-                        elif (cfg.getValue(ELMConfig.chanLabel)[c] == ELMConfig.GREEN):
-                            chanIdx = 1;
-                        img = IJ.openImage(images[c][z][t][0])
-                        imgChanns = ChannelSplitter.split(img);
-                        img.close()
-                        currIP = imgChanns[chanIdx];
-                else:
-                    currIP = IJ.openImage(images[c][z][t][0])
-                resultsImage = currIP.duplicate()
-                dbgOutDesc = wellName + "_" + zStr + "_" + chanStr + "_" + tStr
-                if (cfg.getValue(ELMConfig.numT) > 1):
-                    outputPath = os.path.join(wellPath, "images") 
-                    if not os.path.exists(outputPath):
-                        os.makedirs(outputPath)
-                else:
-                    outputPath = wellPath
+                unfilteredPath = ELMUnfilteredStats.getUnfilteredPath(cfg, wellName, wellPath, c, z, t)
+                columns = ELMUnfilteredStats.readUnfilteredStats(unfilteredPath)
+                if columns is None:
+                    print "ERROR: No unfiltered particle table for " + wellName + " c,z,t: " + str(c) + ", " + str(z) + ", "+ str(t) \
+                          + ", run without refilterOnly first!"
+                    missingTable = True
+                    continue
+                stats[c][z][t] = ELMUnfilteredStats.applyAreaFilters(cfg, columns)
+    if missingTable:
+        quit(-1)
+    return stats
 
-                if cfg.getValue(ELMConfig.debugOutput):
-                    WindowManager.setTempCurrentImage(currIP)
-                    IJ.saveAs('png', os.path.join(outputPath, "Orig_" + dbgOutDesc +  ".png"))
 
-                # We need to get to a grayscale image, which will be done differently for different channels
-                startTime = time.time()
-                currIP = ELMImageUtils.getThresholdedMask(currIP, c, z, t, chanName, cfg, outputPath, dbgOutDesc)
-                endTime = time.time()
-                if not 'grayscale' in times:
-                    times['grayscale'] = []
-                times['grayscale'].append(endTime-startTime)
 
-                if (not currIP):
-                    resultsImage.close()
-                    stats[c][z][t][ELMConfig.UM_AREA] = []
+####
+#
+#  All of the processing that happens for each image
+#
+####
+def processImages(cfg, wellName, wellPath, images):
+
+    stats = [[[dict() for t in range(cfg.getValue(ELMConfig.numT))] for z in range(cfg.getValue(ELMConfig.numZ))] for c in range(cfg.getValue(ELMConfig.numChannels))]
+    times = {}
+    # Fingerprint of the last frame of each c, z and the frames that were skipped
+    fingerprints = {}
+    skippedFrames = []
+
+    # Optionally compute one threshold per channel from the histogram of all of its images
+    thresholds = dict()
+    # Tiled frames are thresholded from the histogram of their own tiles, rather than reading whole frames
+    if cfg.hasValue(ELMConfig.thresholdFromWholeRange) and cfg.getValue(ELMConfig.thresholdFromWholeRange) == True \
+            and not ELMImageUtils.isLocalThresholdMethod(cfg) and not ELMTiledStats.isTiled(cfg):
+        for c in range(0, cfg.getValue(ELMConfig.numChannels)):
+            chanName = cfg.getValue(ELMConfig.chanLabel)[c]
+            if (chanName in cfg.getValue(ELMConfig.chansToSkip)):
+                continue
+            imgPaths = []
+            for z in range(0, cfg.getValue(ELMConfig.numZ)):
+                for t in range(0, cfg.getValue(ELMConfig.numT)):
+                    imgPaths.append(images[c][z][t][0])
+            thresholds[c] = ELMFrameStack.getWholeRangeThreshold(cfg, wellPath, c, chanName, imgPaths)
+
+    if cfg.hasValue(ELMConfig.channelFanOut) and cfg.getValue(ELMConfig.channelFanOut) and not ELMTiledStats.isTiled(cfg):
+        processImagesFanOut(cfg, wellName, wellPath, images, stats, times, thresholds, fingerprints, skippedFrames)
+    else:
+        for c in range(0, cfg.getValue(ELMConfig.numChannels)):
+            chanName = cfg.getValue(ELMConfig.chanLabel)[c]
+
+            if (chanName in cfg.getValue(ELMConfig.chansToSkip)):
+                continue
+
+            # Process images in Z stack
+            for z in range(0, cfg.getValue(ELMConfig.numZ)):
+                for t in range(0, cfg.getValue(ELMConfig.numT)):
+                    if (cfg.getValue(ELMConfig.imgType) == "png"):
+                        # Brightfield uses the whole iamge
+                        if (chanName == ELMConfig.BRIGHTFIELD):
+                            currIP, cropOffset = ELMImageUtils.openImage(images[c][z][t][0], cfg)
+                        else: # otherwise, we'll plit off channels
+                            chanIdx = 2
+                            if (chanName == ELMConfig.RED):
+                                chanIdx = 0
+                            elif (chanName == ELMConfig.GREEN):
+                                chanIdx = 1;
+                            img, cropOffset = ELMImageUtils.openImage(images[c][z][t][0], cfg)
+                            imgChanns = ChannelSplitter.split(img);
+                            img.close()
+                            currIP = imgChanns[chanIdx];
+                    else:
+                        # Large frames are streamed through in tiles, unless they can't be memory mapped
+                        if ELMTiledStats.isTiled(cfg):
+                            minSize, minCircularity = getParticleLimits(cfg, c)
+                            if ELMTiledStats.processImageTiled(cfg, wellName, wellPath, c, z, t, images[c][z][t][0], \
+                                                               stats, times, minSize, minCircularity, thresholds.get(c)):
+                                continue
+                        currIP, cropOffset = ELMImageUtils.openImage(images[c][z][t][0], cfg)
+                    processImage(cfg, wellName, wellPath, c, z, t, currIP, cropOffset, stats, times, thresholds.get(c), fingerprints, skippedFrames, \
+                                 images[c][z][t][0])
+
+    if skippedFrames:
+        print("Skipped " + str(len(skippedFrames)) + " frames by fingerprint")
+    writeSkippedFrames(cfg, wellName, wellPath, skippedFrames)
+
+    timesAvg = {}
+    for key in times:
+        timeList = times[key]
+        timesAvg[key] = sum(timeList) / len(timeList);
+    print("processImage times " + str(timesAvg))
+    return stats
+
+
+####
+#
+#  Process images decoding each file only once.  All channels that are stored
+#  in the same file (e.g., the color planes of an RGB PNG) are split from a
+#  single decode of that file, rather than re-opening it for every channel.
+#
+####
+def processImagesFanOut(cfg, wellName, wellPath, images, stats, times, thresholds, fingerprints, skippedFrames):
+    for z in range(0, cfg.getValue(ELMConfig.numZ)):
+        for t in range(0, cfg.getValue(ELMConfig.numT)):
+            # Group the channels by the file they are read from
+            fileChans = dict()
+            filePaths = []
+            for c in range(0, cfg.getValue(ELMConfig.numChannels)):
+                if (cfg.getValue(ELMConfig.chanLabel)[c] in cfg.getValue(ELMConfig.chansToSkip)):
                     continue
-                
+                imgPath = images[c][z][t][0]
+                if not imgPath in fileChans:
+                    fileChans[imgPath] = []
+                    filePaths.append(imgPath)
+                fileChans[imgPath].append(c)
+
+            for imgPath in filePaths:
                 startTime = time.time()
-                # Create a table to store the results
-                table = ResultsTable()
-                # Create a hidden ROI manager, to store a ROI for each blob or cell
-                #roim = RoiManager(True)
-                # Create a ParticleAnalyzer
-                measurements = Measurements.AREA + Measurements.MEAN + Measurements.STD_DEV + Measurements.MIN_MAX + Measurements.CENTROID + Measurements.RECT + Measurements.ELLIPSE
-                paFlags = ParticleAnalyzer.IN_SITU_SHOW | ParticleAnalyzer.SHOW_MASKS | ParticleAnalyzer.CLEAR_WORKSHEET
-                pa = ParticleAnalyzer(paFlags, measurements, table, minSize, Double.POSITIVE_INFINITY, minCircularity, 1.0)
-
-                #pa.setHideOutputImage(True)
-                
-                # The Result image is copied when CurrIP can still have calibration from loading
-                # We want the output to be in terms of pixels, for ease of use, so adjust calibration
-                resultsImage.setCalibration(currIP.getCalibration())
-                Analyzer.setRedirectImage(resultsImage)
-                if not pa.analyze(currIP):
-                    print "There was a problem in analyzing", currIP
-        
+                img, cropOffset = ELMImageUtils.openImage(imgPath, cfg)
+                chanImages = ELMImageUtils.splitChannelImages(img, fileChans[imgPath], cfg, cropOffset)
                 endTime = time.time()
-                if not 'pa' in times:
-                    times['pa'] = []
-                times['pa'].append(endTime-startTime)
-                #for i in range(0, roim.getCount()) :
-                #    r = roim.getRoi(i);
-                #    r.setColor(Color.red)
-                #    r.setStrokeWidth(2)
-                
-                # The measured areas are listed in the first column of the results table, as a float array:
-                newAreas = []
-                maxArea = 0
-                if table.getColumn(ResultsTable.AREA):
-                    for pixArea in table.getColumn(ResultsTable.AREA):
-                        a = pixArea * cfg.getValue(ELMConfig.pixelHeight) * cfg.getValue(ELMConfig.pixelWidth)
-                        newAreas.append(a)
-                        if (a > maxArea):
-                            maxArea = a
-                        
-                # Threshold areas
-                idxToRemove = set()
-                if cfg.hasValue(ELMConfig.areaMaxPercentThreshold):
-                    areaPercentThresh = cfg.getValue(ELMConfig.areaMaxPercentThreshold)
-                    for i in range(0,len(newAreas)):
-                        if newAreas[i] < (areaPercentThresh * maxArea):
-                            idxToRemove.add(i)
-                if cfg.hasValue(ELMConfig.areaAbsoluteThreshold):
-                    areaAbsoluteThresh = cfg.getValue(ELMConfig.areaAbsoluteThreshold)
-                    for i in range(0,len(newAreas)):
-                        if newAreas[i] < areaAbsoluteThresh:
-                            idxToRemove.add(i)
-
-                for i in sorted(idxToRemove, reverse=True):
-                    del newAreas[i]
-                
-                stats[c][z][t][ELMConfig.UM_AREA] = newAreas
-                centroidX = []
-                centroidY = []
-                roiX = []
-                roiY = []
-                roiWidth = []
-                roiHeight = []
-                rArea = []
-                # Store all of the other data
-                for col in range(0,table.getLastColumn()):
-                    newData = table.getColumn(col)
-                    if not newData is None:
-                        if col == ResultsTable.X_CENTROID:
-                            for idx in idxToRemove:
-                                centroidX.append(newData[idx])
-                        if col == ResultsTable.Y_CENTROID:
-                            for idx in idxToRemove:
-                                centroidY.append(newData[idx])
-                        if col == ResultsTable.ROI_X:
-                            for idx in idxToRemove:
-                                roiX.append(int(newData[idx]))
-                        if col == ResultsTable.ROI_Y:
-                            for idx in idxToRemove:
-                                roiY.append(int(newData[idx]))
-                        if col == ResultsTable.ROI_WIDTH:
-                            for idx in idxToRemove:
-                                roiWidth.append(int(newData[idx]))
-                        if col == ResultsTable.ROI_HEIGHT:
-                            for idx in idxToRemove:
-                                roiHeight.append(int(newData[idx]))
-                        if col == ResultsTable.AREA:
-                            for idx in idxToRemove:
-                                rArea.append(newData[idx])
-                        
-                        for i in sorted(idxToRemove, reverse=True):
-                            del newData[i]
-                    stats[c][z][t][table.getColumnHeading(col)] = newData
-
-                IJ.saveAs('png', os.path.join(outputPath, "PreFiltered_Segmentation_" + dbgOutDesc + "_particles.png"))
-
-                # Remove the segmentation masks for the objects removed
-                currProcessor = currIP.getProcessor()
-                ff = FloodFiller(currProcessor)
-                currIP.getProcessor().setValue(0)
-                calib = resultsImage.getCalibration()
-                sortedAreaIndices = [i[0] for i in sorted(enumerate(rArea), key=lambda x:x[1])]
-                for idx in range(0, len(sortedAreaIndices)):
-                    i = sortedAreaIndices[idx]
-                    centX = int(calib.getRawX(centroidX[i]))
-                    centY = int(calib.getRawY(centroidY[i]))
-
-                    # Since the centroid isn't guaranteed to be part of the blob
-                    # search around until an active pixel is found
-                    found = False
-                    halfWidth = min([roiHeight[i], roiWidth[i]])
-                    for offset in range(0,halfWidth):
+                if not 'decode' in times:
+                    times['decode'] = []
+                times['decode'].append(endTime-startTime)
+                for c in fileChans[imgPath]:
+                    processImage(cfg, wellName, wellPath, c, z, t, chanImages[c], cropOffset, stats, times, thresholds.get(c), fingerprints, skippedFrames, imgPath)
+
+
+
+####
+#
+#  Write the frames of a well that were skipped by fingerprint, with why they
+#  were skipped
+#
+####
+def writeSkippedFrames(cfg, wellName, wellPath, skippedFrames):
+    skippedPath = os.path.join(wellPath, wellName + "_skippedFrames.csv")
+    if not skippedFrames:
+        if os.path.exists(skippedPath):
+            os.remove(skippedPath)
+        return
+    skippedFile = open(skippedPath, "w")
+    skippedFile.write("channel, z, t, reason, results from t\n")
+    for c, z, t, reason, sourceT in skippedFrames:
+        sourceTStr = ""
+        if not sourceT is None:
+            sourceTStr = cfg.getTStr(sourceT)
+        skippedFile.write(", ".join([cfg.getValue(ELMConfig.chanLabel)[c], cfg.getZStr(z), cfg.getTStr(t), reason, sourceTStr]) + "\n")
+    skippedFile.close()
+
+
+
+####
+#
+#  Check a frame's fingerprint before it is thresholded.  Frames with no
+#  pixels above a fixed threshold have no particles, and a frame with the same
+#  fingerprint as the previous frame gets the previous frame's results.
+#  Returns True if the frame was skipped, with its stats filled in.
+#
+####
+def skipByFingerprint(cfg, c, z, t, currIP, stats, thresh, fingerprints, skippedFrames):
+    skipEmpty = cfg.hasValue(ELMConfig.skipEmptyFrames) and cfg.getValue(ELMConfig.skipEmptyFrames)
+    reuseDuplicates = cfg.hasValue(ELMConfig.reuseDuplicateFrames) and cfg.getValue(ELMConfig.reuseDuplicateFrames)
+    if fingerprints is None or not (skipEmpty or reuseDuplicates):
+        return False
+
+    fingerprint, maxValue = ELMImageUtils.getFrameFingerprint(currIP)
+    prevT, prevFingerprint = fingerprints.get((c, z), (None, None))
+    fingerprints[(c, z)] = (t, fingerprint)
+
+    # Only fluorescent channels of single channel images are thresholded on
+    # their own intensity, with the foreground above the threshold
+    chanName = cfg.getValue(ELMConfig.chanLabel)[c]
+    if thresh is None and cfg.hasValue(ELMConfig.imageThreshold):
+        thresh = cfg.getValue(ELMConfig.imageThreshold)
+    isColor = currIP.getType() == ImagePlus.COLOR_RGB or currIP.getType() == ImagePlus.COLOR_256
+    if skipEmpty and not thresh is None and not isColor and not chanName == ELMConfig.BRIGHTFIELD \
+            and maxValue < thresh:
+        stats[c][z][t][ELMConfig.UM_AREA] = []
+        skippedFrames.append((c, z, t, "empty", None))
+        return True
+
+    if reuseDuplicates and prevT == t - 1 and fingerprint == prevFingerprint:
+        stats[c][z][t] = dict(stats[c][z][prevT])
+        skippedFrames.append((c, z, t, "duplicate", prevT))
+        return True
+    return False
+
+
+
+####
+#
+#  Get the particle analysis size and circularity limits for a channel
+#
+####
+def getParticleLimits(cfg, c):
+    minCircularity = 0.001
+    minSize = 5
+    if (cfg.getValue(ELMConfig.chanLabel)[c] == ELMConfig.BRIGHTFIELD):
+        minCircularity = 0.001 # We want to identify one big cell ball, so ignore small less circular objects
+        if cfg.params[ELMConfig.imgType] == "png":
+            minSize = 5;
+        else:
+            minSize = 500
+    return minSize, minCircularity
+
+
+
+####
+#
+#  Threshold a single channel image and analyze its particles, filling in
+#  stats[c][z][t] in the frame coordinates of currIP.  resultsImage is the
+#  image that is measured.  The particles before the area thresholds are
+#  written to unfilteredPath.  Returns the mask of the particles that passed
+#  the area thresholds, or None if no mask was produced.
+#
+####
+def segmentImage(cfg, c, z, t, currIP, resultsImage, cropOffset, stats, times, thresh, imgPath, wellPath, outputPath, dbgOutDesc, unfilteredPath):
+    chanName = cfg.getValue(ELMConfig.chanLabel)[c]
+    minSize, minCircularity = getParticleLimits(cfg, c)
+
+    # We need to get to a grayscale image, which will be done differently for different channels
+    startTime = time.time()
+    currIP = ELMArrayStore.getStoredMask(cfg, imgPath, currIP, c, z, t, chanName, wellPath, outputPath, dbgOutDesc, cropOffset, thresh)
+    endTime = time.time()
+    if not 'grayscale' in times:
+        times['grayscale'] = []
+    times['grayscale'].append(endTime-startTime)
+
+    if (not currIP):
+        return None
+
+    startTime = time.time()
+    # Create a table to store the results
+    table = ResultsTable()
+    # Create a hidden ROI manager, to store a ROI for each blob or cell
+    #roim = RoiManager(True)
+    # Create a ParticleAnalyzer
+    measurements = Measurements.AREA + Measurements.MEAN + Measurements.STD_DEV + Measurements.MIN_MAX + Measurements.CENTROID + Measurements.RECT + Measurements.ELLIPSE
+    paFlags = ParticleAnalyzer.IN_SITU_SHOW | ParticleAnalyzer.SHOW_MASKS | ParticleAnalyzer.CLEAR_WORKSHEET
+    pa = ParticleAnalyzer(paFlags, measurements, table, minSize, Double.POSITIVE_INFINITY, minCircularity, 1.0)
+
+    #pa.setHideOutputImage(True)
+
+    # The Result image is copied when CurrIP can still have calibration from loading
+    # We want the output to be in terms of pixels, for ease of use, so adjust calibration
+    resultsImage.setCalibration(currIP.getCalibration())
+    Analyzer.setRedirectImage(resultsImage)
+    if not pa.analyze(currIP):
+        print "There was a problem in analyzing", currIP
+
+    endTime = time.time()
+    if not 'pa' in times:
+        times['pa'] = []
+    times['pa'].append(endTime-startTime)
+    #for i in range(0, roim.getCount()) :
+    #    r = roim.getRoi(i);
+    #    r.setColor(Color.red)
+    #    r.setStrokeWidth(2)
+
+    # Keep every particle, in full frame coordinates, so the area thresholds
+    # can be applied again without segmenting the image
+    unfiltered = dict()
+    for col in range(0,table.getLastColumn()):
+        newData = table.getColumn(col)
+        if not newData is None:
+            newData = list(newData)
+        unfiltered[table.getColumnHeading(col)] = newData
+    ELMImageUtils.shiftParticleStats(unfiltered, cropOffset, resultsImage.getCalibration())
+    ELMUnfilteredStats.writeUnfilteredStats(unfilteredPath, unfiltered)
+
+    # The measured areas are listed in the first column of the results table, as a float array:
+    newAreas = []
+    if table.getColumn(ResultsTable.AREA):
+        for pixArea in table.getColumn(ResultsTable.AREA):
+            a = pixArea * cfg.getValue(ELMConfig.pixelHeight) * cfg.getValue(ELMConfig.pixelWidth)
+            newAreas.append(a)
+            
+    # Threshold areas
+    keep = set(ELMUnfilteredStats.getKeptParticles(cfg, newAreas))
+    idxToRemove = set([i for i in range(0,len(newAreas)) if not i in keep])
+
+    for i in sorted(idxToRemove, reverse=True):
+        del newAreas[i]
+
+    stats[c][z][t][ELMConfig.UM_AREA] = newAreas
+    centroidX = []
+    centroidY = []
+    roiX = []
+    roiY = []
+    roiWidth = []
+    roiHeight = []
+    rArea = []
+    # Store all of the other data
+    for col in range(0,table.getLastColumn()):
+        newData = table.getColumn(col)
+        if not newData is None:
+            if col == ResultsTable.X_CENTROID:
+                for idx in idxToRemove:
+                    centroidX.append(newData[idx])
+            if col == ResultsTable.Y_CENTROID:
+                for idx in idxToRemove:
+                    centroidY.append(newData[idx])
+            if col == ResultsTable.ROI_X:
+                for idx in idxToRemove:
+                    roiX.append(int(newData[idx]))
+            if col == ResultsTable.ROI_Y:
+                for idx in idxToRemove:
+                    roiY.append(int(newData[idx]))
+            if col == ResultsTable.ROI_WIDTH:
+                for idx in idxToRemove:
+                    roiWidth.append(int(newData[idx]))
+            if col == ResultsTable.ROI_HEIGHT:
+                for idx in idxToRemove:
+                    roiHeight.append(int(newData[idx]))
+            if col == ResultsTable.AREA:
+                for idx in idxToRemove:
+                    rArea.append(newData[idx])
+            
+            for i in sorted(idxToRemove, reverse=True):
+                del newData[i]
+        stats[c][z][t][table.getColumnHeading(col)] = newData
+
+    IJ.saveAs('png', os.path.join(outputPath, "PreFiltered_Segmentation_" + dbgOutDesc + "_particles.png"))
+
+    # Remove the segmentation masks for the objects removed
+    currProcessor = currIP.getProcessor()
+    ff = FloodFiller(currProcessor)
+    currIP.getProcessor().setValue(0)
+    calib = resultsImage.getCalibration()
+    sortedAreaIndices = [i[0] for i in sorted(enumerate(rArea), key=lambda x:x[1])]
+    for idx in range(0, len(sortedAreaIndices)):
+        i = sortedAreaIndices[idx]
+        centX = int(calib.getRawX(centroidX[i]))
+        centY = int(calib.getRawY(centroidY[i]))
+
+        # Since the centroid isn't guaranteed to be part of the blob
+        # search around until an active pixel is found
+        found = False
+        halfWidth = min([roiHeight[i], roiWidth[i]])
+        for offset in range(0,halfWidth):
+            if found:
+                break
+            for x in range(centX-offset,centX+offset+1):
+                if found:
+                    break
+                for y in range(centY-offset,centY+offset+1):
+                    if not currProcessor.getPixel(x,y) == 0x0:
+                        found = True
+                        finalX = x
+                        finalY = y
+                        break
+        if not found:
+            print "\t\tZ = " + str(z) + ", T = " + str(t) +  ", chan " + chanName + ": ERROR: Never found active pixel for filtered blob, centroid: " + str(centX) + ", " + str(centY)
+        else:
+            currProcessor.setRoi(roiX[i], roiY[i], roiWidth[i], roiHeight[i])
+            ff.fill8(finalX,finalY)
+            #IJ.saveAs('png', os.path.join(outputPath, "Segmentation_" + dbgOutDesc + "_" + str(idx) + ".png"))
+        
+        
+    #outImg = pa.getOutputImage()
+    IJ.saveAs('png', os.path.join(outputPath, "Segmentation_" + dbgOutDesc + "_particles.png"))
+    return currIP
+
+
+
+####
+#
+#  All of the processing that happens for a single channel image.  If thresh
+#  is given, it is used to threshold the image instead of the config.  If
+#  fingerprints is given, frames can be skipped by their fingerprint, see
+#  skipByFingerprint.  If imgPath, the file currIP was read from, is given,
+#  the mask can be read from the array store and the particles from the
+#  segmentation cache.
+#
+####
+def processImage(cfg, wellName, wellPath, c, z, t, currIP, cropOffset, stats, times, thresh=None, fingerprints=None, skippedFrames=None, imgPath=None):
+    chanStr = 'ch%(channel)02d' % {"channel" : c};
+    chanName = cfg.getValue(ELMConfig.chanLabel)[c]
+    zStr = cfg.getZStr(z);
+    tStr = cfg.getTStr(t)
+    minSize, minCircularity = getParticleLimits(cfg, c)
+    unfilteredPath = ELMUnfilteredStats.getUnfilteredPath(cfg, wellName, wellPath, c, z, t)
+
+    startTime = time.time()
+    skipped = skipByFingerprint(cfg, c, z, t, currIP, stats, thresh, fingerprints, skippedFrames)
+    endTime = time.time()
+    if not 'fingerprint' in times:
+        times['fingerprint'] = []
+    times['fingerprint'].append(endTime-startTime)
+    if skipped:
+        # Skipped frames share the table of the frame they took their results from
+        sourceT = skippedFrames[-1][4]
+        sourcePath = None
+        if not sourceT is None:
+            sourcePath = ELMUnfilteredStats.getUnfilteredPath(cfg, wellName, wellPath, c, z, sourceT)
+        ELMUnfilteredStats.copyUnfilteredStats(sourcePath, unfilteredPath)
+        currIP.close()
+        return
+
+    resultsImage = currIP.duplicate()
+    dbgOutDesc = wellName + "_" + zStr + "_" + chanStr + "_" + tStr
+    if (cfg.getValue(ELMConfig.numT) > 1):
+        outputPath = os.path.join(wellPath, "images") 
+        if not os.path.exists(outputPath):
+            os.makedirs(outputPath)
+    else:
+        outputPath = wellPath
+
+    if cfg.getValue(ELMConfig.debugOutput):
+        WindowManager.setTempCurrentImage(currIP)
+        IJ.saveAs('png', os.path.join(outputPath, "Orig_" + dbgOutDesc +  ".png"))
+
+    # Frames that haven't changed are served from the segmentation cache, along
+    # with their unfiltered particle table
+    cacheKey = None
+    cached = None
+    if not imgPath is None and ELMSegmentationCache.isEnabled(cfg):
+        cacheKey = ELMSegmentationCache.getCacheKey(cfg, c, imgPath, thresh, minSize, minCircularity)
+        cached = ELMSegmentationCache.loadSegmentation(cfg, cacheKey)
+    if not cached is None:
+        maskIP, stats[c][z][t], unfiltered = cached
+        ELMUnfilteredStats.writeUnfilteredStats(unfilteredPath, unfiltered)
+        maskIP.setCalibration(currIP.getCalibration())
+        resultsImage.setCalibration(currIP.getCalibration())
+        currIP.close()
+        currIP = maskIP
+        WindowManager.setTempCurrentImage(currIP)
+        IJ.saveAs('png', os.path.join(outputPath, "Segmentation_" + dbgOutDesc + "_particles.png"))
+    else:
+        currIP = segmentImage(cfg, c, z, t, currIP, resultsImage, cropOffset, stats, times, thresh, imgPath, wellPath, outputPath, dbgOutDesc, \
+                              unfilteredPath)
+        if (not currIP):
+            resultsImage.close()
+            stats[c][z][t][ELMConfig.UM_AREA] = []
+            ELMUnfilteredStats.writeUnfilteredStats(unfilteredPath, dict())
+            return
+        if not cacheKey is None:
+            ELMSegmentationCache.saveSegmentation(cfg, cacheKey, currIP, stats[c][z][t], \
+                                                  ELMUnfilteredStats.readUnfilteredStats(unfilteredPath))
+    newAreas = stats[c][z][t][ELMConfig.UM_AREA]
+    currProcessor = currIP.getProcessor()
+
+    if cfg.hasValue(ELMConfig.createSegMask) and cfg.getValue(ELMConfig.createSegMask) == True:
+        # Create segmentation mask
+        segMask = currIP.duplicate()
+        segMask.setTitle("SegMask_" + dbgOutDesc)
+        # Iterate by smallest area first
+        #  We are more likely to correctly label small areas
+        if len(newAreas) > 0:
+            segProcessor = segMask.getProcessor()
+            if (len(newAreas) > 255):
+                segProcessor = segProcessor.convertToShort(True)
+                segMask.setProcessor(segProcessor)
+            ff = FloodFiller(segProcessor)
+            sortedAreaIndices = [i[0] for i in sorted(enumerate(stats[c][z][t]['Area']), key=lambda x:x[1])]
+            for idx in range(0, len(sortedAreaIndices)):
+                row = sortedAreaIndices[idx]
+                centX = int(stats[c][z][t]['X'][row])
+                centY = int(stats[c][z][t]['Y'][row])
+                roiX = int(stats[c][z][t]['BX'][row])
+                roiY = int(stats[c][z][t]['BY'][row])
+                roiWidth = int(stats[c][z][t]['Width'][row])
+                roiHeight = int(stats[c][z][t]['Height'][row])
+                area = stats[c][z][t]['Area'][row]
+                halfRoiHeight = roiHeight/2 + 1
+                halfRoiWidth = roiWidth/2 + 1  
+                # Since the centroid isn't guaranteed to be part of the blob
+                # search around until an active pixel is found
+                found = False
+                for xOffset in range(0,halfRoiWidth):
+                    if found:
+                        break
+                    for yOffset in range(0, halfRoiHeight):
                         if found:
                             break
-                        for x in range(centX-offset,centX+offset+1):
+                        for x in range(centX-xOffset,centX+xOffset+1):
                             if found:
                                 break
-                            for y in range(centY-offset,centY+offset+1):
-                                if not currProcessor.getPixel(x,y) == 0x0:
+                            for y in range(centY-yOffset,centY+yOffset+1):
+                                # original image and this image for masked pixel
+                                # By checking original image, we avoid confusion with a label of 255
+                                if segProcessor.getPixel(x,y) == 255 and currProcessor.getPixel(x,y) == 255:
                                     found = True
                                     finalX = x
                                     finalY = y
                                     break
-                    if not found:
-                        print "\t\tZ = " + str(z) + ", T = " + str(t) +  ", chan " + chanName + ": ERROR: Never found active pixel for filtered blob, centroid: " + str(centX) + ", " + str(centY)
-                    else:
-                        currProcessor.setRoi(roiX[i], roiY[i], roiWidth[i], roiHeight[i])
-                        ff.fill8(finalX,finalY)
-                        #IJ.saveAs('png', os.path.join(outputPath, "Segmentation_" + dbgOutDesc + "_" + str(idx) + ".png"))
-                    
-                    
-                #outImg = pa.getOutputImage()
-                IJ.saveAs('png', os.path.join(outputPath, "Segmentation_" + dbgOutDesc + "_particles.png"))
-                
-                if cfg.hasValue(ELMConfig.createSegMask) and cfg.getValue(ELMConfig.createSegMask) == True:
-                    # Create segmentation mask
-                    segMask = currIP.duplicate()
-                    segMask.setTitle("SegMask_" + dbgOutDesc)
-                    # Iterate by smallest area first
-                    #  We are more likely to correctly label small areas
-                    if len(newAreas) > 0:
-                        segProcessor = segMask.getProcessor()
-                        if (len(newAreas) > 255):
-                            segProcessor = segProcessor.convertToShort(True)
-                            segMask.setProcessor(segProcessor)
-                        ff = FloodFiller(segProcessor)
-                        sortedAreaIndices = [i[0] for i in sorted(enumerate(stats[c][z][t]['Area']), key=lambda x:x[1])]
-                        for idx in range(0, len(sortedAreaIndices)):
-                            row = sortedAreaIndices[idx]
-                            centX = int(stats[c][z][t]['X'][row])
-                            centY = int(stats[c][z][t]['Y'][row])
-                            roiX = int(stats[c][z][t]['BX'][row])
-                            roiY = int(stats[c][z][t]['BY'][row])
-                            roiWidth = int(stats[c][z][t]['Width'][row])
-                            roiHeight = int(stats[c][z][t]['Height'][row])
-                            area = stats[c][z][t]['Area'][row]
-                            halfRoiHeight = roiHeight/2 + 1
-                            halfRoiWidth = roiWidth/2 + 1  
-                            # Since the centroid isn't guaranteed to be part of the blob
-                            # search around until an active pixel is found
-                            found = False
-                            for xOffset in range(0,halfRoiWidth):
-                                if found:
-                                    break
-                                for yOffset in range(0, halfRoiHeight):
-                                    if found:
-                                        break
-                                    for x in range(centX-xOffset,centX+xOffset+1):
-                                        if found:
-                                            break
-                                        for y in range(centY-yOffset,centY+yOffset+1):
-                                            # original image and this image for masked pixel
-                                            # By checking original image, we avoid confusion with a label of 255
-                                            if segProcessor.getPixel(x,y) == 255 and currProcessor.getPixel(x,y) == 255:
-                                                found = True
-                                                finalX = x
-                                                finalY = y
-                                                break
-                            if not found:
-                                print "\t\tZ = " + str(z) + ", T = " + str(t) +  ", chan " + chanName + ": ERROR: Never found active pixel for seg mask, centroid, roi, area (px): " \
-                                    + str(centX) + ", " + str(centY) + ", " + str(roiX) + ", " + str(roiY) + ", " + str(roiWidth) + ", " + str(roiHeight) + ", " + str(area)
-                            else:
-                                segProcessor.setRoi(roiX, roiY, roiWidth, roiHeight)
-                                segProcessor.setColor(row + 1)
-                                ff.fill8(finalX,finalY)
-                    
-                    lut = LutLoader.openLut(cfg.getValue(ELMConfig.lutPath))
-                    segMask.setLut(lut)
-                    WindowManager.setTempCurrentImage(segMask);
-                    IJ.saveAs('png', os.path.join(outputPath, "SegMask_" + dbgOutDesc + "_particles.png"))
-                
+                if not found:
+                    print "\t\tZ = " + str(z) + ", T = " + str(t) +  ", chan " + chanName + ": ERROR: Never found active pixel for seg mask, centroid, roi, area (px): " \
+                        + str(centX) + ", " + str(centY) + ", " + str(roiX) + ", " + str(roiY) + ", " + str(roiWidth) + ", " + str(roiHeight) + ", " + str(area)
+                else:
+                    segProcessor.setRoi(roiX, roiY, roiWidth, roiHeight)
+                    segProcessor.setColor(row + 1)
+                    ff.fill8(finalX,finalY)
+        
+        lut = LutLoader.openLut(cfg.getValue(ELMConfig.lutPath))
+        segMask.setLut(lut)
+        WindowManager.setTempCurrentImage(segMask);
+        IJ.saveAs('png', os.path.join(outputPath, "SegMask_" + dbgOutDesc + "_particles.png"))
 
-                startTime = time.time()
+    # Report particle coordinates in the full frame, if the image was cropped
+    ELMImageUtils.shiftParticleStats(stats[c][z][t], cropOffset, resultsImage.getCalibration())
 
-                width = currIP.getWidth();
-                height = currIP.getHeight();
-                overlayImage = resultsImage.duplicate()
-                overlayImage.setTitle("Overlay_" + dbgOutDesc + "_particles")
-                if not overlayImage.getType() == ImagePlus.COLOR_RGB:
-                    imgConvert = ImageConverter(overlayImage)
-                    imgConvert.convertToRGB() 
-                overlayProcessor = overlayImage.getProcessor()
-                currProcessor = currIP.getProcessor()
-
-                if (cfg.getValue(ELMConfig.chanLabel)[c] == ELMConfig.BRIGHTFIELD):
-                    maskColor = 0x0000ff00
-                elif (cfg.getValue(ELMConfig.chanLabel)[c] == ELMConfig.YELLOW):
-                    maskColor = 0x000000ff
-                elif (cfg.getValue(ELMConfig.chanLabel)[c] == ELMConfig.RED):
-                    maskColor = 0x0000ff00
-                elif (cfg.getValue(ELMConfig.chanLabel)[c] == ELMConfig.GREEN):
-                    maskColor = 0x00ff0000
-                elif (cfg.getValue(ELMConfig.chanLabel)[c] == ELMConfig.BLUE):
-                    maskColor = 0x00ffff00
-
-                for x in range(0, width):
-                    for y in range(0,height):
-                        currPix = currProcessor.getPixel(x,y);
-                        if not currPix == 0x00000000:
-                            overlayProcessor.putPixel(x, y, maskColor)
-                            
-                endTime = time.time()
-                if not 'overlay' in times:
-                    times['overlay'] = []
-                times['overlay'].append(endTime-startTime)
+    startTime = time.time()
+
+    width = currIP.getWidth();
+    height = currIP.getHeight();
+    overlayImage = resultsImage.duplicate()
+    overlayImage.setTitle("Overlay_" + dbgOutDesc + "_particles")
+    if not overlayImage.getType() == ImagePlus.COLOR_RGB:
+        imgConvert = ImageConverter(overlayImage)
+        imgConvert.convertToRGB() 
+    overlayProcessor = overlayImage.getProcessor()
+    currProcessor = currIP.getProcessor()
+
+    if (cfg.getValue(ELMConfig.chanLabel)[c] == ELMConfig.BRIGHTFIELD):
+        maskColor = 0x0000ff00
+    elif (cfg.getValue(ELMConfig.chanLabel)[c] == ELMConfig.YELLOW):
+        maskColor = 0x000000ff
+    elif (cfg.getValue(ELMConfig.chanLabel)[c] == ELMConfig.RED):
+        maskColor = 0x0000ff00
+    elif (cfg.getValue(ELMConfig.chanLabel)[c] == ELMConfig.GREEN):
+        maskColor = 0x00ff0000
+    elif (cfg.getValue(ELMConfig.chanLabel)[c] == ELMConfig.BLUE):
+        maskColor = 0x00ffff00
+
+    for x in range(0, width):
+        for y in range(0,height):
+            currPix = currProcessor.getPixel(x,y);
+            if not currPix == 0x00000000:
+                overlayProcessor.putPixel(x, y, maskColor)
                 
-                WindowManager.setTempCurrentImage(overlayImage);
-                IJ.saveAs('png', os.path.join(outputPath, "Overlay_" + dbgOutDesc + "_particles.png"))
+    endTime = time.time()
+    if not 'overlay' in times:
+        times['overlay'] = []
+    times['overlay'].append(endTime-startTime)
 
-                #currIP.hide()
-                currIP.close()
-                resultsImage.close()
+    WindowManager.setTempCurrentImage(overlayImage);
+    IJ.saveAs('png', os.path.join(outputPath, "Overlay_" + dbgOutDesc + "_particles.png"))
 
-    timesAvg = {}
-    for key in times:
-        timeList = times[key]
-        timesAvg[key] = sum(timeList) / len(timeList);
-    print("processImage times " + str(timesAvg))
-    return stats
+    #currIP.hide()
+    currIP.close()
+    resultsImage.close()
 
 
 
@@ -6,45 +6,33 @@
 # exception, as described in the file LICENSE in the TASBE Image Analysis
 # package distribution's top directory.
 
-from ij import IJ, ImagePlus, ImageStack, WindowManager
-from ij.process import ImageConverter, AutoThresholder
+from ij import IJ, ImagePlus, ImageStack
+from ij.process import ImageConverter
 from fiji.plugin.trackmate.io import TmXmlWriter
 
-from fiji.plugin.trackmate import Model, Settings, TrackMate, SelectionModel, Logger, Dimension
+from fiji.plugin.trackmate import Model, Settings, TrackMate, Logger, Dimension
 
 from plugin.trackmate.detector import ThresholdDetectorFactory
-#from plugin.trackmate.detector import LocalThresholdDetectorFactory
+from plugin.trackmate.detector import LocalThresholdDetectorFactory
 
-from fiji.plugin.trackmate.tracking.sparselap import SparseLAPTrackerFactory
-from fiji.plugin.trackmate.tracking import LAPUtils
-
-from fiji.plugin.trackmate.visualization import TrackMateModelView, PerTrackFeatureColorGenerator, SpotColorGeneratorPerTrackFeature
-
-import fiji.plugin.trackmate.visualization.hyperstack.HyperStackDisplayer as HyperStackDisplayer
 import fiji.plugin.trackmate.features.FeatureFilter as FeatureFilter
 
 #import fiji.plugin.trackmate.features.track.TrackDurationAnalyzer as TrackDurationAnalyzer
 from fiji.plugin.trackmate.features.track import TrackBranchingAnalyzer, TrackIndexAnalyzer, TrackLocationAnalyzer, TrackSpeedStatisticsAnalyzer, TrackDurationAnalyzer
 from fiji.plugin.trackmate.features.spot import SpotIntensityAnalyzerFactory, SpotContrastAndSNRAnalyzerFactory
 
-import fiji.plugin.trackmate.action.CaptureOverlayAction as CaptureOverlayAction
-
-from java.util import HashMap
-
-
-import fiji.plugin.trackmate.tracking.TrackerKeys as TrackerKeys
-
 import os, glob, re, time, sys
 
 from java.awt import Color
 from java.io import File
+from java.util.concurrent import Callable, Executors
 
 # I'm not certain why, but when run in ImageJ it doesn't seem to adhere to the CLASSPATH env variable
 # This ensures that CLASSPATH is explicitly on the module search path, which is required for ELMConfig to resolve
 for path in os.environ['CLASSPATH'].split(os.pathsep):
     sys.path.append(path)
 
-import ELMConfig, ELMImageUtils
+import ELMConfig, ELMImageUtils, ELMFrameStack, ELMDetectionCache, ELMTracking, ELMLiveTracking, ELMRender, ELMTrackModelIO, ELMTrackStats, ELMStackReader, ELMArrayStore
 
 #
 #
@@ -70,6 +58,35 @@ def printUsage():
     print "            Valid labels: skip, brightfield, red, green, blue, yellow"
     print "chansToSkip - List of channel names that will be skipped if channels are read from XML properties"
     print "analysisRoi - Rectangular area to perform cell detection on, default 0,0,512,480, must be defined in config file"
+    print "cacheDetections - Optional, True or False, if True save detected spots and reuse them while the detector config is unchanged"
+    print "linkingOnly - Optional, True or False, if True only run the tracker on cached detections"
+    print "linkingMaxDistance - Optional, max linking distance of the tracker in pixels, default 220"
+    print "gapClosingMaxDistance - Optional, max gap closing distance of the tracker in pixels, default 120"
+    print "gapClosingMaxFrameGap - Optional, max number of frames in a closed gap, default 8"
+    print "mergingMaxDistance - Optional, max merging distance of the tracker in pixels, default 45"
+    print "trackerSweep - Optional, True or False, if True the tracker params above can be comma separated lists,"
+    print "              the tracker is run for every combination and only a comparison table is written"
+    print "numThreads - Optional, number of threads TrackMate uses for detection and feature analysis, default 1"
+    print "parallelChannels - Optional, True or False, if True the channels of a well are tracked concurrently"
+    print "liveTracking - Optional, True or False, if True track each frame as it is acquired, keeping the open track tails in memory"
+    print "              Only wells with images when live tracking starts are tracked. With thresholdFromWholeRange, frames are"
+    print "              thresholded from the histogram of the frames acquired so far"
+    print "livePollInterval - Optional, seconds between checks for new frames in live tracking, default 30"
+    print "liveTimeout - Optional, live tracking finishes after this many seconds without a new frame, default 3600"
+    print "frameStride - Optional, only process every frameStride-th timestep of each well, tracker distances and gaps are scaled to match"
+    print "frameWindow - Optional, first and last timestep to process, as numbered in the filenames, comma separated"
+    print "thresholdMethod - Optional, ImageJ auto threshold method, or LocalMean or Sauvola for a local threshold"
+    print "localThresholdRadius - Optional, window radius in pixels for the LocalMean and Sauvola methods, default 15"
+    print "localThresholdK - Optional, weight of the window std dev for the LocalMean and Sauvola methods, default 0.5"
+    print "frameCacheSize - Optional, number of frames per channel kept in memory while tracking, default 8"
+    print "renderAvi - Optional, True or False, if False skip rendering the track overlay video, default True"
+    print "writeTrackModelXml - Optional, True or False, if True also write the track model as TrackMate XML"
+    print "renderInBackground - Optional, True or False, if True render the track overlay videos in a background worker"
+    print "memoryMapTiff - Optional, True or False, if True read uncompressed TIFFs through a memory map"
+    print "stackInput - Optional, True or False, if True multi-page and OME-TIFF hyperstacks are read plane by plane, with C, Z and T from their metadata"
+    print "arrayStore - Optional, True or False, if True thresholded masks and grayscale frames are stored in a chunked, compressed store in each well output dir and reused by all scripts"
+    print "arrayStoreChunkSize - Optional, width and height in pixels of the array store chunks, default 512"
+    print "cropToRoi - Optional, True or False, if True crop images to the analysisRoi and exclusion bounds before processing"
     print "wellNames - Optional, list of well names to process, others are ignored"
     print "debugOutput - Optional, True or False, if True output additional info for debugging purposes"
 
@@ -124,6 +141,10 @@ def main(cfg):
         if not cfg.hasValue(ELMConfig.chanLabel):
             cfg.getCytationChanNames(imgFiles)
 
+    # Stacks are replaced by the planes they hold, named like plane files
+    if cfg.hasValue(ELMConfig.stackInput) and cfg.getValue(ELMConfig.stackInput):
+        imgFiles = ELMStackReader.expandStacks(imgFiles, cfg)
+
     # Get the names of all wells that exist in this dataset/plate
     wellNames = []
     # Each well will have a collection of images, but will all fall under the same common prefix descriptor
@@ -136,8 +157,21 @@ def main(cfg):
     numZ = dict()
     pngTimesteps = dict()
     pngZSlices = dict()
+    wellTimesteps = dict()
+    imgTimesteps = dict()
     
-    manualNumT = cfg.hasValue(ELMConfig.numT)
+    # A numT set in the config applies to every well, frame selection reduces
+    # it for each well in turn
+    manualNumT = None
+    if cfg.hasValue(ELMConfig.numT):
+        manualNumT = cfg.getValue(ELMConfig.numT)
+    liveTracking = cfg.hasValue(ELMConfig.liveTracking) and cfg.getValue(ELMConfig.liveTracking)
+    if liveTracking and cfg.getValue(ELMConfig.imgType) == "png":
+        print "Live tracking is not supported for png images!"
+        quit(-1)
+    if liveTracking and cfg.hasFrameSelection():
+        print "Live tracking is not supported with frameStride or frameWindow!"
+        quit(-1)
 
     # Analyze image filenames to get different pieces of information
     # We care about a time, Z, channel, and the well name
@@ -206,6 +240,7 @@ def main(cfg):
             if wellName not in pngTimesteps:
                 pngTimesteps[wellName] = set()
             pngTimesteps[wellName].add(timestep)
+            imgTimesteps[filePath] = timestep
             maxT[wellName] = len(pngTimesteps[wellName])
             minT[wellName] = 1
 
@@ -226,6 +261,10 @@ def main(cfg):
                 maxT[wellName] = timestep
             if wellName not in minT or timestep < minT[wellName]:
                 minT[wellName] = timestep
+            if wellName not in wellTimesteps:
+                wellTimesteps[wellName] = set()
+            wellTimesteps[wellName].add(timestep)
+            imgTimesteps[filePath] = timestep
         # Set channel file index
         if not chIdx == sys.maxint:
             cfg.setValue(ELMConfig.cIdx, chIdx)
@@ -247,6 +286,7 @@ def main(cfg):
 
     # Process each well
     trackDat = {}
+    liveWells = []
     for wellName in uniqueNames:
         # Check to see if we should ignore this well
         if cfg.getValue(ELMConfig.wellNames):
@@ -268,6 +308,7 @@ def main(cfg):
             os.makedirs(wellPath)
 
         # Update config based on metadata
+        xmlFile = None
         if (metadataExists):
             xmlFile = os.path.join(metadataDir, wellDesc[wellName] + "_Properties.xml")
             if not os.path.exists(xmlFile):
@@ -275,7 +316,9 @@ def main(cfg):
                 continue;
             cfg.updateCfgWithXML(xmlFile)
 
-        if wellName in maxT and not manualNumT:
+        if not manualNumT is None:
+            cfg.setValue(ELMConfig.numT, manualNumT)
+        elif wellName in maxT:
             cfg.setValue(ELMConfig.numT, maxT[wellName] - minT[wellName] + 1)
         if wellName in minT:
             cfg.setValue(ELMConfig.minT, minT[wellName])
@@ -293,10 +336,24 @@ def main(cfg):
                 zSlices = list(pngZSlices[wellName]);
                 zSlices.sort()
                 cfg.setValue(ELMConfig.zList, zSlices)
+            wellTimesteps[wellName] = pngTimesteps[wellName]
+
+        # Skipped frames are dropped from the well's files, so they are never opened
+        if cfg.hasFrameSelection() and wellName in wellTimesteps:
+            selected = set(cfg.selectFrames(wellTimesteps[wellName]))
+            if not selected:
+                print "No frames of well " + wellName + " in the frame window! Skipping well."
+                continue
+            dsImgFiles = [imgPath for imgPath in dsImgFiles if imgTimesteps[imgPath] in selected]
 
         cfg.setValue(ELMConfig.noZInFile, noZInFile[wellName] or cfg.getValue(ELMConfig.numZ) == 1)
         cfg.setValue(ELMConfig.noTInFile, noTInFile[wellName] or cfg.getValue(ELMConfig.numT) == 1)
 
+        # In live tracking, frames are tracked as they arrive, for all wells
+        if liveTracking:
+            liveWells.append(ELMLiveTracking.LiveWell(cfg, wellName, wellPath, xmlFile))
+            continue
+
         print ("Beginning well " + wellName + "...")
         cfg.printCfg()
         start = time.time()
@@ -306,37 +363,16 @@ def main(cfg):
         print("Processed well " + wellName + " in " + str(end - start) + " s")
         print("\n\n")
 
-    # Create output file
+    if liveTracking:
+        trackDat = ELMLiveTracking.trackLive(cfg, liveWells)
+
+    # Summarize the tracks of every well
     trackOut = os.path.join(cfg.getValue(ELMConfig.outputDir), "AlltrackSummary.csv")
-    trackFile = open(trackOut, 'w')
     date = os.path.basename(cfg.getValue(ELMConfig.outputDir))
-    # Fetch the track feature from the feature model.
-    trackFile.write('Date, Wellname, Num Tracks, Mean Duration, Max Duration, Min Duration, Mean Avg Total Intensity, Max Avg Total Intensity, Min Avg Total Intensity \n')
-    for wellName in trackDat:
-        tracks = trackDat[wellName]
-        numTracks = len(tracks);
-        durations = [sys.maxint,0,0]
-        avgTotalItensities = [sys.maxint,0,0]
-        for tId in tracks:
-            dur = float(tracks[tId][1])
-            avgTotalInt = float(tracks[tId][2])
-            if (dur < durations[0]):
-                durations[0] = dur
-            if (dur > durations[1]):
-                durations[1] = dur
-            durations[2] += dur
-            
-            if (avgTotalInt < avgTotalItensities[0]):
-                avgTotalItensities[0] = avgTotalInt
-            if (avgTotalInt > avgTotalItensities[1]):
-                avgTotalItensities[1] = avgTotalInt
-            avgTotalItensities[2] += avgTotalInt    
-            
-        durations[2] /= numTracks
-        avgTotalItensities[2] /= numTracks    
-        dat = [date, wellName, str(numTracks), str(durations[2]), str(durations[1]), str(durations[0]), str(avgTotalItensities[2]), str(avgTotalItensities[1]), str(avgTotalItensities[0])]
-        trackFile.write(','.join(dat) + '\n')
-    trackFile.close()
+    ELMTrackStats.writePlateSummary(trackOut, date, trackDat)
+
+    # Background renders may still be running
+    ELMRender.waitForRenders()
 
 ####
 #
@@ -360,8 +396,8 @@ def processDataset(cfg, datasetName, imgFiles):
         for imgPath in imgFiles:
             fileName = os.path.basename(imgPath)
             c,z,t = cfg.getCZTFromFilename(fileName)
-            # Ignore files if they are past some manual configuration
-            if (t >= cfg.getValue(ELMConfig.numT)):
+            # Ignore files if they are past some manual configuration, or skipped
+            if t is None or (t >= cfg.getValue(ELMConfig.numT)):
                 continue;
             imgFileCats[c][z][t].append(imgPath)
             if (len(imgFileCats[c][z][t]) > 1):
@@ -391,114 +427,154 @@ def processDataset(cfg, datasetName, imgFiles):
 #
 ####
 def processImages(cfg, wellName, wellPath, images):
-    firstImage = IJ.openImage(images[0][0][0][0]);
+    firstImage, cropOffset = ELMImageUtils.openImage(images[0][0][0][0], cfg);
     imgWidth = firstImage.getWidth();
     imgHeight = firstImage.getHeight();
+    firstImage.close()
     
+    # Channels are tracked independently, with their own model, so they can
+    # be run concurrently
+    chans = []
     for c in range(0, cfg.getValue(ELMConfig.numChannels)):
-        chanName = cfg.getValue(ELMConfig.chanLabel)[c]
-            
-        if cfg.getValue(ELMConfig.chanLabel)[c] in cfg.getValue(ELMConfig.chansToSkip):
-            continue;
-        imColorSeq = ImageStack(imgWidth, imgHeight)
-        imSeq = ImageStack(imgWidth, imgHeight)
-        totalHist = []
-        for z in range(0, cfg.getValue(ELMConfig.numZ)):
-            for t in range(0, cfg.getValue(ELMConfig.numT)):
-                
-                currIP = IJ.openImage(images[c][z][t][0])
-                imColorSeq.addSlice(currIP.duplicate().getProcessor())
-                
-                currIP = ELMImageUtils.getGrayScaleImage(currIP, c, chanName, cfg)
-                
-                imSeq.addSlice(currIP.getProcessor());
-                imgStats = currIP.getStatistics()
-                currHist = imgStats.getHistogram()
-                if not totalHist:
-                    for i in range(len(currHist)):
-                        totalHist.append(currHist[i])
-                else:
-                    for i in range(len(currHist)):
-                        totalHist[i] += currHist[i]
+        if not cfg.getValue(ELMConfig.chanLabel)[c] in cfg.getValue(ELMConfig.chansToSkip):
+            chans.append(c)
+    
+    # Errors in a channel are returned by its job, and exit from this thread
+    jobs = [ChannelJob(cfg, wellName, wellPath, images, c, imgWidth, imgHeight, cropOffset) for c in chans]
+    if cfg.hasValue(ELMConfig.parallelChannels) and cfg.getValue(ELMConfig.parallelChannels) and len(chans) > 1:
+        executor = Executors.newFixedThreadPool(len(chans))
+        try:
+            futures = [executor.submit(job) for job in jobs]
+            chanTrackDat = [future.get() for future in futures]
+        finally:
+            executor.shutdown()
+    else:
+        chanTrackDat = []
+        for job in jobs:
+            chanTrackDat.append(job.call())
+            if isinstance(chanTrackDat[-1], TrackingError):
+                break
+    for chanDat in chanTrackDat:
+        if isinstance(chanDat, TrackingError):
+            sys.exit(str(chanDat))
+    
+    # Track data is reported for the last tracked channel
+    trackDat = {}
+    for chanDat in chanTrackDat:
+        if not chanDat is None:
+            trackDat = chanDat
+    return trackDat
 
-        
-        if cfg.hasValue(ELMConfig.thresholdFromWholeRange) and cfg.getValue(ELMConfig.thresholdFromWholeRange) == True:
-            threshMethod = "Otsu" # Default works very poorly for this data
-            if cfg.hasValue(ELMConfig.thresholdMethod):
-                threshMethod = cfg.getValue(ELMConfig.thresholdMethod)
-            thresholder = AutoThresholder()
-            computedThresh = thresholder.getThreshold(threshMethod, totalHist)
-            cfg.setValue(ELMConfig.imageThreshold, computedThresh)
-            print("\tComputed threshold from total hist (" + threshMethod + "): " + str(computedThresh))
-            print()
-        else:
-            print("\tUsing threshold computed on individual images!")
-            print()
-            computedThresh = 0
-        
-        chanName = cfg.getValue(ELMConfig.chanLabel)[c]
-        
-        imp = ImagePlus()
-        imp.setStack(imSeq)
-        imp.setDimensions(1, 1, cfg.getValue(ELMConfig.numT))
-        imp.setTitle(wellName + ", channel " + str(c))
-        
-        impColor = ImagePlus()
-        impColor.setStack(imColorSeq)
-        impColor.setDimensions(1, 1, cfg.getValue(ELMConfig.numT))
-        impColor.setTitle(wellName + ", channel " + str(c) + " (Color)")
-
-        #----------------------------
-        # Create the model object now
-        #----------------------------
-        
-        # Some of the parameters we configure below need to have
-        # a reference to the model at creation. So we create an
-        # empty model now.
-        
-        model = Model()
-        
-        # Send all messages to ImageJ log window.
-        model.setLogger(Logger.IJ_LOGGER)
-        
-        pa_features = ["Area", "PercentArea", "Mean", "StdDev", "Mode", "Min",
-                                      "Max", "X", "Y", "XM", "YM", "Perim.",
-                                      "BX", "BY", "Width", "Height", "Major",
-                                      "Minor", "Angle", "Circ.", "Feret",
-                                      "IntDen", "Median", "Skew", "Kurt",
-                                      "RawIntDen", "FeretX", "FeretY",
-                                      "FeretAngle", "MinFeret", "AR",
-                                      "Round", "Solidity"]
-
-        featureNames = {}
-        featureShortNames = {}
-        featureDimensions = {};
-        isInt = {};
-        for feature in pa_features:
-            featureNames[feature] = feature
-            featureShortNames[feature] = feature
-            featureDimensions[feature] = Dimension.STRING
-            isInt[feature] = False
-
-        model.getFeatureModel().declareSpotFeatures(pa_features, featureNames, featureShortNames, featureDimensions, isInt)
-
-        #------------------------
-        # Prepare settings object
-        #------------------------
-        
-        settings = Settings()
-        settings.setFrom(imp)
-        
-        dbgPath = os.path.join(wellPath, 'debugImages_' + chanName )
-        if not os.path.exists(dbgPath):
-            os.makedirs(dbgPath)
-        
-        if cfg.hasValue(ELMConfig.thresholdMethod):
-            threshMethod = cfg.getValue(ELMConfig.thresholdMethod)
-        else:
-            threshMethod = "Default"
-            
-        # Configure detector - We use the Strings for the keys
+
+####
+#
+#  Track the cells in a single channel of a well.  Returns the track data of
+#  the channel, or None if no tracks were written.
+#
+####
+def processChannel(cfg, wellName, wellPath, images, c, imgWidth, imgHeight, cropOffset):
+    chanName = cfg.getValue(ELMConfig.chanLabel)[c]
+    
+    # Frames are opened on demand, so only the cached frames are in memory
+    framePaths = []
+    framePlanes = []
+    for z in range(0, cfg.getValue(ELMConfig.numZ)):
+        for t in range(0, cfg.getValue(ELMConfig.numT)):
+            framePaths.append(images[c][z][t][0])
+            framePlanes.append((z, t))
+    cacheSize = ELMFrameStack.DEFAULT_CACHE_SIZE
+    if cfg.hasValue(ELMConfig.frameCacheSize):
+        cacheSize = cfg.getValue(ELMConfig.frameCacheSize)
+    # Grayscale frames are kept in the array store, so later runs read them from its chunks
+    store = None
+    if ELMArrayStore.isEnabled(cfg):
+        store = ELMArrayStore.ArrayStore(wellPath, cfg)
+        framePlanes = [(z, t, ELMArrayStore.getGrayHash(cfg, c, framePaths[i])) for i, (z, t) in enumerate(framePlanes)]
+    imSeq = ELMFrameStack.FrameStack(imgWidth, imgHeight, framePaths, c, chanName, cfg, True, cacheSize, store, framePlanes)
+
+    # The whole range threshold comes from a separate, histogram-only pass
+    # over the frames, so detection can stream the frames independently
+    computedThresh = ELMTracking.getDetectionThreshold(cfg, wellPath, c, chanName, framePaths)
+    print()
+    
+    chanName = cfg.getValue(ELMConfig.chanLabel)[c]
+    
+    imp = ImagePlus()
+    imp.setStack(imSeq)
+    imp.setDimensions(1, 1, cfg.getValue(ELMConfig.numT))
+    imp.setTitle(wellName + ", channel " + str(c))
+    
+    # The color frames are only needed to render the overlay video
+    renderAvi = not cfg.hasValue(ELMConfig.renderAvi) or cfg.getValue(ELMConfig.renderAvi)
+
+    #----------------------------
+    # Create the model object now
+    #----------------------------
+    
+    # Some of the parameters we configure below need to have
+    # a reference to the model at creation. So we create an
+    # empty model now.
+    
+    model = Model()
+    
+    # Send all messages to ImageJ log window.
+    model.setLogger(Logger.IJ_LOGGER)
+    
+    pa_features = ["Area", "PercentArea", "Mean", "StdDev", "Mode", "Min",
+                                  "Max", "X", "Y", "XM", "YM", "Perim.",
+                                  "BX", "BY", "Width", "Height", "Major",
+                                  "Minor", "Angle", "Circ.", "Feret",
+                                  "IntDen", "Median", "Skew", "Kurt",
+                                  "RawIntDen", "FeretX", "FeretY",
+                                  "FeretAngle", "MinFeret", "AR",
+                                  "Round", "Solidity"]
+
+    featureNames = {}
+    featureShortNames = {}
+    featureDimensions = {};
+    isInt = {};
+    for feature in pa_features:
+        featureNames[feature] = feature
+        featureShortNames[feature] = feature
+        featureDimensions[feature] = Dimension.STRING
+        isInt[feature] = False
+
+    model.getFeatureModel().declareSpotFeatures(pa_features, featureNames, featureShortNames, featureDimensions, isInt)
+
+    #------------------------
+    # Prepare settings object
+    #------------------------
+    
+    settings = Settings()
+    settings.setFrom(imp)
+    
+    dbgPath = os.path.join(wellPath, 'debugImages_' + chanName )
+    if not os.path.exists(dbgPath):
+        os.makedirs(dbgPath)
+    
+    if cfg.hasValue(ELMConfig.thresholdMethod):
+        threshMethod = cfg.getValue(ELMConfig.thresholdMethod)
+    else:
+        threshMethod = "Default"
+        
+    # Configure detector - We use the Strings for the keys
+    if ELMImageUtils.isLocalThresholdMethod(cfg):
+        localRadius = ELMImageUtils.DEFAULT_LOCAL_THRESHOLD_RADIUS
+        if cfg.hasValue(ELMConfig.localThresholdRadius):
+            localRadius = cfg.getValue(ELMConfig.localThresholdRadius)
+        localK = ELMImageUtils.DEFAULT_LOCAL_THRESHOLD_K
+        if cfg.hasValue(ELMConfig.localThresholdK):
+            localK = cfg.getValue(ELMConfig.localThresholdK)
+        settings.detectorFactory = LocalThresholdDetectorFactory()
+        settings.detectorSettings = {
+            'ABOVE' : True,
+            'DEBUG_MODE' : True,
+            'DEBUG_OUTPATH' : dbgPath,
+            'THRESHOLD_METHOD' : threshMethod,
+            'LOCAL_RADIUS' : localRadius,
+            'LOCAL_K' : localK
+        }
+    else:
         settings.detectorFactory = ThresholdDetectorFactory()
         settings.detectorSettings = {
             'THRESHOLD' : computedThresh,
@@ -507,307 +583,202 @@ def processImages(cfg, wellName, wellPath, images):
             'DEBUG_OUTPATH' : dbgPath,
             'THRESHOLD_METHOD' : threshMethod
         }
-        
-        #settings.detectorFactory = LocalThresholdDetectorFactory()
-        #settings.detectorSettings = {
-        #    'THRESHOLD' : computedThresh,
-        #    'DEBUG_MODE' : True,
-        #    'DEBUG_OUTPATH' : dbgPath
-        #}
-        
-        # Configure spot filters - Classical filter on quality
-        filter1 = FeatureFilter('QUALITY', 150, True)
-        settings.addSpotFilter(filter1)
-        
-        # Configure tracker - We want to allow merges and fusions
-        settings.trackerFactory = SparseLAPTrackerFactory()
-        settings.trackerSettings = LAPUtils.getDefaultLAPSettingsMap() # almost good enough
-        
-        # Linking
-        settings.trackerSettings[TrackerKeys.KEY_LINKING_MAX_DISTANCE] = 220.0; # in pixels
-        
-        linkFeaturePenalties = HashMap();
-        linkFeaturePenalties['Area'] = 1.0
-        linkFeaturePenalties['POSITION_X'] = 1.0
-        linkFeaturePenalties['POSITION_Y'] = 1.0
-        #linkFeaturePenalties['Circ.'] = 1.0
-        #linkFeaturePenalties['Mean'] = 1.0
-         
-        settings.trackerSettings[TrackerKeys.KEY_LINKING_FEATURE_PENALTIES] = linkFeaturePenalties;
-        # Gap closing
-        settings.trackerSettings[TrackerKeys.KEY_ALLOW_GAP_CLOSING] =  True;
-        settings.trackerSettings[TrackerKeys.KEY_GAP_CLOSING_MAX_FRAME_GAP] =  8;
-        settings.trackerSettings[TrackerKeys.KEY_GAP_CLOSING_MAX_DISTANCE] =  120.0; # in pixels
-        #settings.trackerSettings[TrackerKeys.KEY_GAP_CLOSING_FEATURE_PENALTIES] =  new HashMap<>(DEFAULT_GAP_CLOSING_FEATURE_PENALTIES));
-        # Track splitting
-        settings.trackerSettings[TrackerKeys.KEY_ALLOW_TRACK_SPLITTING] =  False;
-        settings.trackerSettings[TrackerKeys.KEY_SPLITTING_MAX_DISTANCE] =  45.0; # in pixels
-        #settings.trackerSettings[TrackerKeys.KEY_SPLITTING_FEATURE_PENALTIES] =  new HashMap<>(DEFAULT_SPLITTING_FEATURE_PENALTIES));
-        # Track merging
-        settings.trackerSettings[TrackerKeys.KEY_ALLOW_TRACK_MERGING] =  True;
-        settings.trackerSettings[TrackerKeys.KEY_MERGING_MAX_DISTANCE] =  45.0; # in pixels
-        #settings.trackerSettings[TrackerKeys.KEY_MERGING_FEATURE_PENALTIES] =  new HashMap<>(DEFAULT_MERGING_FEATURE_PENALTIES));
-        # Others
-        settings.trackerSettings[TrackerKeys.KEY_BLOCKING_VALUE] =  float("inf");
-        settings.trackerSettings[TrackerKeys.KEY_ALTERNATIVE_LINKING_COST_FACTOR] =  1.05;
-        settings.trackerSettings[TrackerKeys.KEY_CUTOFF_PERCENTILE] =  0.9;
-
-        
-        # Configure track analyzers - Later on we want to filter out tracks
-        # based on their displacement, so we need to state that we want
-        # track displacement to be calculated. By default, out of the GUI,
-        # no features are calculated.
-        
-        # The displacement feature is provided by the TrackDurationAnalyzer.
-        settings.addTrackAnalyzer(TrackDurationAnalyzer())
-        settings.addTrackAnalyzer(TrackBranchingAnalyzer())
-        settings.addTrackAnalyzer(TrackIndexAnalyzer())
-        settings.addTrackAnalyzer(TrackLocationAnalyzer())
-        settings.addTrackAnalyzer(TrackSpeedStatisticsAnalyzer())
-        
-        settings.addSpotAnalyzerFactory(SpotIntensityAnalyzerFactory())
-        settings.addSpotAnalyzerFactory(SpotContrastAndSNRAnalyzerFactory())        
-        
-        # Configure track filters - We want to get rid of the two immobile spots at
-        # the bottom right of the image. Track displacement must be above 10 pixels.
-        #filter2 = FeatureFilter('TRACK_DISPLACEMENT', 1, True)
-        #settings.addTrackFilter(filter2)
-        #filter2 = FeatureFilter('TRACK_DISPLACEMENT', 1, True)
-        #settings.addTrackFilter(filter2)
-        
-        
-        #print("Spot feature analyzers: " + settings.toStringFeatureAnalyzersInfo())
-        
-        #-------------------
-        # Instantiate plugin
-        #-------------------
-        
-        trackmate = TrackMate(model, settings)
-        trackmate.setNumThreads(1)
-        
-        #--------
-        # Process
-        #--------
-        
-        ok = trackmate.checkInput()
-        if not ok:
-            sys.exit(str(trackmate.getErrorMessage()))
-        
+    
+    # Configure spot filters - Classical filter on quality
+    filter1 = FeatureFilter('QUALITY', 150, True)
+    settings.addSpotFilter(filter1)
+    
+    # Configure tracker - We want to allow merges and fusions
+    ELMTracking.configureTracker(settings, ELMConfig.getTrackerParams(cfg))
+    
+    # Configure track analyzers - Later on we want to filter out tracks
+    # based on their displacement, so we need to state that we want
+    # track displacement to be calculated.
+    ELMTracking.addTrackAnalyzers(settings)
+    
+    settings.addSpotAnalyzerFactory(SpotIntensityAnalyzerFactory())
+    settings.addSpotAnalyzerFactory(SpotContrastAndSNRAnalyzerFactory())        
+    
+    # Configure track filters - We want to get rid of the two immobile spots at
+    # the bottom right of the image. Track displacement must be above 10 pixels.
+    #filter2 = FeatureFilter('TRACK_DISPLACEMENT', 1, True)
+    #settings.addTrackFilter(filter2)
+    #filter2 = FeatureFilter('TRACK_DISPLACEMENT', 1, True)
+    #settings.addTrackFilter(filter2)
+    
+    
+    #print("Spot feature analyzers: " + settings.toStringFeatureAnalyzersInfo())
+    
+    #-------------------
+    # Instantiate plugin
+    #-------------------
+    
+    trackmate = TrackMate(model, settings)
+    trackmate.setNumThreads(getNumThreads(cfg))
+    
+    #--------
+    # Process
+    #--------
+    
+    ok = trackmate.checkInput()
+    if not ok:
+        raise TrackingError(str(trackmate.getErrorMessage()))
+    
+    # Detections can be cached, so re-tuning the tracker doesn't require re-detecting spots
+    cacheDetections = cfg.hasValue(ELMConfig.cacheDetections) and cfg.getValue(ELMConfig.cacheDetections)
+    linkingOnly = cfg.hasValue(ELMConfig.linkingOnly) and cfg.getValue(ELMConfig.linkingOnly)
+    cachedSpots = None
+    if cacheDetections or linkingOnly:
+        detectionCachePath = ELMDetectionCache.getCachePath(wellPath, chanName)
+        detectionHash = ELMDetectionCache.getDetectionHash(cfg, c, framePaths, settings.detectorSettings)
+        cachedSpots = ELMDetectionCache.loadSpots(detectionCachePath, detectionHash)
+        if linkingOnly and cachedSpots is None:
+            raise TrackingError("Linking only mode, but no valid cached detections for " + wellName + ", " + chanName + "! Path: " + detectionCachePath)
+    
+    # A tracker sweep only compares the tracker params on one set of
+    # detections, no other output is written
+    if cfg.hasValue(ELMConfig.trackerSweep) and cfg.getValue(ELMConfig.trackerSweep):
+        if cachedSpots is None:
+            print ("Detecting " + chanName + "...")
+            ok = trackmate.execDetection() \
+                and trackmate.execInitialSpotFiltering() \
+                and trackmate.computeSpotFeatures(False)
+            if not ok:
+                raise TrackingError(str(trackmate.getErrorMessage()))
+            cachedSpots = model.getSpots()
+            if cacheDetections:
+                ELMDetectionCache.saveSpots(detectionCachePath, detectionHash, cachedSpots)
+        sweepPath = os.path.join(wellPath, chanName + "_trackerSweep.csv")
+        ELMTracking.runTrackerSweep(cfg, cachedSpots, settings.getSpotFilters(), sweepPath)
+        imp.close()
+        return None
+    
+    if not cachedSpots is None:
+        print ("Linking " + chanName + " using cached detections...")
+        ok = runLinking(trackmate, model, settings, cachedSpots)
+    else:
         print ("Processing " + chanName + "...")
         ok = trackmate.process()
-        if not ok:
-            sys.exit(str(trackmate.getErrorMessage()))
-        
-        
-        #----------------
-        # Display results
-        #----------------
-        print("Rendering...")
-        
-        # Set spot names based on track IDs
-        # This allows track IDs to be displayed in the rendered video
-        for tId in model.getTrackModel().trackIDs(True):
-            trackSpots = model.getTrackModel().trackSpots(tId)
-            for spot in trackSpots:
-                spot.setName(str(tId))
-                
-        # Determine sub-tracks within a track
-        # Since tracks can merge, we want to keep track of which track a spot is
-        # in prior to the merge
-        spotToSubTrackMap = {}
-        spotIt = model.getSpots().iterator(False)
-        trackModel = model.getTrackModel()
-        subTrackCount = {}
-        while spotIt.hasNext():
-            spot = spotIt.next();
-            spotEdges = trackModel.edgesOf(spot);
-            # Find merge points within a track: ignore spots with fewer than 2 edges
-            if (len(spotEdges) < 2):
-                continue
-            
-            # We have a merge if we have multiple incoming edges
-            incomingEdges = 0
-            edgeIt = spotEdges.iterator()
-            ancestorSpots = []
-            while edgeIt.hasNext():
-                edge = edgeIt.next()
-                src = trackModel.getEdgeSource(edge)
-                dst = trackModel.getEdgeTarget(edge)
-                if dst.ID() == spot.ID():
-                    ancestorSpots.append(src)
-                    incomingEdges += 1
-            # Ignore non-merges
-            if incomingEdges < 2:
-                continue
+        if ok and cacheDetections:
+            ELMDetectionCache.saveSpots(detectionCachePath, detectionHash, model.getSpots())
+    if not ok:
+        raise TrackingError(str(trackmate.getErrorMessage()))
+    
+    #----------------
+    # Display results
+    #----------------
+    print("Rendering...")
+    
+    # Set spot names based on track IDs
+    # This allows track IDs to be displayed in the rendered video
+    for tId in model.getTrackModel().trackIDs(True):
+        trackSpots = model.getTrackModel().trackSpots(tId)
+        for spot in trackSpots:
+            spot.setName(str(tId))
             
-            trackId = trackModel.trackIDOf(spot)
-            if trackId in subTrackCount:
-                subTrackId = subTrackCount[trackId]
-            else:
-                subTrackId = 1
-            for ancestorSpot in ancestorSpots:
-                labelSubTrackAncestors(trackModel, spotToSubTrackMap, ancestorSpot, subTrackId, trackId, False)
-                subTrackId += 1
-            subTrackCount[trackId] = subTrackId
-        
-        # Spots after the last merge still need to be labeled
-        for tId in trackModel.trackIDs(True):
-            trackSpots = trackModel.trackSpots(tId)
-            spotIt = trackSpots.iterator();
-            lastSpot = None
-            while spotIt.hasNext():
-                spot = spotIt.next()
-                outgoingEdges = 0
-                spotEdges = trackModel.edgesOf(spot);
-                edgeIt = spotEdges.iterator()
-                while edgeIt.hasNext():
-                    edge = edgeIt.next()
-                    src = trackModel.getEdgeSource(edge)
-                    dst = trackModel.getEdgeTarget(edge)
-                    if src.ID() == spot.ID():
-                        outgoingEdges += 1
-                if outgoingEdges == 0 and len(spotEdges) > 0:
-                    lastSpot = spot
-                
-            if tId in subTrackCount:
-                subTrackId = subTrackCount[tId]
-            else:
-                subTrackId = 1
-            if not lastSpot == None:
-                labelSubTrackAncestors(trackModel, spotToSubTrackMap, lastSpot, subTrackId, tId, True)    
-        
-        # Create output file
-        trackOut = os.path.join(wellPath, chanName + "_spotToTrackMap.csv")
-        trackFile = open(trackOut, 'w')
-        # Fetch the track feature from the feature model.
-        trackFile.write('Spot Id, Track Sub Id, Track Id, Frame \n')
-        for spotId in spotToSubTrackMap:
-            trackFile.write(str(spotId) + ', ' + ','.join(spotToSubTrackMap[spotId]) + '\n')
-        trackFile.close()
-        
-        # Write Edge Set
-        trackOut = os.path.join(wellPath, chanName + "_mergeEdgeSet.csv")
-        trackFile = open(trackOut, 'w')
-        trackFile.write('Track Id, Spot Id, Spot Id \n')
-        edgeIt = trackModel.edgeSet().iterator()
-        while edgeIt.hasNext():
-            edge = edgeIt.next()
-            src = trackModel.getEdgeSource(edge)
-            dst = trackModel.getEdgeTarget(edge)
-            trackId = trackModel.trackIDOf(edge)
-            srcSubTrack = spotToSubTrackMap[src.ID()][0]
-            dstSubTrack = spotToSubTrackMap[dst.ID()][0]
-            if not srcSubTrack == dstSubTrack:
-                trackFile.write(str(trackId) + ', ' + str(src.ID()) + ', ' + str(dst.ID()) + '\n')
-        trackFile.close()
-
-
-        selectionModel = SelectionModel(model)
-        displayer =  HyperStackDisplayer(model, selectionModel, impColor)
-        displayer.setDisplaySettings(TrackMateModelView.KEY_TRACK_COLORING, PerTrackFeatureColorGenerator(model, TrackIndexAnalyzer.TRACK_INDEX ))
-        displayer.setDisplaySettings(TrackMateModelView.KEY_SPOT_COLORING, SpotColorGeneratorPerTrackFeature(model, TrackIndexAnalyzer.TRACK_INDEX ))
-        displayer.setDisplaySettings(TrackMateModelView.KEY_DISPLAY_SPOT_NAMES, True)        
-        displayer.setDisplaySettings(TrackMateModelView.KEY_TRACK_DISPLAY_MODE, TrackMateModelView.TRACK_DISPLAY_MODE_LOCAL_BACKWARD_QUICK)
-        displayer.setDisplaySettings(TrackMateModelView.KEY_TRACK_DISPLAY_DEPTH, 2)
-        displayer.render()
-        displayer.refresh()
-        
-        trackmate.getSettings().imp = impColor
-        coa = CaptureOverlayAction(None)
-        coa.execute(trackmate)
-        
-        WindowManager.setTempCurrentImage(coa.getCapture());
-        IJ.saveAs('avi', os.path.join(wellPath, chanName + "_out.avi"))
+    # Determine sub-tracks within a track
+    # Since tracks can merge, we want to keep track of which track a spot is
+    # in prior to the merge
+    spotToSubTrackMap = ELMTracking.labelSubTracks(model)
+    trackModel = model.getTrackModel()
+    
+    # Create output file
+    trackOut = os.path.join(wellPath, chanName + "_spotToTrackMap.csv")
+    trackFile = open(trackOut, 'w')
+    # Fetch the track feature from the feature model.
+    trackFile.write('Spot Id, Track Sub Id, Track Id, Frame \n')
+    for spotId in spotToSubTrackMap:
+        trackFile.write(str(spotId) + ', ' + ','.join(spotToSubTrackMap[spotId]) + '\n')
+    trackFile.close()
+    
+    # Write Edge Set
+    trackOut = os.path.join(wellPath, chanName + "_mergeEdgeSet.csv")
+    trackFile = open(trackOut, 'w')
+    trackFile.write('Track Id, Spot Id, Spot Id \n')
+    edgeIt = trackModel.edgeSet().iterator()
+    while edgeIt.hasNext():
+        edge = edgeIt.next()
+        src = trackModel.getEdgeSource(edge)
+        dst = trackModel.getEdgeTarget(edge)
+        trackId = trackModel.trackIDOf(edge)
+        srcSubTrack = spotToSubTrackMap[src.ID()][0]
+        dstSubTrack = spotToSubTrackMap[dst.ID()][0]
+        if not srcSubTrack == dstSubTrack:
+            trackFile.write(str(trackId) + ', ' + str(src.ID()) + ', ' + str(dst.ID()) + '\n')
+    trackFile.close()
 
-        imp.close()
-        impColor.close()
-        displayer.clear()
-        displayer.getImp().hide()
-        displayer.getImp().close()
-        coa.getCapture().hide()
-        coa.getCapture().close()
-
-        # Echo results with the logger we set at start:
-        model.getLogger().log(str(model))
-        
-        # The feature model, that stores edge and track features.
-        fm = model.getFeatureModel()
-
-        # Write output for tracks
-        numTracks = model.getTrackModel().trackIDs(True).size();
-        print "Writing track data for " + str(numTracks) + " tracks."
-        trackDat = {} 
-        for tId in model.getTrackModel().trackIDs(True):
-            track = model.getTrackModel().trackSpots(tId)
-            
-            # Ensure track spots dir exists
-            trackOut = os.path.join(wellPath, chanName + "_track_spots")
-            if not os.path.exists(trackOut):
-                os.makedirs(trackOut)
-            # Create output file
-            trackOut = os.path.join(trackOut, "track_" + str(tId) + ".csv")
-            trackFile = open(trackOut, 'w')
-
-            # Write Header
-            header = 'Name, ID, Frame, '
-            for feature in track.toArray()[0].getFeatures().keySet():
-                if feature == 'Frame':
-                    continue;
-                header += feature + ", "
-            header = header[0:len(header) - 2]
-            header += '\n'
-            trackFile.write(header)
-            # Write spot data
-            avgTotalIntensity = 0
-            for spot in track:
-                #print spot.echo()
-                data = [spot.getName(), str(spot.ID()), str(spot.getFeature('FRAME'))]
-                for feature in spot.getFeatures():
-                    if feature == 'Frame':
-                        continue;
-                    elif feature == 'TOTAL_INTENSITY':
-                        avgTotalIntensity += spot.getFeature(feature)
-                    data.append(str(spot.getFeature(feature)))
-                trackFile.write(','.join(data) + '\n')
-            trackFile.close()
-            avgTotalIntensity /= len(track)
-
-            # Write out track stats
-            # Make sure dir exists            
-            trackOut = os.path.join(wellPath, chanName + "_tracks")
-            if not os.path.exists(trackOut):
-                os.makedirs(trackOut)
-            # Create output file
-            trackOut = os.path.join(trackOut, "track_" + str(tId) + ".csv")
-            trackFile = open(trackOut, 'w')
-            # Fetch the track feature from the feature model.
-            header = ''
-            for featName in fm.getTrackFeatureNames():
-                header += featName + ", "
-            header = header[0:len(header) - 2]
-            header += '\n'
-            trackFile.write(header)
-            
-            features = ''
-            for featName in fm.getTrackFeatureNames():
-                features += str(fm.getTrackFeature(tId, featName)) + ', '
-            features = features[0:len(features) - 2]
-            features += '\n'
-            trackFile.write(features)
-            trackFile.write('\n')
-            trackFile.close()
-            
-            trackDat[tId] = [str(tId), str(fm.getTrackFeature(tId, 'TRACK_DURATION')), str(avgTotalIntensity), str(fm.getTrackFeature(tId, 'TRACK_START')), str(fm.getTrackFeature(tId, 'TRACK_STOP'))]
 
-        # Create output file
-        trackOut = os.path.join(wellPath, chanName + "_trackSummary.csv")
-        trackFile = open(trackOut, 'w')
-        # Fetch the track feature from the feature model.
-        trackFile.write('Track Id, Duration, Avg Total Intensity, Start Frame, Stop Frame \n')
-        for track in trackDat:
-            trackFile.write(','.join(trackDat[track]) + '\n')
-        trackFile.close()
+    imp.close()
+
+    # Report spot coordinates in the full frame, if the frames were cropped
+    if not cropOffset == (0, 0):
+        shiftSpotCoordinates(model, cropOffset, imp.getCalibration())
+        trackmate.computeEdgeFeatures(False)
+        trackmate.computeTrackFeatures(False)
+
+    # Echo results with the logger we set at start:
+    model.getLogger().log(str(model))
+    
+    # The feature model, that stores edge and track features.
+    fm = model.getFeatureModel()
+
+    # Write output for tracks
+    # All spots go in one table and all tracks in another, with the track
+    # ID as a column, rather than two files for every track
+    numTracks = model.getTrackModel().trackIDs(True).size();
+    print "Writing track data for " + str(numTracks) + " tracks."
+    spotFeatures = [feature for feature in fm.getSpotFeatures() if not feature == 'FRAME']
+    trackFeatures = list(fm.getTrackFeatures())
+    
+    spotFile = open(os.path.join(wellPath, chanName + "_trackSpots.csv"), 'w')
+    spotFile.write(','.join(['Track Id', 'Name', 'ID', 'Frame'] + spotFeatures) + '\n')
+    trackFile = open(os.path.join(wellPath, chanName + "_trackFeatures.csv"), 'w')
+    trackFile.write(','.join(['Track Id'] + trackFeatures) + '\n')
+    
+    # Spot and edge columns for the track stats, so they are computed in one
+    # pass rather than track by track through the model
+    spotColumns = {'Track Id' : [], 'Frame' : [], 'X' : [], 'Y' : [], 'Total Intensity' : []}
+    spotIndex = dict()
+    for tId in model.getTrackModel().trackIDs(True):
+        track = model.getTrackModel().trackSpots(tId)
+        
+        # Write spot data
+        for spot in track:
+            data = [str(tId), spot.getName(), str(spot.ID()), str(spot.getFeature('FRAME'))]
+            for feature in spotFeatures:
+                value = spot.getFeature(feature)
+                if value is None:
+                    data.append('')
+                else:
+                    data.append(str(value))
+            spotFile.write(','.join(data) + '\n')
+            spotIndex[spot.ID()] = len(spotColumns['Track Id'])
+            spotColumns['Track Id'].append(tId)
+            # Time, rather than frame, so durations match the TrackMate track features
+            spotColumns['Frame'].append(spot.getFeature('POSITION_T'))
+            spotColumns['X'].append(spot.getFeature('POSITION_X'))
+            spotColumns['Y'].append(spot.getFeature('POSITION_Y'))
+            spotColumns['Total Intensity'].append(spot.getFeature('TOTAL_INTENSITY'))
+        
+        # Write out track stats
+        data = [str(tId)]
+        for featName in trackFeatures:
+            data.append(str(fm.getTrackFeature(tId, featName)))
+        trackFile.write(','.join(data) + '\n')
+    spotFile.close()
+    trackFile.close()
+
+    edgeColumns = {'Source' : [], 'Target' : []}
+    for edge in trackModel.edgeSet():
+        edgeColumns['Source'].append(spotIndex[trackModel.getEdgeSource(edge).ID()])
+        edgeColumns['Target'].append(spotIndex[trackModel.getEdgeTarget(edge).ID()])
+    trackDat = ELMTrackStats.computeTrackStats(spotColumns, edgeColumns)
+    ELMTrackStats.writeTrackSummary(os.path.join(wellPath, chanName + "_trackSummary.csv"), trackDat)
     
+    # The compressed track model is streamed to disk, the TrackMate XML is
+    # much larger and slower to write so it is optional
+    ELMTrackModelIO.writeTrackModel(model, ELMTrackModelIO.getTrackModelPath(wellPath, chanName))
+    if cfg.hasValue(ELMConfig.writeTrackModelXml) and cfg.getValue(ELMConfig.writeTrackModelXml):
         trackOut = os.path.join(wellPath, chanName + "_trackModel.xml")
         trackFile = File(trackOut)
         writer = TmXmlWriter(trackFile, model.getLogger() );
@@ -816,39 +787,101 @@ def processImages(cfg, wellName, wellPath, images):
         writer.appendSettings( trackmate.getSettings() );
         #writer.appendGUIState( controller.getGuimodel() );
         writer.writeToFile();
-        
+    ELMRender.saveFrameList(wellPath, chanName, framePaths)
+
+    # The overlay video is rendered from the saved track model, streaming the
+    # frames, either now or by a background worker
+    if renderAvi:
+        if cfg.hasValue(ELMConfig.renderInBackground) and cfg.getValue(ELMConfig.renderInBackground):
+            ELMRender.submitRender(cfg, wellPath, chanName)
+        else:
+            ELMRender.renderTrackOverlay(cfg, wellPath, chanName)
+    
     model.clearSpots(True)
     model.clearTracks(True)
-        
+    
     return trackDat
 
 
 ####
 #
+#  An error that stops the tracking of a channel
 #
 ####
-def labelSubTrackAncestors(trackModel, spotToSubTrackMap, spot, subTrackId, trackId, lastSpot):
-    if spot.ID() in spotToSubTrackMap:
-        if lastSpot:
-            print("Warning! Adding last Spot " + str(spot.ID()) + ' to spotToSubTrackMap, but it is already entered!')
-        else:
-            print("Warning! Adding Spot " + str(spot.ID()) + ' to spotToSubTrackMap, but it is already entered!')
-        
-    spotToSubTrackMap[spot.ID()] = [str(subTrackId), str(trackId), str(spot.getFeature('FRAME'))]
-    
-    spotEdges = trackModel.edgesOf(spot);
-    # Stop labeling at merges
-    if (len(spotEdges) > 2):
-        return
-    
-    edgeIt = spotEdges.iterator()
-    while edgeIt.hasNext():
-        edge = edgeIt.next()
-        src = trackModel.getEdgeSource(edge)
-        dst = trackModel.getEdgeTarget(edge)
-        if dst.ID() == spot.ID():
-            labelSubTrackAncestors(trackModel, spotToSubTrackMap, src, subTrackId, trackId, lastSpot)
-    
+class TrackingError(Exception):
+    pass
+
+
+####
+#
+#  Runs processChannel for one channel, so channels can be submitted to an
+#  executor.  A TrackingError is returned rather than raised, so it can be
+#  reported from the thread that submitted the job.
+#
+####
+class ChannelJob(Callable):
+
+    ###
+    #
+    ###
+    def __init__(self, cfg, wellName, wellPath, images, c, imgWidth, imgHeight, cropOffset):
+        self.args = (cfg, wellName, wellPath, images, c, imgWidth, imgHeight, cropOffset)
+
+    ###
+    #
+    ###
+    def call(self):
+        try:
+            return processChannel(*self.args)
+        except TrackingError, e:
+            return e
+
+
+####
+#
+#  Get the number of threads TrackMate uses for detection and feature analysis
+#
+####
+def getNumThreads(cfg):
+    if cfg.hasValue(ELMConfig.numThreads):
+        return cfg.getValue(ELMConfig.numThreads)
+    return 1
+
+
+####
+#
+#  Run only the tracking steps of TrackMate, on spots that were detected earlier
+#
+####
+def runLinking(trackmate, model, settings, spots):
+    ELMDetectionCache.declareAnalyzerFeatures(model, settings)
+    model.setSpots(spots, False)
+    return trackmate.execSpotFiltering(False) \
+        and trackmate.execTracking() \
+        and trackmate.computeEdgeFeatures(False) \
+        and trackmate.computeTrackFeatures(False) \
+        and trackmate.execTrackFiltering(False)
+
+
+####
+#
+#  Shift the positions of all spots in a model by a pixel offset, used to map
+#  spots detected in a cropped frame back to full frame coordinates.
+#
+####
+def shiftSpotCoordinates(model, offset, calib):
+    dx = offset[0] * calib.pixelWidth
+    dy = offset[1] * calib.pixelHeight
+    for spot in model.getSpots().iterable(True):
+        spot.putFeature('POSITION_X', spot.getFeature('POSITION_X') + dx)
+        spot.putFeature('POSITION_Y', spot.getFeature('POSITION_Y') + dy)
+        for feature in ELMImageUtils.PARTICLE_COORD_COLS_X:
+            if not spot.getFeature(feature) is None:
+                spot.putFeature(feature, spot.getFeature(feature) + dx)
+        for feature in ELMImageUtils.PARTICLE_COORD_COLS_Y:
+            if not spot.getFeature(feature) is None:
+                spot.putFeature(feature, spot.getFeature(feature) + dy)
+
 
 ####
 #
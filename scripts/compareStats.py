@@ -0,0 +1,138 @@
+# Copyright (C) 2011 - 2019, Raytheon BBN Technologies and contributors listed
+# in the AUTHORS file in TASBE Flow Analytics distribution's top directory.
+#
+# This file is part of the TASBE Flow Analytics package, and is distributed
+# under the terms of the GNU General Public License, with a linking
+# exception, as described in the file LICENSE in the TASBE Image Analysis
+# package distribution's top directory.
+
+import sys, os
+
+# Values are written with 4 decimals, so they can differ in the last one
+DEFAULT_TOLERANCE = 0.001
+
+####
+#
+#
+####
+def printUsage():
+    print "This script compares the particle stats CSVs of two cellStats output"
+    print "directories, such as a run with tileSize set and a run without it."
+    print "Particles can be listed in a different order, so the rows of each"
+    print "table are sorted before they are compared."
+    print "usage: "
+    print "python compareStats.py <outputDir1> <outputDir2> [tolerance]"
+    print "tolerance - Optional, largest difference allowed between two values,"
+    print "            relative to the larger of them when it is above 1.  Default "
+    print "            is " + str(DEFAULT_TOLERANCE) + "."
+
+
+####
+#
+#  Get the paths of the stats CSVs under a directory, relative to it
+#
+####
+def getStatsFiles(outputDir):
+    statsFiles = []
+    for dirPath, dirNames, fileNames in os.walk(outputDir):
+        for fileName in fileNames:
+            if fileName.endswith("_stats.csv"):
+                statsFiles.append(os.path.relpath(os.path.join(dirPath, fileName), outputDir))
+    return sorted(statsFiles)
+
+
+####
+#
+#  Read a stats CSV.  Returns the header and the sorted rows, with N/A values
+#  as None.
+#
+####
+def readStats(path):
+    statsFile = open(path, "r")
+    header = [heading.strip() for heading in statsFile.readline().split(",")]
+    rows = []
+    for line in statsFile:
+        if not line.strip():
+            continue
+        row = []
+        for value in line.split(","):
+            value = value.strip()
+            if value == "N/A":
+                row.append(None)
+            else:
+                row.append(float(value))
+        rows.append(row)
+    statsFile.close()
+    return header, sorted(rows)
+
+
+####
+#
+#  Check if two values are equal within the tolerance
+#
+####
+def isClose(value1, value2, tolerance):
+    if value1 is None or value2 is None:
+        return value1 is None and value2 is None
+    return abs(value1 - value2) <= tolerance * max(1.0, abs(value1), abs(value2))
+
+
+####
+#
+#  Compare two stats CSVs.  Returns a list of the differences found.
+#
+####
+def compareStats(path1, path2, tolerance):
+    header1, rows1 = readStats(path1)
+    header2, rows2 = readStats(path2)
+    if not header1 == header2:
+        return ["columns differ: " + ", ".join(header1) + " vs " + ", ".join(header2)]
+    if not len(rows1) == len(rows2):
+        return [str(len(rows1)) + " particles vs " + str(len(rows2))]
+    diffs = []
+    for i in range(0, len(rows1)):
+        for col in range(0, len(header1)):
+            if not isClose(rows1[i][col], rows2[i][col], tolerance):
+                diffs.append("particle " + str(i) + " " + header1[col] + ": " + str(rows1[i][col]) + " vs " + str(rows2[i][col]))
+    return diffs
+
+
+####
+#
+#  Compare the stats CSVs of two output dirs.  Returns True if they match.
+#
+####
+def main(outputDir1, outputDir2, tolerance):
+    files1 = getStatsFiles(outputDir1)
+    files2 = getStatsFiles(outputDir2)
+    match = True
+    for statsFile in sorted(set(files1) - set(files2)):
+        print statsFile + ": only in " + outputDir1
+        match = False
+    for statsFile in sorted(set(files2) - set(files1)):
+        print statsFile + ": only in " + outputDir2
+        match = False
+
+    commonFiles = sorted(set(files1) & set(files2))
+    for statsFile in commonFiles:
+        diffs = compareStats(os.path.join(outputDir1, statsFile), os.path.join(outputDir2, statsFile), tolerance)
+        for diff in diffs:
+            print statsFile + ": " + diff
+        if diffs:
+            match = False
+    print "Compared " + str(len(commonFiles)) + " stats files"
+    return match
+
+
+argc = len(sys.argv) - 1
+if argc < 2 or argc > 3:
+    print "Expected 2 or 3 arguments, received " + str(argc) + "!"
+    printUsage()
+    quit(1)
+
+tolerance = DEFAULT_TOLERANCE
+if argc == 3:
+    tolerance = float(sys.argv[3])
+
+if not main(sys.argv[1], sys.argv[2], tolerance):
+    quit(1)
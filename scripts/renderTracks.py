@@ -0,0 +1,97 @@
+# Copyright (C) 2011 - 2019, Raytheon BBN Technologies and contributors listed
+# in the AUTHORS file in TASBE Flow Analytics distribution's top directory.
+#
+# This file is part of the TASBE Flow Analytics package, and is distributed
+# under the terms of the GNU General Public License, with a linking
+# exception, as described in the file LICENSE in the TASBE Image Analysis
+# package distribution's top directory.
+
+from ij import IJ
+
+import os, glob, time, sys
+
+# I'm not certain why, but when run in ImageJ it doesn't seem to adhere to the CLASSPATH env variable
+# This ensures that CLASSPATH is explicitly on the module search path, which is required for ELMConfig to resolve
+for path in os.environ['CLASSPATH'].split(os.pathsep):
+    sys.path.append(path)
+
+import ELMConfig, ELMRender, ELMTrackModelIO
+
+#
+#
+#
+def printUsage():
+    print "This script renders the track overlay videos for the output of cellStatsTracking, from the saved"
+    print "track models and the frames they were tracked on.  It uses the same configuration ini file."
+    print "The following parameters are recognized in the [Config] section:"
+
+    print "outputDir - Dir that cellStatsTracking wrote output to. (Required)"
+    print "cropToRoi - Optional, True or False, must match the value used for tracking"
+    print "memoryMapTiff - Optional, True or False, if True read uncompressed TIFFs through a memory map"
+    print "wellNames - Optional, list of well names to render, others are ignored"
+
+    print "Usage: "
+    print "<cfgPath>"
+
+
+
+####
+#
+#  Render every saved track model in the output dir
+#
+####
+def main(cfg):
+    outputDir = cfg.getValue(ELMConfig.outputDir)
+    # Each channel has a compressed track model, a TrackMate XML one, or both
+    channels = set()
+    for suffix in [ELMTrackModelIO.TRACK_MODEL_SUFFIX, "_trackModel.xml"]:
+        for modelPath in glob.glob(os.path.join(outputDir, "*", "*" + suffix)):
+            channels.add((os.path.dirname(modelPath), os.path.basename(modelPath)[:-len(suffix)]))
+
+    for wellPath, chanName in sorted(channels):
+        wellName = os.path.basename(wellPath)
+        if cfg.getValue(ELMConfig.wellNames) and not wellName in cfg.getValue(ELMConfig.wellNames):
+            continue
+        print "Rendering well " + wellName + ", channel " + chanName + "..."
+        ELMRender.renderTrackOverlay(cfg, wellPath, chanName)
+
+
+
+####
+#
+#
+####
+# Checking for __main__ will cause running from ImageJ to fail
+#if __name__ == "__main__":
+
+#@String cfgPath
+
+# Check to see if cfgPath is defined
+# They could be defined if running from ImageJ directly
+try:
+    cfgPath
+    imageJ = True
+except NameError:
+    imageJ = False
+    argc = len(sys.argv) - 1
+    if not argc == 1:
+        print "Expected 1 argument, received " + str(argc) + "!"
+        printUsage()
+        quit(1)
+    cfgPath = sys.argv[1]
+
+# Load the configuration file
+cfg = ELMConfig.ConfigParams()
+rv = cfg.loadConfig(cfgPath)
+if not rv:
+    quit(1)
+
+start = time.time()
+main(cfg)
+end = time.time()
+
+print("Rendered all tracks in " + str((end - start) / 60) + "m ("  + str(end - start) + "s)")
+if imageJ:
+    IJ.run("Quit")
+else:
+    exit(0)